@@ -13,12 +13,13 @@ __all__ = [ "FastaRecord",
             "splitFastaHeader"]
 
 from .base import ReaderBase, WriterBase
-from ._utils import splitFileContents
+from ._utils import splitFastaRecords
 from pbcore import sequence
 from pbcore.util.decorators import deprecated
 
-import mmap, numpy as np, re
+import mmap, numpy as np, re, struct
 from collections import namedtuple, OrderedDict, Sequence
+from itertools import izip, islice
 from os.path import abspath, expanduser, isfile, getsize
 
 
@@ -183,15 +184,39 @@ class FastaReader(ReaderBase):
     """
     DELIMITER = ">"
 
-    def __iter__(self):
+    def _records(self):
         try:
-            parts = splitFileContents(self.file, ">")
-            assert "" == next(parts)
-            for part in parts:
-                yield FastaRecord.fromString(">" + part)
-        except AssertionError:
+            for records in splitFastaRecords(self.file):
+                yield records
+        except ValueError:
             raise ValueError("Invalid FASTA file {f}".format(f=self.filename))
 
+    def __iter__(self):
+        for records in self._records():
+            for header, sequence in records:
+                yield FastaRecord(header, sequence)
+
+    def batches(self, size=1024):
+        """
+        Iterate over the file in lists of up to `size` (header,
+        sequence) tuples, skipping FastaRecord construction entirely.
+        This is the fast path for bulk consumers::
+
+            >>> from pbcore.io import FastaReader
+            >>> from pbcore import data
+            >>> with FastaReader(data.getTinyFasta()) as r:
+            ...     [len(batch) for batch in r.batches(3)]
+            [3, 1]
+        """
+        pending = []
+        for records in self._records():
+            pending.extend(records)
+            while len(pending) >= size:
+                yield pending[:size]
+                pending = pending[size:]
+        if pending:
+            yield pending
+
 
 class FastaWriter(WriterBase):
     """
@@ -230,6 +255,57 @@ class FastaWriter(WriterBase):
         self.file.write(str(record))
         self.file.write("\n")
 
+    def writeRecords(self, records, size=4096):
+        """
+        Write an iterable of FASTA records, given either as
+        ``FastaRecord`` objects or as (header, sequence) tuples.  The
+        records are formatted `size` at a time into the output buffer,
+        which is written out in large chunks.
+        """
+        records = iter(records)
+        while True:
+            batch = [record if isinstance(record, tuple) else
+                     (record.header, record.sequence)
+                     for record in islice(records, size)]
+            if not batch:
+                break
+            self._writeBatch(batch)
+        self.flush()
+
+    def writeBatch(self, batch):
+        """
+        Write a list of (header, sequence) tuples, as produced by
+        ``FastaReader.batches``::
+
+            >>> from StringIO import StringIO
+            >>> from pbcore.io import FastaWriter
+            >>> f = StringIO()
+            >>> FastaWriter(f).writeBatch([("dog", "GATTACA"), ("cat", "")])
+            >>> f.getvalue()
+            '>dog\\nGATTACA\\n>cat\\n\\n'
+        """
+        self._writeBatch(batch)
+        self.flush()
+
+    def _writeBatch(self, batch):
+        columns = FastaRecord.COLUMNS
+        headers = [header for header, _ in batch]
+        sequences = [sequence if isinstance(sequence, str) else str(sequence)
+                     for _, sequence in batch]
+        # validate all of the records at once, as FastaRecord would:
+        allSequence = "".join(sequences)
+        if ("\n" in "".join(headers) or "\n" in allSequence or
+                FastaRecord.DELIMITER in allSequence):
+            raise ValueError("Invalid FASTA record data")
+        del allSequence
+        parts = []
+        for header, sequence in izip(headers, sequences):
+            if len(sequence) > columns:
+                sequence = "\n".join([sequence[i:i + columns] for i in
+                                      xrange(0, len(sequence), columns)])
+            parts.extend((">", header, "\n", sequence, "\n"))
+        self._bufferWrite("".join(parts))
+
 
 ##
 ## Utility functions for FastaReader
@@ -244,11 +320,162 @@ def wrap(s, columns):
 # IndexedFastaReader: random access Fasta class
 #
 
-FaiRecord = namedtuple("FaiRecord", ("id", "comment", "header", "length", "offset", "lineWidth", "stride"))
-
 def faiFilename(fastaFilename):
     return fastaFilename + ".fai"
 
+def writeFastaIndex(fastaFilename, faidxFilename=None):
+    """
+    Write a samtools-compatible FASTA index (.fai) for an uncompressed
+    FASTA file in a single streaming pass, returning the index filename.
+
+    As with `samtools faidx`, every line of a sequence but the last
+    must have the same width, and sequences with no bases are left out
+    of the index.  A ValueError is raised (and no index written) if the
+    line widths are inconsistent, as offsets computed from the index
+    would be wrong.
+    """
+    if faidxFilename is None:
+        faidxFilename = faiFilename(fastaFilename)
+    entries = []
+    name = None
+    pos = offset = length = lineWidth = stride = 0
+    lastLine = False
+    with open(fastaFilename, "rb") as f:
+        for line in f:
+            lineBytes = len(line)
+            if line[0] == ">":
+                if name is not None and length:
+                    entries.append("%s\t%d\t%d\t%d\t%d\n" % (
+                        name, length, offset, lineWidth, stride))
+                name = splitFastaHeader(line[1:].rstrip("\r\n"))[0]
+                offset = pos + lineBytes
+                length = lineWidth = stride = 0
+                lastLine = False
+            else:
+                bases = len(line.rstrip("\r\n"))
+                if line[-1] != "\n":
+                    # An unterminated final line is assumed to have
+                    # the usual newline
+                    lineBytes = bases + (stride - lineWidth or 1)
+                if bases == 0:
+                    lastLine = True
+                elif name is None or lastLine:
+                    raise ValueError(
+                        "Inconsistent line width in FASTA sequence {n} "
+                        "of {f}".format(n=name, f=fastaFilename))
+                elif stride == 0:
+                    lineWidth, stride = bases, lineBytes
+                elif bases < lineWidth or (bases == lineWidth and
+                                           lineBytes < stride):
+                    lastLine = True
+                elif bases != lineWidth or lineBytes != stride:
+                    raise ValueError(
+                        "Inconsistent line width in FASTA sequence {n} "
+                        "of {f}".format(n=name, f=fastaFilename))
+                length += bases
+            pos += len(line)
+    if name is not None and length:
+        entries.append("%s\t%d\t%d\t%d\t%d\n" % (
+            name, length, offset, lineWidth, stride))
+    with open(faidxFilename, "w") as out:
+        out.writelines(entries)
+    return faidxFilename
+
+def _readFastaHeader(fastaView, offset, delimiter=">"):
+    """
+    Read the header line ending just before the sequence at `offset`
+    """
+    start = fastaView.rfind("\n", 0, offset - 1) + 1
+    header_ = fastaView[start:offset]
+    assert (header_[0] == delimiter and header_[-1] == "\n")
+    return header_[1:].rstrip("\r\n")
+
+FaiRecord = namedtuple("FaiRecord", ("id", "comment", "header", "length", "offset", "lineWidth", "stride"))
+
+class FastaIndex(Sequence):
+    """
+    The contents of a .fai file held as NumPy columns (`lengths`,
+    `offsets`, `lineWidths`, `strides`) plus a list of `ids`.  Indexing
+    yields FaiRecord objects, for which the full header of that contig
+    is read from the FASTA (and cached); opening an index never touches
+    the FASTA itself.
+    """
+    DELIMITER = ">"
+
+    def __init__(self, ids, lengths, offsets, lineWidths, strides,
+                 fastaView=None):
+        self.ids = ids
+        self.lengths = lengths
+        self.offsets = offsets
+        self.lineWidths = lineWidths
+        self.strides = strides
+        self.fastaView = fastaView
+        self._headers = {}
+        self._idLookup = None
+
+    def header(self, pos):
+        header = self._headers.get(pos)
+        if header is None:
+            header = _readFastaHeader(self.fastaView, int(self.offsets[pos]),
+                                      self.DELIMITER)
+            self._headers[pos] = header
+        return header
+
+    def find(self, key):
+        """
+        The position of the contig with id or full header `key`, or None
+        """
+        if self._idLookup is None:
+            self._idLookup = dict(izip(self.ids, xrange(len(self.ids))))
+        pos = self._idLookup.get(key)
+        if pos is not None:
+            return pos
+        id_ = splitFastaHeader(key)[0]
+        pos = self._idLookup.get(id_)
+        if pos is None:
+            return None
+        if self.header(pos) == key:
+            return pos
+        # duplicate ids: fall back to checking each of them
+        for pos, other in enumerate(self.ids):
+            if other == id_ and self.header(pos) == key:
+                return pos
+        return None
+
+    def toRecArray(self, headers=True):
+        """
+        All entries as a record array, including the (now read) headers
+        and comments unless headers=False, in which case only the .fai
+        columns are used and the FASTA file is left untouched
+        """
+        arrays = [np.array(self.ids, dtype='O')]
+        dtype = [('id', 'O')]
+        if headers:
+            heads = [self.header(i) for i in xrange(len(self))]
+            comments = [splitFastaHeader(h)[1] for h in heads]
+            arrays.extend([np.array(comments, dtype='O'),
+                           np.array(heads, dtype='O')])
+            dtype.extend([('comment', 'O'), ('header', 'O')])
+        arrays.extend([self.lengths, self.offsets, self.lineWidths,
+                       self.strides])
+        dtype.extend([('length', '<i8'), ('offset', '<i8'),
+                      ('lineWidth', '<i8'), ('stride', '<i8')])
+        return np.rec.fromarrays(arrays, dtype=dtype)
+
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += len(self)
+        if not 0 <= pos < len(self):
+            raise IndexError("FASTA index position out of range")
+        header = self.header(pos)
+        id_, comment = splitFastaHeader(header)
+        return FaiRecord(id_, comment, header, int(self.lengths[pos]),
+                         int(self.offsets[pos]), int(self.lineWidths[pos]),
+                         int(self.strides[pos]))
+
+    def __len__(self):
+        return len(self.ids)
+
 def loadFastaIndex(faidxFilename, fastaView):
 
     if not isfile(faidxFilename): # os.path.isfile
@@ -256,31 +483,135 @@ def loadFastaIndex(faidxFilename, fastaView):
                       "malformatted! Use 'samtools faidx' to generate FASTA "
                       "index.")
 
-    tbl = []
-    # NB: We have to look back in the FASTA to find the full header;
-    # only "id" makes it into the fai.
-    offsetEnd = 0
-    for line in open(faidxFilename):
-        length, offset, lineWidth, blen = map(int, line.split()[-4:])
-        newlineWidth = blen - lineWidth                                # 2 for DOS, 1 for UNIX
-        header_    = fastaView[offsetEnd:offset]
-        assert (header_[0] == ">" and header_[-1] == "\n")
-        # used to use 1:-newlineWidth here, but when DOS encoded
-        # and single-line, single-entry FASTA, sometimes newlineWidth = 0
-        header     = header_[1:].rstrip('\r\n')
-        id, comment = splitFastaHeader(header)
-        q, r = divmod(length, lineWidth)
-        numNewlines = q + (r > 0)
-        offsetEnd = offset + length + numNewlines*newlineWidth
-        record = FaiRecord(id, comment, header, length, offset, lineWidth, blen)
-        tbl.append(record)
-    return tbl
+    with open(faidxFilename) as f:
+        fields = f.read().split()
+    if len(fields) % 5:
+        raise IOError("Malformatted FASTA index (.fai) file "
+                      "{f}".format(f=faidxFilename))
+    ids = fields[0::5]
+    del fields[0::5]
+    columns = np.array(map(int, fields), dtype=np.int64).reshape(-1, 4)
+    return FastaIndex(ids, columns[:, 0].copy(), columns[:, 1].copy(),
+                      columns[:, 2].copy(), columns[:, 3].copy(), fastaView)
+
+def gziFilename(fastaFilename):
+    return fastaFilename + ".gzi"
+
+def _loadBgzfBlockMap(fastaFilename, handle):
+    """
+    The compressed and uncompressed start offsets of the BGZF blocks of
+    a bgzip-compressed FASTA, read from the companion .gzi (as written
+    by `bgzip -i` or `samtools faidx`) or, failing that, by walking the
+    block headers and trailers (no decompression needed).
+    """
+    gzi = gziFilename(fastaFilename)
+    if isfile(gzi):
+        raw = np.fromfile(gzi, dtype="<u8")
+        pairs = raw[1:1 + 2 * int(raw[0])].reshape(-1, 2).astype(np.int64)
+        # the first block (at 0, 0) is implicit in the .gzi
+        return (np.concatenate([[0], pairs[:, 0]]),
+                np.concatenate([[0], pairs[:, 1]]))
+    cOffsets, uOffsets = [], []
+    cOffset = uOffset = 0
+    while True:
+        handle.seek(cOffset)
+        header = handle.read(18)
+        if len(header) < 18:
+            break
+        if header[:4] != "\x1f\x8b\x08\x04" or header[12:14] != "BC":
+            raise IOError("{f} is not BGZF-compressed, use bgzip to allow "
+                          "random access".format(f=fastaFilename))
+        blockSize = struct.unpack("<H", header[16:18])[0] + 1
+        handle.seek(cOffset + blockSize - 4)
+        dataSize = struct.unpack("<I", handle.read(4))[0]
+        if dataSize:
+            cOffsets.append(cOffset)
+            uOffsets.append(uOffset)
+        cOffset += blockSize
+        uOffset += dataSize
+    return (np.array(cOffsets, dtype=np.int64),
+            np.array(uOffsets, dtype=np.int64))
+
+class BgzfFastaView(object):
+    """
+    A read-only view of the uncompressed contents of a bgzip-compressed
+    FASTA, supporting the slicing and `rfind` that are used on the mmap
+    of an uncompressed FASTA.  Uncompressed (fai) offsets are mapped to
+    BGZF blocks through the block map, and decompressed blocks are kept
+    in an LRU cache of `maxCachedBlocks` (of <= 64KB each).
+    """
+    def __init__(self, fastaFilename, handle, maxCachedBlocks=128):
+        self.handle = handle
+        self.maxCachedBlocks = maxCachedBlocks
+        self.cOffsets, self.uOffsets = _loadBgzfBlockMap(fastaFilename,
+                                                         handle)
+        self._blocks = OrderedDict()
+        self._size = None
+
+    def _block(self, i):
+        data = self._blocks.pop(i, None)
+        if data is None:
+            # (pbcore.io.align imports this module)
+            from .align._bgzf import _load_bgzf_block
+            self.handle.seek(self.cOffsets[i])
+            _, data = _load_bgzf_block(self.handle)
+            if len(self._blocks) >= self.maxCachedBlocks:
+                self._blocks.popitem(last=False)
+        self._blocks[i] = data
+        return data
+
+    def __len__(self):
+        if self._size is None:
+            if len(self.uOffsets):
+                last = len(self.uOffsets) - 1
+                self._size = int(self.uOffsets[last]) + len(self._block(last))
+            else:
+                self._size = 0
+        return self._size
+
+    def __getitem__(self, spec):
+        if isinstance(spec, slice):
+            start, stop, _ = spec.indices(len(self))
+        else:
+            start, stop = spec, spec + 1
+        pieces = []
+        i = int(np.searchsorted(self.uOffsets, start, side="right")) - 1
+        pos = start
+        while pos < stop and 0 <= i < len(self.uOffsets):
+            data = self._block(i)
+            within = pos - int(self.uOffsets[i])
+            piece = data[within:within + stop - pos]
+            if not piece:
+                break
+            pieces.append(piece)
+            pos += len(piece)
+            i += 1
+        return "".join(pieces)
+
+    def rfind(self, sub, start=0, end=None):
+        if end is None:
+            end = len(self)
+        window = 4096
+        while True:
+            lo = max(start, end - window)
+            found = self[lo:end].rfind(sub)
+            if found >= 0:
+                return lo + found
+            if lo == start:
+                return -1
+            window *= 4
+
+    def close(self):
+        self._blocks.clear()
 
 def fileOffset(faiRecord, pos):
     """
     Find the in-file position (in bytes) corresponding to the position
     in the named contig, using the FASTA index.
     """
+    if not faiRecord.lineWidth:
+        # empty sequence
+        return faiRecord.offset
     q, r = divmod(pos, faiRecord.lineWidth)
     offset = faiRecord.offset + q*faiRecord.stride + r
     return offset
@@ -288,7 +619,7 @@ def fileOffset(faiRecord, pos):
 class MmappedFastaSequence(Sequence):
     """
     A string-like view of a contig sequence that is backed by a file
-    using mmap.
+    using mmap (or a BgzfFastaView for bgzip-compressed files).
     """
     def __init__(self, view, faiRecord):
         self.view = view
@@ -325,13 +656,226 @@ class MmappedFastaSequence(Sequence):
         return str(self[:])
 
 
+# 2-bit codes for the packed reference store
+_PACKED_LETTERS = np.frombuffer("ACGT", dtype=np.uint8)
+_PACKED_CODES = np.full(256, 255, dtype=np.uint8)
+_PACKED_CODES[_PACKED_LETTERS] = np.arange(4, dtype=np.uint8)
+_PACKED_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+# each packed byte decoded to its four letters (and to their reverse
+# complement), as one uint32 so that decoding is a single `take`
+_PACKED_WORDS = np.ascontiguousarray(_PACKED_LETTERS[
+    (np.arange(256, dtype=np.uint8)[:, np.newaxis] >> _PACKED_SHIFTS) & 3
+]).view(np.uint32).ravel()
+_PACKED_RC_WORDS = np.ascontiguousarray(_PACKED_LETTERS[
+    3 - ((np.arange(256, dtype=np.uint8)[:, np.newaxis] >>
+          _PACKED_SHIFTS[::-1]) & 3)]).view(np.uint32).ravel()
+_COMPLEMENT = np.frombuffer(sequence.DNA_COMPLEMENT, dtype=np.uint8)
+
+def _runs(mask, values=None):
+    """
+    The [start, end) runs of True in a boolean array, further split
+    wherever `values` changes
+    """
+    edges = np.diff(np.concatenate([[0], mask.view(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if values is not None and len(starts):
+        changes = np.flatnonzero(mask[1:] & mask[:-1] &
+                                 (values[1:] != values[:-1])) + 1
+        starts = np.union1d(starts, changes)
+        ends = np.union1d(ends, changes)
+    return starts, ends
+
+class PackedFastaStore(object):
+    """
+    An in-memory copy of every contig of a FASTA, held as 2-bit codes
+    (A, C, G, T; four bases per byte, each contig starting on a byte
+    boundary) in the single read-only array `bases`.  Anything else
+    (N and the other IUPAC codes) is kept as sparse runs of exceptions,
+    and soft-masking as sparse runs of lowercase.  Slices are decoded
+    (and reverse-complemented) with vectorized table lookups.
+
+    All state is held in a few NumPy arrays, so forked workers share
+    the store without copying, and `save`/`load` let unrelated
+    processes map the same read-only `bases` from disk.
+    """
+    _ARRAYS = ("bases", "byteOffsets", "lengths",
+               "excOffsets", "excStarts", "excEnds", "excChars",
+               "lowerOffsets", "lowerStarts", "lowerEnds")
+
+    def __init__(self, **arrays):
+        for name in self._ARRAYS:
+            setattr(self, name, arrays[name])
+        self.bases.flags.writeable = False
+
+    @classmethod
+    def fromFasta(cls, view, fai):
+        """
+        Pack each contig of an indexed FASTA (its view and FastaIndex)
+        """
+        lengths = np.asarray(fai.lengths, dtype=np.int64)
+        byteOffsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum((lengths + 3) // 4, out=byteOffsets[1:])
+        bases = np.zeros(byteOffsets[-1], dtype=np.uint8)
+        exc, lower = [[], [], []], [[], []]
+        excOffsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        lowerOffsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        for i in xrange(len(lengths)):
+            seq = np.frombuffer(str(MmappedFastaSequence(view, fai[i])[:]),
+                                dtype=np.uint8)
+            isLower = (seq >= ord("a")) & (seq <= ord("z"))
+            seq = np.where(isLower, seq - 32, seq).astype(np.uint8)
+            codes = _PACKED_CODES[seq]
+            isExc = codes == 255
+            starts, ends = _runs(isExc, seq)
+            exc[0].append(starts)
+            exc[1].append(ends)
+            exc[2].append(seq[starts])
+            excOffsets[i + 1] = excOffsets[i] + len(starts)
+            starts, ends = _runs(isLower)
+            lower[0].append(starts)
+            lower[1].append(ends)
+            lowerOffsets[i + 1] = lowerOffsets[i] + len(starts)
+            codes[isExc] = 0
+            padded = np.zeros(byteOffsets[i + 1] * 4 - byteOffsets[i] * 4,
+                              dtype=np.uint8)
+            padded[:len(codes)] = codes
+            bases[byteOffsets[i]:byteOffsets[i + 1]] = np.bitwise_or.reduce(
+                padded.reshape(-1, 4) << _PACKED_SHIFTS, axis=1)
+        concat = lambda parts, dtype: (np.concatenate(parts).astype(dtype)
+                                       if parts else np.array([], dtype))
+        return cls(bases=bases, byteOffsets=byteOffsets, lengths=lengths,
+                   excOffsets=excOffsets,
+                   excStarts=concat(exc[0], np.int64),
+                   excEnds=concat(exc[1], np.int64),
+                   excChars=concat(exc[2], np.uint8),
+                   lowerOffsets=lowerOffsets,
+                   lowerStarts=concat(lower[0], np.int64),
+                   lowerEnds=concat(lower[1], np.int64))
+
+    def save(self, prefix):
+        """
+        Write the store as `prefix`.bases.npy (mappable) and
+        `prefix`.tables.npz
+        """
+        np.save(prefix + ".bases.npy", self.bases)
+        np.savez(prefix + ".tables.npz",
+                 **{name: getattr(self, name) for name in self._ARRAYS[1:]})
+
+    @classmethod
+    def load(cls, prefix):
+        """
+        Open a saved store, mapping (not reading) its bases read-only
+        """
+        tables = np.load(prefix + ".tables.npz")
+        arrays = {name: tables[name] for name in cls._ARRAYS[1:]}
+        arrays["bases"] = np.load(prefix + ".bases.npy", mmap_mode="r")
+        return cls(**arrays)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def decode(self, contig, start, end, reverseComplement=False):
+        """
+        Bases [start, end) of contig number `contig`, optionally
+        reverse-complemented, as a string
+        """
+        if end <= start:
+            return ""
+        first, last = start // 4, (end + 3) // 4
+        byteOffset = int(self.byteOffsets[contig])
+        packed = self.bases[byteOffset + first:byteOffset + last]
+        if reverseComplement:
+            seq = _PACKED_RC_WORDS.take(packed[::-1]).tostring()
+            seq = seq[last * 4 - end:last * 4 - start]
+        else:
+            seq = _PACKED_WORDS.take(packed).tostring()
+            seq = seq[start - first * 4:end - first * 4]
+        out = None
+        for offsets, starts, ends, chars in (
+                (self.excOffsets, self.excStarts, self.excEnds, self.excChars),
+                (self.lowerOffsets, self.lowerStarts, self.lowerEnds, None)):
+            lo, hi = int(offsets[contig]), int(offsets[contig + 1])
+            if lo == hi:
+                continue
+            # runs are sorted and disjoint; find those overlapping
+            i = lo + int(np.searchsorted(ends[lo:hi], start, side="right"))
+            j = lo + int(np.searchsorted(starts[lo:hi], end, side="left"))
+            if i < j and out is None:
+                out = np.frombuffer(seq, dtype=np.uint8).copy()
+            for k in xrange(i, j):
+                a = max(int(starts[k]), start) - start
+                b = min(int(ends[k]), end) - start
+                if reverseComplement:
+                    a, b = end - start - b, end - start - a
+                if chars is None:
+                    out[a:b] |= 0x20
+                elif reverseComplement:
+                    out[a:b] = _COMPLEMENT[chars[k]]
+                else:
+                    out[a:b] = chars[k]
+        if out is not None:
+            return out.tostring()
+        return seq
+
+class PackedFastaSequence(Sequence):
+    """
+    A string-like view of a contig sequence decoded on demand from a
+    PackedFastaStore.
+    """
+    def __init__(self, store, contig):
+        self.store = store
+        self.contig = contig
+        self._length = int(store.lengths[contig])
+
+    def __getitem__(self, spec):
+        if isinstance(spec, slice):
+            start, stop, stride = spec.indices(len(self))
+            if stride != 1:
+                raise ValueError("Unsupported stride")
+        elif spec < 0:
+            start = len(self) + spec
+            stop = start + 1
+        else:
+            start = spec
+            stop = start + 1
+        if not (0 <= start <= stop <= len(self)):
+            raise IndexError("Out of bounds")
+        return self.store.decode(self.contig, start, stop)
+
+    def reverseComplement(self, start=0, stop=None):
+        """
+        The reverse complement of bases [start, stop)
+        """
+        if stop is None:
+            stop = len(self)
+        if not (0 <= start <= stop <= len(self)):
+            raise IndexError("Out of bounds")
+        return self.store.decode(self.contig, start, stop,
+                                 reverseComplement=True)
+
+    def __len__(self):
+        return self._length
+
+    def __eq__(self, other):
+        return (isinstance(other, (MmappedFastaSequence,
+                                   PackedFastaSequence)) and
+                self[:] == other[:])
+
+    def __str__(self):
+        return str(self[:])
+
+
 class IndexedFastaRecord(object):
 
     COLUMNS   = 60
 
-    def __init__(self, view, faiRecord):
+    def __init__(self, view, faiRecord, packedStore=None, pos=None):
         self.view = view
         self.faiRecord = faiRecord
+        self.packedStore = packedStore
+        # (the position in the index, for the packed store)
+        self.pos = pos
 
     @property
     def name(self):
@@ -351,6 +895,8 @@ class IndexedFastaRecord(object):
 
     @property
     def sequence(self):
+        if self.packedStore is not None:
+            return PackedFastaSequence(self.packedStore, self.pos)
         return MmappedFastaSequence(self.view, self.faiRecord)
 
     @property
@@ -383,7 +929,9 @@ class IndexedFastaReader(ReaderBase, Sequence):
 
     Requires that the lines of the FASTA file be fixed-length and that
     there is a FASTA index file (generated by `samtools faidx`) with
-    name `fastaFilename.fai` in the same directory.
+    name `fastaFilename.fai` in the same directory.  A FASTA ending in
+    ".gz" must be bgzip-compressed; its `fastaFilename.gzi` block index
+    is used when present.
 
     .. doctest::
 
@@ -399,40 +947,62 @@ class IndexedFastaReader(ReaderBase, Sequence):
          <IndexedFastaRecord: ref000004|EGFR_Exon_5>]
         >>> t.close()
 
+    With `packed=True` every contig is read up front into a
+    PackedFastaStore (about a quarter of the FASTA size) and sequences
+    are served from it, which is much faster for many random windows;
+    an existing (e.g. loaded or shared) store can be passed instead.
+
+    .. doctest::
+
+        >>> t = IndexedFastaReader(filename, packed=True)
+        >>> seq = t["ref000001|EGFR_Exon_2"].sequence
+        >>> seq[0:10], seq.reverseComplement(0, 10)
+        ('TTTCTTCCAG', 'CTGGAAGAAA')
+        >>> t.close()
+
     """
-    def __init__(self, filename):
+    def __init__(self, filename, packed=False):
         self.filename = abspath(expanduser(filename))
         self.file = open(self.filename, "r")
         self.faiFilename = faiFilename(self.filename)
         if getsize(self.filename) > 0:
-            self.view = mmap.mmap(self.file.fileno(), 0,
-                                  prot=mmap.PROT_READ)
+            if self.filename.endswith(".gz"):
+                self.view = BgzfFastaView(self.filename, self.file)
+            else:
+                self.view = mmap.mmap(self.file.fileno(), 0,
+                                      prot=mmap.PROT_READ)
             self.fai = loadFastaIndex(self.faiFilename, self.view)
         else:
             self.view = None
-            self.fai = []
-        self.contigLookup = self._loadContigLookup()
+            self.fai = FastaIndex([], *[np.array([], dtype=np.int64)] * 4)
+        if isinstance(packed, PackedFastaStore):
+            if not np.array_equal(packed.lengths, self.fai.lengths):
+                raise ValueError("Packed store does not match "
+                                 "{f}".format(f=self.filename))
+            self.packedStore = packed
+        elif packed:
+            self.packedStore = PackedFastaStore.fromFasta(self.view, self.fai)
+        else:
+            self.packedStore = None
 
-    def _loadContigLookup(self):
-        contigLookup = dict()
-        for (pos, faiRecord) in enumerate(self.fai):
-            contigLookup[pos]              = faiRecord
-            contigLookup[faiRecord.id]     = faiRecord
-            contigLookup[faiRecord.header] = faiRecord
-        return contigLookup
+    def _record(self, pos):
+        if pos < 0:
+            pos += len(self)
+        return IndexedFastaRecord(self.view, self.fai[pos], self.packedStore,
+                                  pos)
 
     def __getitem__(self, key):
-        if key < 0:
-            key = len(self) + key
-
         if isinstance(key, slice):
             indices = xrange(*key.indices(len(self)))
-            return [ IndexedFastaRecord(self.view, self.contigLookup[i])
-                     for i in indices ]
-        elif key in self.contigLookup:
-            return IndexedFastaRecord(self.view, self.contigLookup[key])
-        else:
-            raise IndexError("Contig not in FastaTable")
+            return [ self._record(i) for i in indices ]
+        elif isinstance(key, (int, long, np.integer)):
+            if -len(self) <= key < len(self):
+                return self._record(key)
+        elif isinstance(key, basestring):
+            pos = self.fai.find(key)
+            if pos is not None:
+                return self._record(pos)
+        raise IndexError("Contig not in FastaTable")
 
     def __iter__(self):
         return (self[i] for i in xrange(len(self)))
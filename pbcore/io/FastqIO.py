@@ -6,13 +6,20 @@ I/O support for FASTQ files
 from __future__ import absolute_import
 
 __all__ = [ "FastqRecord",
+            "FastqBatch",
             "FastqReader",
+            "IndexedFastqReader",
             "FastqWriter",
             "qvsFromAscii",
             "asciiFromQvs" ]
+import mmap
 import numpy as np
+from collections import Sequence
+from itertools import islice, imap, izip
+from os.path import abspath, expanduser, isfile, getsize
 from .base import ReaderBase, WriterBase
-from .FastaIO import splitFastaHeader
+from .FastaIO import (splitFastaHeader, faiFilename, FastaIndex,
+                      MmappedFastaSequence)
 from pbcore import sequence
 from pbcore.util.decorators import deprecated
 
@@ -42,11 +49,13 @@ class FastqRecord(object):
 
             # Only one of quality, qualityString should be provided
             assert (quality is None) != (qualityString is None)
+            # A quality string is decoded lazily, on first access
+            self._quality = quality
+            self._qualityString = qualityString
             if quality is not None:
-                self._quality = quality
+                assert len(self.sequence) == len(self.quality)
             else:
-                self._quality = qvsFromAscii(qualityString)
-            assert len(self.sequence) == len(self.quality)
+                assert len(self.sequence) == len(qualityString)
         except AssertionError:
             raise ValueError("Invalid FASTQ record data")
 
@@ -100,6 +109,8 @@ class FastqRecord(object):
         """
         The quality values, as an array of integers
         """
+        if self._quality is None:
+            self._quality = qvsFromAscii(self._qualityString)
         return self._quality
 
     @property
@@ -107,6 +118,10 @@ class FastqRecord(object):
         """
         The quality values as an ASCII-encoded string
         """
+        # the read string only stands in until the QVs are decoded, as
+        # those may be modified in place
+        if self._quality is None:
+            return self._qualityString
         return asciiFromQvs(self._quality)
 
     @classmethod
@@ -181,6 +196,272 @@ class FastqReader(ReaderBase):
                               lines[1][:-1],
                               qualityString=lines[3][:-1])
 
+    def batches(self, n=4096):
+        """
+        Iterate over the file in FastqBatch objects of up to `n`
+        records each.  No per-record objects or quality arrays are
+        created, which makes this the fast path for bulk statistics::
+
+            >>> from StringIO import StringIO
+            >>> from pbcore.io import FastqReader
+            >>> f = StringIO("@r1\\nACGT\\n+\\n+5?I\\n@r2\\nGG\\n+\\n!!\\n")
+            >>> batch = next(FastqReader(f).batches())
+            >>> batch.headers, batch.lengths.tolist(), batch.quality(0).tolist()
+            (['r1', 'r2'], [4, 2], [10, 20, 30, 40])
+        """
+        while True:
+            lines = list(islice(self.file, 4 * n))
+            if not lines:
+                break
+            if len(lines) % 4 != 0:
+                raise ValueError("Truncated FASTQ file")
+            try:
+                assert all(l[0] == FastqRecord.DELIMITER1 for l in lines[0::4])
+                assert all(l[0] == FastqRecord.DELIMITER2 for l in lines[2::4])
+            except (AssertionError, IndexError):
+                raise ValueError("Invalid FASTQ record data")
+            headers = [l[1:].rstrip("\r\n") for l in lines[0::4]]
+            sequences = [l.rstrip("\r\n") for l in lines[1::4]]
+            qualities = [l.rstrip("\r\n") for l in lines[3::4]]
+            lengths = np.fromiter(imap(len, sequences), dtype=np.int64,
+                                  count=len(sequences))
+            qvLengths = np.fromiter(imap(len, qualities), dtype=np.int64,
+                                    count=len(qualities))
+            if not np.array_equal(lengths, qvLengths):
+                raise ValueError("Invalid FASTQ record data")
+            offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            yield FastqBatch(headers, "".join(sequences),
+                             qvsFromAscii("".join(qualities)), offsets)
+
+
+class FastqBatch(object):
+    """
+    A columnar block of FASTQ records: a list of headers, a single
+    concatenated sequence string, a single concatenated uint8 array of
+    quality values, and an offsets array such that record i occupies
+    [offsets[i], offsets[i+1]) in both buffers.
+    """
+    __slots__ = ("headers", "sequences", "qualities", "offsets")
+
+    def __init__(self, headers, sequences, qualities, offsets):
+        self.headers = headers
+        self.sequences = sequences
+        self.qualities = qualities
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.headers)
+
+    @property
+    def lengths(self):
+        """
+        The length of each record
+        """
+        return np.diff(self.offsets)
+
+    def meanQvs(self):
+        """
+        The mean quality value of each record (NaN for empty records)
+        """
+        lengths = self.lengths
+        sums = np.zeros(len(lengths), dtype=np.float64)
+        nonEmpty = lengths > 0
+        if self.qualities.size:
+            sums[nonEmpty] = np.add.reduceat(
+                self.qualities.astype(np.float64),
+                self.offsets[:-1][nonEmpty])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return sums / lengths
+
+    def sequence(self, i):
+        """
+        The sequence of record i
+        """
+        return self.sequences[self.offsets[i]:self.offsets[i + 1]]
+
+    def quality(self, i):
+        """
+        The quality values of record i
+        """
+        return self.qualities[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        for i, header in enumerate(self.headers):
+            yield FastqRecord(header, self.sequence(i), self.quality(i))
+
+
+# ------------------------------------------------------------------------------
+# IndexedFastqReader: random access FASTQ class
+#
+
+def writeFastqIndex(fastqFilename, faidxFilename=None):
+    """
+    Write a FASTQ index in the layout of `samtools faidx --fastq`
+    (name, length, sequence offset, line bases, line width, quality
+    offset) for a four-line FASTQ in a single streaming pass, returning
+    the index filename.  Unlike samtools, empty reads are indexed.
+    """
+    if faidxFilename is None:
+        faidxFilename = faiFilename(fastqFilename)
+    entries = []
+    pos = 0
+    with open(fastqFilename, "rb") as f:
+        while True:
+            lines = list(islice(f, 4))
+            if not lines:
+                break
+            length = len(lines[1].rstrip("\r\n")) if len(lines) > 1 else -1
+            if (len(lines) < 4 or lines[0][0] != FastqRecord.DELIMITER1 or
+                    lines[2][0] != FastqRecord.DELIMITER2 or
+                    len(lines[3].rstrip("\r\n")) != length):
+                raise ValueError("Invalid FASTQ record at byte {p} of "
+                                 "{f}".format(p=pos, f=fastqFilename))
+            name = splitFastaHeader(lines[0][1:].rstrip("\r\n"))[0]
+            offset = pos + len(lines[0])
+            # An unterminated line is assumed to have the usual newline
+            lineWidth = (len(lines[1]) if lines[1].endswith("\n")
+                         else length + 1)
+            qualOffset = offset + len(lines[1]) + len(lines[2])
+            entries.append("%s\t%d\t%d\t%d\t%d\t%d\n" % (
+                name, length, offset, length, lineWidth, qualOffset))
+            pos += sum(len(line) for line in lines)
+    with open(faidxFilename, "w") as out:
+        out.writelines(entries)
+    return faidxFilename
+
+class FastqIndex(FastaIndex):
+    """
+    A FastaIndex over a FASTQ file, with the additional `qualOffsets`
+    column of the FASTQ flavor of .fai
+    """
+    DELIMITER = FastqRecord.DELIMITER1
+
+    def __init__(self, ids, lengths, offsets, lineWidths, strides,
+                 qualOffsets, fastqView=None):
+        super(FastqIndex, self).__init__(ids, lengths, offsets, lineWidths,
+                                         strides, fastqView)
+        self.qualOffsets = qualOffsets
+
+def loadFastqIndex(faidxFilename, fastqView):
+    if not isfile(faidxFilename):
+        raise IOError("Companion FASTQ index (.fai) file not found or "
+                      "malformatted! Use 'samtools faidx -f' to generate "
+                      "FASTQ index.")
+    with open(faidxFilename) as f:
+        fields = f.read().split()
+    if len(fields) % 6:
+        raise IOError("Malformatted FASTQ index (.fai) file "
+                      "{f}".format(f=faidxFilename))
+    ids = fields[0::6]
+    del fields[0::6]
+    columns = np.array(map(int, fields), dtype=np.int64).reshape(-1, 5)
+    return FastqIndex(ids, *([columns[:, i].copy() for i in xrange(5)] +
+                             [fastqView]))
+
+class IndexedFastqRecord(object):
+    """
+    A FASTQ record backed by the mmapped file: the sequence is a lazy
+    MmappedFastaSequence view and the quality values are only read and
+    decoded when requested.
+    """
+    def __init__(self, view, faiRecord, qualOffset):
+        self.view = view
+        self.faiRecord = faiRecord
+        self.qualOffset = qualOffset
+
+    @property
+    def name(self):
+        return self.header
+
+    @property
+    def header(self):
+        return self.faiRecord.header
+
+    @property
+    def id(self):
+        return self.faiRecord.id
+
+    @property
+    def comment(self):
+        return self.faiRecord.comment
+
+    @property
+    def sequence(self):
+        return MmappedFastaSequence(self.view, self.faiRecord)
+
+    @property
+    def qualityString(self):
+        return self.view[self.qualOffset:
+                         self.qualOffset + self.faiRecord.length]
+
+    @property
+    def quality(self):
+        return qvsFromAscii(self.qualityString)
+
+    def __len__(self):
+        return self.faiRecord.length
+
+    def __repr__(self):
+        return "<IndexedFastqRecord: %s>" % self.header
+
+    def __eq__(self, other):
+        return (isinstance(other, (IndexedFastqRecord, FastqRecord)) and
+                self.header == other.header and
+                self.sequence[:] == other.sequence[:] and
+                self.qualityString == other.qualityString)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __str__(self):
+        return "\n".join([FastqRecord.DELIMITER1 + self.header,
+                          self.sequence[:],
+                          FastqRecord.DELIMITER2,
+                          self.qualityString])
+
+class IndexedFastqReader(ReaderBase, Sequence):
+    """
+    Random-access FASTQ file reader, for four-line FASTQ files with a
+    companion index `fastqFilename.fai` (from `samtools faidx -f` or
+    `writeFastqIndex`).  Records are found by position, id or header
+    without parsing the file.
+    """
+    def __init__(self, filename):
+        self.filename = abspath(expanduser(filename))
+        self.file = open(self.filename, "r")
+        self.faiFilename = faiFilename(self.filename)
+        if getsize(self.filename) > 0:
+            self.view = mmap.mmap(self.file.fileno(), 0,
+                                  prot=mmap.PROT_READ)
+            self.fai = loadFastqIndex(self.faiFilename, self.view)
+        else:
+            self.view = None
+            self.fai = FastqIndex([], *[np.array([], dtype=np.int64)] * 5)
+
+    def _record(self, pos):
+        return IndexedFastqRecord(self.view, self.fai[pos],
+                                  int(self.fai.qualOffsets[pos]))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._record(i)
+                    for i in xrange(*key.indices(len(self)))]
+        elif isinstance(key, (int, long, np.integer)):
+            if -len(self) <= key < len(self):
+                return self._record(key)
+        elif isinstance(key, basestring):
+            pos = self.fai.find(key)
+            if pos is not None:
+                return self._record(pos)
+        raise IndexError("Read not in IndexedFastqReader")
+
+    def __iter__(self):
+        return (self[i] for i in xrange(len(self)))
+
+    def __len__(self):
+        return len(self.fai)
+
 
 class FastqWriter(WriterBase):
     """
@@ -219,6 +500,76 @@ class FastqWriter(WriterBase):
         self.file.write(str(record))
         self.file.write("\n")
 
+    def writeRecords(self, records, size=4096):
+        """
+        Write an iterable of FASTQ records, given either as
+        ``FastqRecord`` objects or as (header, sequence, quality)
+        tuples, where quality is an array of QVs or an ASCII string.
+        The records are formatted `size` at a time into the output
+        buffer, which is written out in large chunks, and the QVs of
+        each batch are encoded in one vectorized step.
+        """
+        records = iter(records)
+        while True:
+            headers, sequences, qualities = [], [], []
+            for record in islice(records, size):
+                if isinstance(record, tuple):
+                    header, sequence, quality = record
+                else:
+                    header, sequence = record.header, record.sequence
+                    # don't decode qualities just to encode them again:
+                    if (isinstance(record, FastqRecord) and
+                            record._quality is not None):
+                        quality = record.quality
+                    else:
+                        quality = record.qualityString
+                headers.append(header)
+                sequences.append(sequence)
+                qualities.append(quality)
+            if not headers:
+                break
+            self._writeBatch(headers, sequences,
+                             _encodeQualities(qualities))
+        self.flush()
+
+    def writeBatch(self, batch):
+        """
+        Write a ``FastqBatch``, as produced by ``FastqReader.batches``::
+
+            >>> from StringIO import StringIO
+            >>> import numpy as np
+            >>> from pbcore.io import FastqWriter, FastqBatch
+            >>> f = StringIO()
+            >>> batch = FastqBatch(["r1", "r2"], "ACGTGG",
+            ...                    np.array([10, 20, 30, 40, 0, 99]), [0, 4, 6])
+            >>> FastqWriter(f).writeBatch(batch)
+            >>> f.getvalue()
+            '@r1\\nACGT\\n+\\n+5?I\\n@r2\\nGG\\n+\\n!~\\n'
+        """
+        offsets = list(batch.offsets)
+        if len(offsets) != len(batch.headers) + 1:
+            raise ValueError("Invalid FASTQ record data")
+        qualityString = asciiFromQvs(batch.qualities)
+        bounds = zip(offsets[:-1], offsets[1:])
+        self._writeBatch(batch.headers,
+                         [batch.sequences[b:e] for b, e in bounds],
+                         [qualityString[b:e] for b, e in bounds])
+        self.flush()
+
+    def _writeBatch(self, headers, sequences, qualityStrings):
+        sequences = [sequence if isinstance(sequence, str) else str(sequence)
+                     for sequence in sequences]
+        # validate all of the records at once, as FastqRecord would:
+        if ("\n" in "".join(headers) or "\n" in "".join(sequences) or
+                map(len, sequences) != map(len, qualityStrings)):
+            raise ValueError("Invalid FASTQ record data")
+        parts = []
+        for header, sequence, qualityString in izip(headers, sequences,
+                                                    qualityStrings):
+            parts.extend(("@", header, "\n", sequence, "\n+\n",
+                          qualityString, "\n"))
+        self._bufferWrite("".join(parts))
+
 
 ##
 ## Utility
@@ -228,3 +579,22 @@ def qvsFromAscii(s):
 
 def asciiFromQvs(a):
     return (np.clip(a, 0, 93).astype(np.uint8) + 33).tostring()
+
+def _encodeQualities(qualities):
+    """
+    ASCII-encode a list of QV arrays (or already encoded strings), with
+    a single asciiFromQvs over the concatenated arrays
+    """
+    toEncode = [i for i, q in enumerate(qualities)
+                if not isinstance(q, basestring)]
+    if not toEncode:
+        return qualities
+    arrays = [np.asarray(qualities[i]) for i in toEncode]
+    ends = np.cumsum([len(a) for a in arrays]).tolist()
+    encoded = asciiFromQvs(np.concatenate(arrays))
+    qualities = list(qualities)
+    start = 0
+    for i, end in izip(toEncode, ends):
+        qualities[i] = encoded[start:end]
+        start = end
+    return qualities
@@ -15,6 +15,8 @@ __all__ = [ "Gff3Record",
 from .base import ReaderBase, WriterBase
 from collections import OrderedDict, defaultdict, namedtuple
 from copy import copy as shallow_copy
+from itertools import chain, islice
+import numpy as np
 import logging
 import tempfile
 import os.path
@@ -47,10 +49,14 @@ class Gff3Record(object):
         >>> record.get(fieldName, defaultValue)
 
     to fetch the field or attribute with a custom default.
+
+    Records parsed with ``lazyAttributes`` keep the raw attribute column,
+    which is only split and converted on first access to an attribute.
     """
     _GFF_COLUMNS = [ "seqid", "source", "type",
                      "start", "end", "score",
                      "strand", "phase", "attributes" ]
+    _GFF_COLUMN_SET = frozenset(_GFF_COLUMNS)
 
     def __init__(self, seqid, start, end, type,
                  score=".", strand=".", phase=".",
@@ -71,18 +77,47 @@ class Gff3Record(object):
         """
         return shallow_copy(self)
 
+    @property
+    def attributes(self):
+        if self._rawAttributes is not None:
+            try:
+                attributes = OrderedDict(
+                    map(tupleFromGffAttribute, self._rawAttributes.split(";")))
+            except ValueError:
+                raise ValueError("Could not interpret GFF attributes: %s" %
+                                 self._rawAttributes)
+            object.__setattr__(self, "_attributes", attributes)
+            object.__setattr__(self, "_rawAttributes", None)
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, value):
+        object.__setattr__(self, "_attributes", OrderedDict(value))
+        object.__setattr__(self, "_rawAttributes", None)
+
     @classmethod
-    def fromString(cls, s):
+    def fromString(cls, s, lazyAttributes=False):
         """
         Parse a string as a GFF record.
-        Trailing whitespace is ignored.
+        Trailing whitespace is ignored.  With lazyAttributes, the
+        attributes are kept as the raw string until they are first
+        accessed (and only then validated).
         """
         columns = s.rstrip().rstrip(";").split("\t")
         try:
             assert len(columns) == len(cls._GFF_COLUMNS)
-            attributes = map(tupleFromGffAttribute, columns[-1].split(";"))
             (_seqid, _source, _type, _start,
-             _end, _score, _strand, _phase)  = columns[:-1]
+             _end, _score, _strand, _phase, _attributes)  = columns
+            if lazyAttributes:
+                # skip the per-field __setattr__ dispatch as well:
+                record = cls.__new__(cls)
+                record.__dict__.update(
+                    seqid=_seqid, source=_source, type=_type,
+                    start=int(_start), end=int(_end), score=_score,
+                    strand=_strand, phase=_phase, _attributes=None,
+                    _rawAttributes=_attributes)
+                return record
+            attributes = map(tupleFromGffAttribute, _attributes.split(";"))
             return Gff3Record(_seqid, int(_start), int(_end), _type,
                               _score, _strand, _phase, _source, attributes)
         except (AssertionError, ValueError):
@@ -113,13 +148,16 @@ class Gff3Record(object):
     # not found.
     #
     def __getattr__(self, name):
+        if name in ("attributes", "_attributes", "_rawAttributes"):
+            # not initialized (yet), e.g. while copying
+            raise AttributeError(name)
         if name in self.attributes:
             return self.attributes[name]
         else:
             raise AttributeError
 
     def __setattr__(self, name, value):
-        if name in self._GFF_COLUMNS:
+        if name in self._GFF_COLUMN_SET:
             object.__setattr__(self, name, value)
         else:
             self.attributes[name] = value
@@ -154,16 +192,76 @@ class GffReader(ReaderBase):
                 break
         return headers, firstLine
 
-    def __init__(self, f):
+    def __init__(self, f, lazyAttributes=False):
+        """
+        With lazyAttributes, the records' attributes are only parsed on
+        first access, which is much faster when most are never used.
+        """
         super(GffReader, self).__init__(f)
+        self.lazyAttributes = lazyAttributes
         self.headers, self.firstLine = self._readHeaders()
 
-    def __iter__(self):
+    def _lines(self):
         if self.firstLine:
-            yield Gff3Record.fromString(self.firstLine)
+            yield self.firstLine
             self.firstLine = None
         for line in self.file:
-            yield Gff3Record.fromString(line)
+            yield line
+
+    def __iter__(self):
+        lazyAttributes = self.lazyAttributes
+        for line in self._lines():
+            yield Gff3Record.fromString(line, lazyAttributes)
+
+    def toArrays(self, chunkSize=1000000):
+        """
+        Read the (remaining) records into a record array of the nine
+        GFF columns, for vectorized filtering and sorting.  start and
+        end are int64, score is float64 (NaN for "."), and the
+        attributes are left as the raw strings::
+
+            >>> from pbcore.io import GffReader
+            >>> from pbcore import data
+            >>> recs = GffReader(data.getGff3()).toArrays()
+            >>> recs.start.tolist(), recs.type[recs.start > 30900].tolist()
+            ([30890, 30924], ['insertion'])
+        """
+        nColumns = len(Gff3Record._GFF_COLUMNS)
+        lines = self._lines()
+        chunks = []
+        while True:
+            rows = [line.rstrip().rstrip(";")
+                    for line in islice(lines, chunkSize)]
+            if not rows:
+                break
+            for row in rows:
+                if row.count("\t") != nColumns - 1:
+                    raise ValueError("Could not interpret string as a "
+                                     "Gff3Record: %s" % row)
+            # one split for the whole chunk, then stride out the columns:
+            fields = "\t".join(rows).split("\t")
+            del rows
+            columns = [fields[i::nColumns] for i in xrange(nColumns)]
+            del fields
+            scores = np.array(columns[5], dtype="O")
+            missing = scores == "."
+            score = np.full(len(scores), np.nan)
+            score[~missing] = scores[~missing].astype(np.float64)
+            chunks.append(
+                [np.array(columns[0]), np.array(columns[1]),
+                 np.array(columns[2]),
+                 np.array(columns[3], dtype=np.int64),
+                 np.array(columns[4], dtype=np.int64), score,
+                 np.array(columns[6]), np.array(columns[7]),
+                 np.array(columns[8], dtype="O")])
+        if not chunks:
+            chunks = [[np.array([], dtype=dt) for dt in
+                       ("S1", "S1", "S1", np.int64, np.int64, np.float64,
+                        "S1", "S1", "O")]]
+        # (string columns are sized to the longest value of all chunks)
+        return np.rec.fromarrays(
+            [np.concatenate(column) for column in zip(*chunks)],
+            names=Gff3Record._GFF_COLUMNS)
 
 
 class GffWriter(WriterBase):
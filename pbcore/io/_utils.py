@@ -43,6 +43,62 @@ def splitFileContents(f, delimiter, BLOCKSIZE=8192):
     yield remainder.getvalue()
 
 
+def _parseFastaWindow(window):
+    """
+    Parse a string holding complete FASTA records (starting with '>')
+    into a list of (header, sequence) tuples.
+    """
+    records = []
+    append = records.append
+    find = window.find
+    end = len(window)
+    start = 0
+    while start < end:
+        headerEnd = find("\n", start)
+        if headerEnd < 0:
+            append((window[start + 1:].rstrip("\r"), ""))
+            break
+        nextStart = find("\n>", headerEnd)
+        if nextStart < 0:
+            nextStart = end
+        append((window[start + 1:headerEnd].rstrip("\r"),
+                window[headerEnd + 1:nextStart].translate(None, "\r\n")))
+        start = nextStart + 1
+    return records
+
+
+def splitFastaRecords(f, BLOCKSIZE=4194304):
+    """
+    Parse a FASTA stream into lists of (header, sequence) tuples, one
+    list per window of (at least) BLOCKSIZE bytes.  Record boundaries
+    are located with `find` over the window and each sequence is
+    assembled with a single pass over its lines, so per-record overhead
+    is independent of the line wrapping.  A record larger than the
+    window simply grows the window until it is complete.
+
+    Raises ValueError if the stream does not start with '>'.
+    """
+    block = f.read(BLOCKSIZE)
+    if block and block[0] != ">":
+        raise ValueError("FASTA stream does not start with '>'")
+    buf = bytearray()
+    searchFrom = 0
+    while block:
+        buf += block
+        # Only the last record in the buffer may be incomplete
+        cut = buf.rfind("\n>", max(searchFrom - 1, 0))
+        if cut < 0:
+            searchFrom = len(buf)
+        else:
+            window = str(buf[:cut + 1])
+            del buf[:cut + 1]
+            searchFrom = len(buf)
+            yield _parseFastaWindow(window)
+        block = f.read(BLOCKSIZE)
+    if buf:
+        yield _parseFastaWindow(str(buf))
+
+
 
 # For reasons that are obscure to me, the recarray outer join
 # functionality in numpy's lib.recfunctions is broken as of numpy
@@ -151,7 +151,11 @@ class _BamReaderBase(ReaderBase):
             self._programTable = None
 
     def _loadReferenceFasta(self, referenceFastaFname):
-        ft = FastaTable(referenceFastaFname)
+        # an open (e.g. packed) reader can be shared between BAM readers
+        if isinstance(referenceFastaFname, FastaTable):
+            ft = referenceFastaFname
+        else:
+            ft = FastaTable(referenceFastaFname)
         # Verify that this FASTA is in agreement with the BAM's
         # reference table---BAM should be a subset.
         fastaIdsAndLens = set((c.id, len(c)) for c in ft)
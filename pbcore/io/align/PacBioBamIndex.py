@@ -160,7 +160,13 @@ class PacBioBamIndex(PbIndexBase):
             # TODO: do something with these:
             # TODO: remove nReads check when the rest of this code can handle empty
             # mapped bam files (columns are missing, flags don't reflect that)
-            if self.hasCoordinateSortedInfo and self.nReads:
+            if self.hasCoordinateSortedInfo and self.nReads and self.isChunk:
+                # This section is per-reference rather than per-record, so it
+                # can't be chunked. Step over it to the barcode columns:
+                f.seek(to_virtual_offset(self._array_start))
+                ntId = int(np.frombuffer(f.read(4), "<u4")[0])
+                self._array_start += 4 + ntId * 12
+            elif self.hasCoordinateSortedInfo and self.nReads:
                 ntId = int(peek("u4", 1))
                 for columnName, columnType in COORDINATE_SORTED_DTYPE:
                     peek(columnType, ntId)
@@ -3,6 +3,8 @@
 
 from __future__ import absolute_import
 import gzip
+import threading
+from Queue import Queue
 from os.path import abspath, expanduser
 
 __all__ = [ "ReaderBase", "WriterBase" ]
@@ -60,21 +62,94 @@ class ReaderBase(object):
     def __repr__(self):
         return "<%s for %s>" % (type(self).__name__, self.filename)
 
+class BackgroundWriter(threading.Thread):
+    """
+    A file-like wrapper handing the chunks written to it over to a
+    separate thread, so that (gzip) compression of one chunk overlaps
+    with formatting the next.  At most `maxChunks` chunks are queued.
+    """
+    def __init__(self, f, maxChunks=4):
+        super(BackgroundWriter, self).__init__()
+        self.daemon = True
+        self.file = f
+        self.name = getattr(f, "name", "(anonymous)")
+        self._queue = Queue(maxChunks)
+        self._error = None
+        self.start()
+
+    def run(self):
+        while True:
+            chunk = self._queue.get()
+            try:
+                if chunk is None:
+                    return
+                if self._error is None:
+                    self.file.write(chunk)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raiseError(self):
+        if self._error is not None:
+            raise self._error
+
+    def write(self, chunk):
+        self._raiseError()
+        self._queue.put(chunk)
+
+    def flush(self):
+        self._queue.join()
+        self._raiseError()
+        self.file.flush()
+
+    def close(self):
+        self._queue.put(None)
+        self.join()
+        self.file.close()
+        self._raiseError()
+
 class WriterBase(object):
-    def __init__(self, f):
+    # bytes of formatted records collected before each write
+    BUFFERSIZE = 4194304
+
+    def __init__(self, f, backgroundCompression=False):
         """
-        Prepare for output to the file
+        Prepare for output to the file.  With backgroundCompression,
+        output to a ".gz" file is compressed on a separate thread.
         """
         self.file = getFileHandle(f, "w")
         if hasattr(self.file, "name"):
             self.filename = self.file.name
         else:
             self.filename = "(anonymous)"
+        if (backgroundCompression and isinstance(f, basestring) and
+                self.filename.endswith(".gz")):
+            self.file = BackgroundWriter(self.file)
+        self._buffer = bytearray()
+
+    def _bufferWrite(self, s):
+        """
+        Append to the reusable output buffer, writing it out whenever it
+        fills up
+        """
+        self._buffer += s
+        if len(self._buffer) >= self.BUFFERSIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Write out any buffered output
+        """
+        if self._buffer:
+            self.file.write(str(self._buffer))
+            del self._buffer[:]
 
     def close(self):
         """
         Close the underlying file
         """
+        self.flush()
         self.file.close()
 
     def __enter__(self):
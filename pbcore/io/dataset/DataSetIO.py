@@ -17,16 +17,18 @@ import re
 import shutil
 import tempfile
 import uuid
-import xml.dom.minidom
 import numpy as np
 from urlparse import urlparse
 from functools import wraps, partial
-from collections import defaultdict, Counter
+from collections import defaultdict, Counter, OrderedDict
+from multiprocessing.pool import ThreadPool
 from pbcore.util.Process import backticks
 from pbcore.chemistry.chemistry import ChemistryLookupError
-from pbcore.io.align.PacBioBamIndex import PBI_FLAGS_BARCODE
+from pbcore.io.align.PacBioBamIndex import (PBI_FLAGS_BARCODE,
+                                             StreamingBamIndex)
 from pbcore.io.FastaIO import splitFastaHeader, FastaWriter
-from pbcore.io.FastqIO import FastqReader, FastqWriter, qvsFromAscii
+from pbcore.io.FastqIO import (FastqReader, FastqWriter, IndexedFastqReader,
+                               qvsFromAscii)
 from pbcore.io import (BaxH5Reader, FastaReader, IndexedFastaReader,
                        CmpH5Reader, IndexedBamReader, BamReader)
 from pbcore.io.align._BamSupport import UnavailableFeature
@@ -34,23 +36,30 @@ from pbcore.io.dataset.DataSetReader import (parseStats, populateDataSet,
                                              resolveLocation, xmlRootType,
                                              wrapNewResource, openFofnFile,
                                              parseMetadata, checksts)
-from pbcore.io.dataset.DataSetWriter import toXml
-from pbcore.io.dataset.DataSetValidator import validateString
+from pbcore.io.dataset.DataSetWriter import toXml, serializeXml
+from pbcore.io.dataset.DataSetValidator import (validateString,
+                                                BackgroundValidation)
 from pbcore.io.dataset.DataSetMembers import (DataSetMetadata,
                                               SubreadSetMetadata,
                                               ContigSetMetadata,
                                               BarcodeSetMetadata,
                                               ExternalResources,
-                                              ExternalResource, Filters)
+                                              ExternalResource, Filters,
+                                              StatsMetadata,
+                                              HistogramAccumulator,
+                                              _emptyMember, packZmwKeys,
+                                              _MemberOwner)
 from pbcore.io.dataset.utils import (_infixFname, _pbindexBam,
                                      _indexBam, _indexFasta, _fileCopy,
                                      _swapPath, which, consolidateXml,
-                                     getTimeStampedName, getCreatedAt)
+                                     getTimeStampedName, getCreatedAt,
+                                     _writeContigs)
 from pbcore.io.dataset.DataSetErrors import (InvalidDataSetIOError,
                                              ResourceMismatchError)
 from pbcore.io.dataset.DataSetMetaTypes import (DataSetMetaTypes, toDsId,
                                                 dsIdToSuffix)
-from pbcore.io.dataset.DataSetUtils import fileType
+from pbcore.io.dataset.DataSetUtils import (fileType, fileExists,
+                                            filesExist)
 from functools import reduce
 
 
@@ -181,6 +190,42 @@ def _stackRecArrays(recArrays):
         tbr = tbr.view(np.recarray)
         return tbr
 
+def _indexMapSegment(rrNum, rows):
+    """The _indexMap entries for the given rows of resource reader rrNum"""
+    tbr = np.empty(len(rows), dtype=[('reader', 'uint64'),
+                                     ('index', 'uint64')])
+    tbr['reader'] = rrNum
+    tbr['index'] = rows
+    return tbr
+
+def _remapIds(values, before, after):
+    """Replace (in place) the ids in 'values' that have changed between two
+    name: id maps, e.g. movieIds before and after adding resources. Returns
+    T/F any ids changed"""
+    changes = [(before[name], after[name]) for name in before
+               if name in after and before[name] != after[name]]
+    if not changes:
+        return False
+    orig = values.copy()
+    for old, new in changes:
+        values[orig == old] = new
+    return True
+
+def _remapIndexIds(reader, field, values, newIds):
+    """Remap (in place) the ids in an index column of a resource reader,
+    given a map of the reader's own ids to the ids joined across resources.
+    The ids applied are kept on the reader, so that the column is only ever
+    changed where the joined ids have changed since (e.g. when resources are
+    added), and ids are never remapped twice. Returns T/F any ids changed"""
+    applied = getattr(reader, '_appliedIds', None)
+    if applied is None:
+        applied = reader._appliedIds = {}
+    current = applied.get(field, {})
+    before = {rawId: current.get(rawId, rawId) for rawId in newIds}
+    changed = _remapIds(values, before, newIds)
+    applied[field] = dict(newIds)
+    return changed
+
 def _uniqueRecords(recArray):
     """Remove duplicate records"""
     unique = set()
@@ -247,11 +292,18 @@ def splitKeys(keys, chunks):
         start += cs
     return key_chunks
 
+def _zmwMaxima(keys, values):
+    """The unique (packed) ZMW keys and the largest value of each"""
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    last = np.flatnonzero(np.concatenate((keys[1:] != keys[:-1], [True])))
+    return keys[last], values[order][last]
+
 def _fileExists(fname):
     """Assert that a file exists with a useful failure mode"""
     if not isinstance(fname, basestring):
         fname = fname.resourceId
-    if not os.path.exists(fname):
+    if not fileExists(fname):
         raise InvalidDataSetIOError("Resource {f} not found".format(f=fname))
     return True
 
@@ -304,6 +356,10 @@ class DataSet(object):
             :files: one or more filenames or uris to read
             :strict=False: strictly require all index files
             :skipCounts=False: skip updating counts for faster opening
+            :lazy=False: only parse the XML, deferring the resource existence
+                         and type checks and any count updates until the
+                         resources or counts are first used (see
+                         getDataSetHeader for reading just the counts)
 
         Doctest:
             >>> import os, tempfile
@@ -360,14 +416,23 @@ class DataSet(object):
         skipMissing = kwargs.get('skipMissing', False)
         self._skipCounts = kwargs.get('skipCounts', False)
         _induceIndices = kwargs.get('generateIndices', False)
+        lazy = kwargs.get('lazy', False)
 
         # The metadata concerning the DataSet or subtype itself (e.g.
         # name, version, UniqueId)
         self.objMetadata = {}
 
+        # members still shared with the DataSet this was copied from, the
+        # ids of their shared records (filled on demand) and the links from
+        # their wrappers back to this DataSet (see _beforeWrite)
+        self._sharedMembers = set()
+        self._sharedRecords = {}
+        self._memberOwners = {member: _MemberOwner(self, member)
+                              for member in self._OWNED_TAGS}
+
         # The metadata contained in the DataSet or subtype (e.g.
         # NumRecords, BioSamples, Collections, etc.
-        self._metadata = DataSetMetadata()
+        self._setMetadata(DataSetMetadata())
 
         self.externalResources = ExternalResources()
         self._filters = Filters()
@@ -378,13 +443,17 @@ class DataSet(object):
         # Why not keep this around... (filled by file reader)
         self.fileNames = files
 
+        # checks and updates put off until first use by lazy opening
+        self._deferred = []
+
         # parse files
         populateDataSet(self, files)
 
         if not skipMissing and len(files):
-            log.debug("Checking that the files exist...")
-            self._modResources(_fileExists)
-            log.debug("Done checking that the files exist")
+            if lazy:
+                self._deferred.append(self._checkResourcesExist)
+            else:
+                self._checkResourcesExist()
 
         # DataSet base class shouldn't really be used. It is ok-ish for just
         # basic xml mainpulation. May start warning at some point, but
@@ -424,22 +493,10 @@ class DataSet(object):
         # Don't allow for creating datasets from inappropriate file types
         # (external resources of improper types)
         if not baseDataSet:
-            for fname in self.toExternalFiles():
-                # due to h5 file types, must be unpythonic:
-                found = False
-                for allowed in self._metaTypeMapping().keys():
-                    if fname.endswith(allowed):
-                        found = True
-                        break
-                if not found:
-                    allowed = self._metaTypeMapping().keys()
-                    extension = fname.split('.')[-1]
-                    raise IOError(errno.EIO,
-                                  "Cannot create {c} with resource of type "
-                                  "'{t}' ({f}), only {a}".format(c=dsType,
-                                                           t=extension,
-                                                           f=fname,
-                                                           a=allowed))
+            if lazy:
+                self._deferred.append(self._checkResourceTypes)
+            else:
+                self._checkResourceTypes()
 
         # State tracking:
         self._cachedFilters = []
@@ -451,17 +508,26 @@ class DataSet(object):
         self._referenceInfoTableIsStacked = None
         self._readGroupTableIsRemapped = False
         self._index = None
+        # the last filter mask of each resource's index, see _filterPasses:
+        self._lastPasses = {}
         # only to be used against incorrect counts from the XML, not for
         # internal accounting:
         self._countsUpdated = False
 
         # update counts
         if files:
-            if not self.totalLength or not self.numRecords:
-                self.updateCounts()
-            elif self.totalLength <= 0 or self.numRecords <= 0:
-                self.updateCounts()
+            countsNeeded = False
+            if (not self._metadata.totalLength or
+                    not self._metadata.numRecords):
+                countsNeeded = True
+            elif (self._metadata.totalLength <= 0 or
+                  self._metadata.numRecords <= 0):
+                countsNeeded = True
             elif len(files) > 1:
+                countsNeeded = True
+            if countsNeeded and lazy:
+                self._deferred.append(self.updateCounts)
+            elif countsNeeded:
                 self.updateCounts()
 
         # generate indices if requested and needed
@@ -474,6 +540,50 @@ class DataSet(object):
         Not compatible with DataSet base type"""
         raise NotImplementedError()
 
+    def _checkResourcesExist(self):
+        log.debug("Checking that the files exist...")
+        # Collect first, so the (possibly remote) stat calls can be batched:
+        resources = []
+        self._modResources(resources.append)
+        fnames = [res.resourceId for res in resources]
+        for fname, exists in zip(fnames, filesExist(fnames)):
+            if not exists:
+                raise InvalidDataSetIOError(
+                    "Resource {f} not found".format(f=fname))
+        log.debug("Done checking that the files exist")
+
+    def _checkResourceTypes(self):
+        """Assert that the ExternalResources are of types this DataSet type
+        can hold"""
+        dsType = self.objMetadata["MetaType"]
+        for fname in self.toExternalFiles():
+            # due to h5 file types, must be unpythonic:
+            found = False
+            for allowed in self._metaTypeMapping().keys():
+                if fname.endswith(allowed):
+                    found = True
+                    break
+            if not found:
+                allowed = self._metaTypeMapping().keys()
+                extension = fname.split('.')[-1]
+                raise IOError(errno.EIO,
+                              "Cannot create {c} with resource of type "
+                              "'{t}' ({f}), only {a}".format(c=dsType,
+                                                             t=extension,
+                                                             f=fname,
+                                                             a=allowed))
+
+    def _runDeferred(self):
+        """Run the checks and count updates deferred by lazy opening, if
+        any. Called on first use of the resources or counts."""
+        if not self._deferred:
+            return
+        deferred = self._deferred
+        self._deferred = []
+        log.debug("Completing lazy open")
+        for func in deferred:
+            func()
+
     def __repr__(self):
         """Represent the dataset with an informative string:
 
@@ -529,7 +639,7 @@ class DataSet(object):
                 self.__class__.__name__ == 'DataSet'):
             # determine whether or not this is the merge that is populating a
             # dataset for the first time
-            firstIn = True if len(self.externalResources) == 0 else False
+            firstIn = True if len(self._externalResources) == 0 else False
 
             if copyOnMerge:
                 result = self.copy()
@@ -614,23 +724,200 @@ class DataSet(object):
             raise TypeError('DataSets can only be merged with records of the '
                             'same type or of type DataSet')
 
+    def mergeMany(self, others, newuuid=True):
+        """Merge several datasets with this dataset at once, without modifying
+        any of them. The result is that of reduce(operator.add, [self] +
+        others), but this dataset is copied only once, filters are checked
+        once, resources are unioned through a hash of their ResourceIds, the
+        summary stats are merged in a single pass and the counts are updated
+        once, from the merged resources.
+
+        Args:
+            :others: An iterable of DataSets to merge with self
+            :newuuid: T/F (True) give the result a new UniqueId
+
+        Returns:
+            A new DataSet, or None if the filters are incompatible
+
+        Doctest:
+            >>> import pbcore.data.datasets as data
+            >>> from pbcore.io import AlignmentSet
+            >>> ds1 = AlignmentSet(data.getXml(no=8))
+            >>> ds2 = AlignmentSet(data.getXml(no=11))
+            >>> ds3 = AlignmentSet(data.getXml(no=8))
+            >>> merged = ds1.mergeMany([ds2, ds3])
+            >>> expected = ds1.numExternalResources + ds2.numExternalResources
+            >>> merged.numExternalResources == expected
+            True
+            >>> len(merged.subdatasets)
+            3
+        """
+        others = list(others)
+        for other in others:
+            if not (other.__class__.__name__ == self.__class__.__name__ or
+                    other.__class__.__name__ == 'DataSet' or
+                    self.__class__.__name__ == 'DataSet'):
+                raise TypeError('DataSets can only be merged with records of '
+                                'the same type or of type DataSet')
+        if not others:
+            return self.copy()
+
+        # populating an empty dataset is a special case in merge:
+        if len(self._externalResources) == 0:
+            result = self.merge(others[0], newuuid=newuuid)
+            if result is None or len(others) == 1:
+                return result
+            return result.mergeMany(others[1:], newuuid=newuuid)
+
+        # Block on filters?
+        for other in others:
+            if not self.filters.testCompatibility(other.filters):
+                log.warning("Filter incompatibility has blocked the merging "
+                            "of two datasets")
+                return None
+
+        result = self.copy()
+        # reset the filters, just in case
+        result._cachedFilters = []
+
+        # block on object metadata?
+        for other in others:
+            result._checkObjMetadata(other.objMetadata)
+
+        # subdatasets, flattened as in merge:
+        if not self.subdatasets:
+            result.addDatasets(self.copy())
+        for other in others:
+            result.addDatasets(other.copy())
+
+        # add in the metadata (not to be confused with obj metadata) in one
+        # pass, with the type enforced by this dataset's metadata wrapper.
+        # The summed counts are replaced below, as the inputs' counts may be
+        # stale or overlap
+        wrapper = type(result.metadata)
+        newMetadata = [wrapper(other._metadata.record) for other in others
+                       if other._metadata]
+        if result.metadata:
+            result.metadata.mergeMany(newMetadata)
+        else:
+            for metadata in newMetadata:
+                result.addMetadata(metadata)
+
+        # gather the new resources (deduplicated by ResourceId) so that they
+        # are added in one call, then count the records of the merged
+        # resources that pass the (shared) filters once:
+        newResources = ExternalResources()
+        newResources.mergeMany([other.externalResources for other in others])
+        result.addExternalResources(newResources, updateCount=False)
+        result.updateCounts()
+
+        # objMetadata:
+        # schemaLocation, MetaType, Version should be the same
+        for key, sep in (('Name', ' AND '), ('Tags', ' ')):
+            parts = []
+            if result.objMetadata.get(key):
+                parts.append(result.objMetadata[key])
+            for other in others:
+                value = other.objMetadata.get(key)
+                if not value:
+                    continue
+                if len(parts) != 1 or parts[0] != value:
+                    parts.append(value)
+            if parts:
+                result.objMetadata[key] = sep.join(parts)
+        # TimeStampedName:
+        if result.objMetadata.get("MetaType"):
+            result.objMetadata["TimeStampedName"] = getTimeStampedName(
+                result.objMetadata["MetaType"])
+        # CreatedAt:
+        result.objMetadata['CreatedAt'] = getCreatedAt()
+        # UUID:
+        if newuuid:
+            result.newUuid()
+        return result
+
 
     def __deepcopy__(self, memo):
         """Deep copy this Dataset by recursively deep copying the members
         (objMetadata, DataSet metadata, externalResources, filters and
         subdatasets)
         """
+        self._runDeferred()
         tbr = type(self)(skipCounts=True)
         memo[id(self)] = tbr
         tbr.objMetadata = copy.deepcopy(self.objMetadata, memo)
         tbr.metadata = copy.deepcopy(self._metadata, memo)
-        tbr.externalResources = copy.deepcopy(self.externalResources, memo)
+        tbr.externalResources = copy.deepcopy(self._externalResources, memo)
         tbr.filters = copy.deepcopy(self._filters, memo)
         tbr.subdatasets = copy.deepcopy(self.subdatasets, memo)
         tbr.fileNames = copy.deepcopy(self.fileNames, memo)
         tbr._skipCounts = False
         return tbr
 
+    # the child elements of each shared member that a copy gets its own
+    # (deep) copy of, see _cowCopy
+    _OWNED_TAGS = {'metadata': ('NumRecords', 'TotalLength'),
+                   'externalResources': ()}
+
+    def _cowCopy(self):
+        """Copy this DataSet, sharing the metadata and ExternalResource
+        records with the original rather than deep copying them. Only the
+        counts, object metadata (UUID etc.), filters and subdatasets are
+        copied up front, a shared member is deep copied by _unshare just
+        before one of its shared records is first modified (see
+        _beforeWrite), by either DataSet."""
+        self._runDeferred()
+        tbr = type(self)(skipCounts=True)
+        tbr.objMetadata = dict(self.objMetadata)
+        tbr._setMetadata(self._metadata.cowCopy(
+            own=self._OWNED_TAGS['metadata']))
+        tbr.externalResources = self._externalResources.cowCopy(
+            own=self._OWNED_TAGS['externalResources'])
+        tbr.filters = copy.deepcopy(self._filters)
+        tbr.subdatasets = copy.deepcopy(self.subdatasets)
+        tbr.fileNames = list(self.fileNames)
+        tbr._sharedMembers = set(self._OWNED_TAGS)
+        self._sharedMembers |= tbr._sharedMembers
+        self._sharedRecords = {}
+        tbr._skipCounts = False
+        return tbr
+
+    def _beforeWrite(self, member, record):
+        """Called (through the member's wrappers) before a record of a member
+        is modified. If the record is shared with another DataSet (see
+        _cowCopy) the member is unshared first, records only this DataSet
+        holds (e.g. the counts) are modified in place."""
+        if not member in self._sharedMembers:
+            return
+        shared = self._sharedRecords.get(member)
+        if shared is None:
+            shared = set()
+            root = getattr(self, '_' + member).record
+            todo = [child for child in root['children']
+                    if child['tag'] not in self._OWNED_TAGS[member]]
+            while todo:
+                rec = todo.pop()
+                shared.add(id(rec))
+                todo.extend(rec['children'])
+            self._sharedRecords[member] = shared
+        if id(record) in shared:
+            self._unshare(member)
+
+    def _unshare(self, member):
+        """Deep copy the records of a member (see _cowCopy) that may still be
+        shared with another DataSet, so that they can be modified. The member
+        wrapper is kept, and wrappers handed out earlier move over to the new
+        records."""
+        if not member in self._sharedMembers:
+            return
+        self._sharedMembers.discard(member)
+        self._sharedRecords.pop(member, None)
+        wrapper = getattr(self, '_' + member)
+        old = wrapper.record
+        new = copy.deepcopy(old)
+        self._memberOwners[member].move(old, new)
+        wrapper.record = new
+
     def __eq__(self, other):
         """Test for DataSet equality. The method specified in the documentation
         calls for md5 hashing the "Core XML" elements and comparing. This is
@@ -752,7 +1039,10 @@ class DataSet(object):
             self.write(ofn, relPaths=relative)
 
     def copy(self, asType=None):
-        """Deep copy the representation of this DataSet
+        """Copy the representation of this DataSet. Metadata and
+        ExternalResource records are shared with this DataSet until either
+        copy modifies them (copy-on-write), so copying is cheap even for
+        DataSets with large metadata.
 
         Args:
             :asType: The type of DataSet to return, e.g. 'AlignmentSet'
@@ -827,13 +1117,14 @@ class DataSet(object):
             tbr.merge(self)
             tbr.makePathsAbsolute()
             return tbr
-        result = copy.deepcopy(self)
+        result = self._cowCopy()
         result.newUuid()
         return result
 
     def split(self, chunks=0, ignoreSubDatasets=True, contigs=False,
               maxChunks=0, breakContigs=False, targetSize=5000, zmws=False,
-              barcodes=False, byRecords=False, updateCounts=True):
+              barcodes=False, byRecords=False, updateCounts=True,
+              byBases=False, byCoverage=False):
         """Deep copy the DataSet into a number of new DataSets containing
         roughly equal chunks of the ExternalResources or subdatasets.
 
@@ -855,6 +1146,11 @@ class DataSet(object):
 
                 dset.split(contigs=True, maxChunks=n, breakContigs=True)
 
+            - split into n datasets of reference windows with roughly equal \
+              numbers of aligned bases, however skewed the coverage::
+
+                dset.split(contigs=True, chunks=n, byCoverage=True)
+
         Args:
             :chunks: the number of chunks to split the DataSet.
             :ignoreSubDatasets: (True) do not split by subdatasets
@@ -864,6 +1160,8 @@ class DataSet(object):
             :maxChunks: The upper limit on the number of chunks.
             :breakContigs: Whether or not to break contigs
             :byRecords: Split contigs by mapped records, rather than ref length
+            :byCoverage: Split contigs into windows of equal aligned bases
+            :byBases: Balance zmw chunks by bases, rather than number of zmws
             :targetSize: The target minimum number of reads per chunk
             :updateCounts: Update the count metadata in each chunk
 
@@ -926,7 +1224,8 @@ class DataSet(object):
             return self._split_contigs(chunks, maxChunks, breakContigs,
                                        targetSize=targetSize,
                                        byRecords=byRecords,
-                                       updateCounts=updateCounts)
+                                       updateCounts=updateCounts,
+                                       byCoverage=byCoverage)
         elif zmws:
             if chunks == 0:
                 if maxChunks:
@@ -934,9 +1233,10 @@ class DataSet(object):
                 elif targetSize:
                     chunks = max(1,
                                  int(round(np.true_divide(
-                                     len(set(self.index.holeNumber)),
+                                     len(np.unique(self.index.holeNumber)),
                                      targetSize))))
-            return self._split_zmws(chunks, targetSize=targetSize)
+            return self._split_zmws(chunks, targetSize=targetSize,
+                                    byBases=byBases)
         elif barcodes:
             if maxChunks and not chunks:
                 chunks = maxChunks
@@ -948,7 +1248,7 @@ class DataSet(object):
                 and not ignoreSubDatasets):
             return self._split_subdatasets(chunks)
 
-        atoms = self.externalResources.resources
+        atoms = self._externalResources.resources
         balanceKey = len
 
         # If chunks not specified, split to one DataSet per
@@ -987,13 +1287,14 @@ class DataSet(object):
         return results
 
     def _split_contigs(self, chunks, maxChunks=0, breakContigs=False,
-                       targetSize=5000, byRecords=False, updateCounts=False):
+                       targetSize=5000, byRecords=False, updateCounts=False,
+                       byCoverage=False):
         raise TypeError("Only AlignmentSets may be split by contigs")
 
     def _split_barcodes(self, chunks):
         raise TypeError("Only ReadSets may be split by contigs")
 
-    def _split_zmws(self, chunks, targetSize=None):
+    def _split_zmws(self, chunks, targetSize=None, byBases=False):
         raise TypeError("Only ReadSets may be split by ZMWs")
 
     def _split_atoms(self, atoms, num_chunks):
@@ -1037,7 +1338,7 @@ class DataSet(object):
         return results
 
     def write(self, outFile, validate=True, modPaths=None,
-              relPaths=None, pretty=True):
+              relPaths=None, pretty=True, background=False):
         """Write to disk as an XML file
 
         Args:
@@ -1046,6 +1347,10 @@ class DataSet(object):
             :relPaths: T/F (None/no change) make the ExternalResource
                        ResourceIds relative instead of absolute filenames
             :modPaths: DEPRECATED (T/F) allow paths to be modified
+            :pretty: T/F (True) indent the XML
+            :background: T/F (False) validate in a background thread after
+                         writing. The BackgroundValidation thread is
+                         returned, its result() raises any validation error
 
         Doctest:
             >>> import pbcore.data.datasets as data
@@ -1060,6 +1365,8 @@ class DataSet(object):
             True
         """
         log.debug("Writing DataSet...")
+        # complete a lazy open, so that the counts written are current:
+        self._runDeferred()
         if not modPaths is None:
             log.info("modPaths as a write argument is deprecated. Paths "
                      "aren't modified unless relPaths is explicitly set "
@@ -1079,24 +1386,19 @@ class DataSet(object):
             else:
                 self.makePathsAbsolute()
         log.debug('Serializing XML...')
-        xml_string = toXml(self)
+        xml_string = serializeXml(self, pretty=pretty)
         log.debug('Done serializing XML')
 
-        if pretty:
-            log.debug('Making pretty...')
-            xml_string = xml.dom.minidom.parseString(xml_string).toprettyxml(
-                encoding="UTF-8")
-            log.debug('Done making pretty...')
+        relTo = '.'
+        if isinstance(outFile, basestring):
+            relTo = os.path.dirname(outFile)
 
         # not useful yet as a list, but nice to keep the options open:
         validation_errors = []
-        if validate:
+        if validate and not background:
             log.debug('Validating...')
             try:
-                if isinstance(outFile, basestring):
-                    validateString(xml_string, relTo=os.path.dirname(outFile))
-                else:
-                    validateString(xml_string)
+                validateString(xml_string, relTo=relTo)
             except Exception as e:
                 validation_errors.append(e)
             log.debug('Done validating')
@@ -1120,6 +1422,13 @@ class DataSet(object):
             log.error("Invalid file produced: {f}".format(f=fileName))
             raise e
         log.debug("Done writing DataSet")
+        if validate and background:
+            log.debug('Validating in the background...')
+            validation = BackgroundValidation(xml_string, relTo=relTo,
+                                              fileName=getattr(outFile, 'name',
+                                                               None))
+            validation.start()
+            return validation
 
     def loadStats(self, filename=None):
         """Load pipeline statistics from a <moviename>.sts.xml file. The subset
@@ -1445,8 +1754,8 @@ class DataSet(object):
         determination. It should never be written out to XML in regular use.
 
         """
-        self.metadata.totalLength = -1
-        self.metadata.numRecords = -1
+        self._metadata.totalLength = -1
+        self._metadata.numRecords = -1
 
     def addExternalResources(self, newExtResources, updateCount=True):
         """Add additional ExternalResource objects, ensuring no duplicate
@@ -1492,11 +1801,22 @@ class DataSet(object):
                               if not isinstance(res, ExternalResource) else res
                               for res in newExtResources])
             newExtResources = tmp
+        known = set(self.externalResources.resourceIds)
         self.externalResources.merge(newExtResources)
         if updateCount:
-            self._openFiles()
+            # readers that are already open (and their index) are extended
+            # with the new resources where possible:
+            added = [extRes for extRes in self.externalResources
+                     if not extRes.resourceId in known]
+            if not (self._openReaders and self._extendResources(added)):
+                self._openFiles()
             self.updateCounts()
 
+    def _extendResources(self, extResources):
+        """Open newly added ExternalResources alongside the open readers.
+        Returns False if all resources have to be reopened instead"""
+        return False
+
     def addDatasets(self, otherDataSet):
         """Add subsets to a DataSet object using other DataSets.
 
@@ -1661,7 +1981,7 @@ class DataSet(object):
             ...         skipMissing=True).toFofn(uri=False)
             ['bam1.bam', 'bam2.bam']
         """
-        lines = [er.resourceId for er in self.externalResources]
+        lines = [er.resourceId for er in self._externalResources]
         if not uri:
             lines = [urlparse(line).path for line in lines]
         if relative is True:
@@ -1679,7 +1999,7 @@ class DataSet(object):
 
     def toExternalFiles(self):
         """Returns a list of top level external resources (no indices)."""
-        return self.externalResources.resourceIds
+        return self._externalResources.resourceIds
 
     @property
     def _castableDataSetTypes(self):
@@ -1714,11 +2034,33 @@ class DataSet(object):
                 'TranscriptSet': TranscriptSet,
                 'TranscriptAlignmentSet': TranscriptAlignmentSet}
 
+    @property
+    def externalResources(self):
+        """The ExternalResources of this DataSet. These may be shared with
+        copies of this DataSet until modified (see _cowCopy)."""
+        return self._externalResources
+
+    @externalResources.setter
+    def externalResources(self, value):
+        self._sharedMembers.discard('externalResources')
+        self._externalResources = self._ownMember('externalResources', value)
+
+    def _ownMember(self, member, wrapper):
+        """Tie the wrapper of a member (and so the wrappers it hands out) to
+        this DataSet, see _beforeWrite. A wrapper belonging to another DataSet
+        is replaced by a new one around the same records."""
+        owner = self._memberOwners[member]
+        if wrapper._owner is not None and wrapper._owner is not owner:
+            wrapper = type(wrapper)(wrapper.record)
+        wrapper._owner = owner
+        return wrapper
+
     @property
     def metadata(self):
         """Return the DataSet metadata as a DataSetMetadata object. Attributes
         should be populated intuitively, but see DataSetMetadata documentation
         for more detail."""
+        self._runDeferred()
         return self._metadata
 
     @metadata.setter
@@ -1727,10 +2069,23 @@ class DataSet(object):
         the argument must be a properly formated data structure, as specified
         in the DataSetMetadata documentation. This setter is primarily used
         by other DataSet objects, rather than users or API consumers."""
+        self._sharedMembers.discard('metadata')
         if isinstance(newDict, DataSetMetadata):
-            self._metadata = newDict
+            self._setMetadata(newDict)
         else:
-            self._metadata = self._metadata.__class__(newDict)
+            self._setMetadata(self._metadata.__class__(newDict))
+
+    def _setMetadata(self, metadata):
+        """Set self._metadata, converted to the metadata subtype of this
+        DataSet type and tied to this DataSet"""
+        self._metadata = self._ownMember('metadata',
+                                         self._castMetadata(metadata))
+
+    def _castMetadata(self, metadata):
+        """Convert a DataSetMetadata to the metadata subtype of this DataSet
+        type, if it has one. Used wherever the metadata is created or
+        replaced, so that self._metadata always has the right type"""
+        return metadata
 
     @property
     def filters(self):
@@ -1758,8 +2113,8 @@ class DataSet(object):
         self._index = None
         self._indexMap = None
         if not light:
-            self.metadata.totalLength = -1
-            self.metadata.numRecords = -1
+            self._metadata.totalLength = -1
+            self._metadata.numRecords = -1
             if self.metadata.summaryStats:
                 self.metadata.removeChildren('SummaryStats')
             self.updateCounts()
@@ -1775,6 +2130,7 @@ class DataSet(object):
     @property
     def numRecords(self):
         """The number of records in this DataSet (from the metadata)"""
+        self._runDeferred()
         return self._metadata.numRecords
 
     @numRecords.setter
@@ -1785,6 +2141,7 @@ class DataSet(object):
     @property
     def totalLength(self):
         """The total length of this DataSet"""
+        self._runDeferred()
         return self._metadata.totalLength
 
     @totalLength.setter
@@ -1855,7 +2212,7 @@ class DataSet(object):
     @property
     def numExternalResources(self):
         """The number of ExternalResources in this DataSet"""
-        return len(self.externalResources)
+        return len(self._externalResources)
 
     def _pollResources(self, func):
         """Collect the responses to func on each resource (or those with reads
@@ -1940,6 +2297,39 @@ class DataSet(object):
     def _indexRecords(self):
         raise NotImplementedError()
 
+    def _filterPasses(self, key, indexRecords, evaluate):
+        """The mask of the records in a resource's index that pass the
+        filters. The last mask of each resource is kept, so when the filters
+        have since only been narrowed (e.g. by addRequirement), just the new
+        requirements are evaluated, and only on the records that passed
+        before. OR-ed or removed requirements mean a full evaluation.
+
+        Args:
+            :key: The resource the index belongs to
+            :indexRecords: The unfiltered index recarray of that resource
+            :evaluate: f(filters, records) returning a boolean mask
+
+        Returns:
+            A boolean mask over indexRecords
+        """
+        passes = None
+        last = self._lastPasses.get(key)
+        if last is not None and len(last[1]) == len(indexRecords):
+            lastFilters, lastPasses = last
+            newFilters = self._filters.refinement(lastFilters)
+            if newFilters is not None:
+                rows = np.flatnonzero(lastPasses)
+                log.debug("Refining {n} of {t} previously filtered records "
+                          "of {k}".format(n=len(rows), t=len(indexRecords),
+                                          k=key))
+                passes = np.zeros(len(indexRecords), dtype=np.bool_)
+                if len(rows):
+                    passes[rows] = evaluate(newFilters, indexRecords[rows])
+        if passes is None:
+            passes = evaluate(self._filters, indexRecords)
+        self._lastPasses[key] = (self._filters.requirementSets(), passes)
+        return passes
+
     def isIndexed(self):
         raise NotImplementedError()
 
@@ -1992,7 +2382,7 @@ class ReadSet(DataSet):
 
     def __init__(self, *files, **kwargs):
         super(ReadSet, self).__init__(*files, **kwargs)
-        self._metadata = SubreadSetMetadata(self._metadata)
+        self._setMetadata(SubreadSetMetadata(self._metadata))
 
     def induceIndices(self, force=False):
         for res in self.externalResources:
@@ -2043,18 +2433,37 @@ class ReadSet(DataSet):
         if not self.isBarcoded:
             raise RuntimeError("File not barcoded")
 
-    def _openFiles(self):
+    def _openFiles(self, extResources=None):
         """Open the files (assert they exist, assert they are of the proper
         type before accessing any file)
+
+        Args:
+            :extResources: Open just these ExternalResources, appending them to
+                           the readers already open, rather than (re)opening
+                           all of them
         """
-        if self._openReaders:
-            log.debug("Closing old readers...")
-            self.close()
-        log.debug("Opening ReadSet resources")
+        self._runDeferred()
         sharedRefs = {}
         infotables = []
         infodicts = []
-        for extRes in self.externalResources:
+        if extResources is None:
+            extResources = self._externalResources
+            if self._openReaders:
+                log.debug("Closing old readers...")
+                self.close()
+        else:
+            # share references and reference tables with the open readers:
+            for extRes, reader in zip(self._externalResources,
+                                      self._openReaders):
+                if extRes.reference and hasattr(reader, 'referenceFasta'):
+                    sharedRefs.setdefault(extRes.reference,
+                                          reader.referenceFasta)
+                table = getattr(reader, '_referenceInfoTable', None)
+                if not any(table is ri for ri in infotables):
+                    infotables.append(table)
+                    infodicts.append(getattr(reader, '_referenceDict', {}))
+        log.debug("Opening ReadSet resources")
+        for extRes in extResources:
             refFile = extRes.reference
             if refFile:
                 if not refFile in sharedRefs:
@@ -2238,105 +2647,89 @@ class ReadSet(DataSet):
 
         return results
 
-    def _split_zmws(self, chunks, targetSize=None):
+    def _split_zmws(self, chunks, targetSize=None, byBases=False):
         """The combination of <movie>_<holenumber> is assumed to refer to a
-        unique ZMW"""
+        unique ZMW.
+
+        The index is sorted once by (qId, holeNumber), and chunks are cut at
+        ZMW boundaries found in the packed ZMW keys, balancing either the
+        number of ZMWs (default) or the number of bases (byBases) per chunk.
+        """
 
         if chunks == 1:
             return [self.copy()]
         # make sure we can pull out the movie name:
         rgIdMovieNameMap = {rg[0]: rg[1] for rg in self.readGroupTable}
 
-        active_holenumbers = self.index
+        index = self.index
 
         # lower limit on the  number of chunks
-        n_chunks = min(len(active_holenumbers), chunks)
+        n_chunks = min(len(index), chunks)
 
         # if we have a target size and can have two or more chunks:
-        if (not targetSize is None and len(active_holenumbers) > 1 and
+        if (not targetSize is None and len(index) > 1 and
                 chunks > 1):
             # we want at least two if we can swing it
-            desired = max(2, len(active_holenumbers)//targetSize)
+            desired = max(2, len(index)//targetSize)
             n_chunks = min(n_chunks, desired)
 
         if n_chunks != chunks:
             log.info("Adjusted number of chunks to %d" % n_chunks)
 
-        # sort atoms and group into chunks:
-        active_holenumbers.sort(order=['qId', 'holeNumber'])
-        view = _fieldsView(self.index, ['qId', 'holeNumber'])
-        keys = np.unique(view)
-        # Find the beginning and end keys of each chunk
-        ranges = splitKeys(keys, n_chunks)
-
-        # The above ranges can include hidden, unrepresented movienames that
-        # are sandwiched between those identified by the range bounds. In
-        # order to capture those, we need to find the indices of the range
-        # bounds, then pull out the chunks.
-        hn_chunks = []
-        for zmw_range in ranges:
-            if zmw_range[0][0] == zmw_range[1][0]:
-                # The start and end movienames match, grab the appropriate
-                # record indices in one query:
-                hn_chunks.append(active_holenumbers[
-                    (active_holenumbers['qId'] == zmw_range[0][0]) &
-                    (active_holenumbers['holeNumber'] >= zmw_range[0][1]) &
-                    (active_holenumbers['holeNumber'] <= zmw_range[1][1])])
-            else:
-                # The start and end movienames don't match, grab the first
-                # record matching the start of the range:
-                start = np.flatnonzero(
-                    (active_holenumbers['qId'] == zmw_range[0][0]) &
-                    (active_holenumbers['holeNumber'] == zmw_range[0][1]))[0]
-                # and grab the last record matching the end of the range:
-                end = np.flatnonzero(
-                    (active_holenumbers['qId'] == zmw_range[1][0]) &
-                    (active_holenumbers['holeNumber'] == zmw_range[1][1]))[-1]
-                # and add all indices between these two (with an exclusive
-                # right bound):
-                hn_chunks.append(active_holenumbers[start:(end + 1)])
+        # sort once, then find the first record of each ZMW:
+        order = np.lexsort((index.holeNumber, index.qId))
+        qIds = index.qId[order]
+        holeNumbers = index.holeNumber[order]
+        keys = packZmwKeys(qIds, holeNumbers)
+        zmwStarts = np.flatnonzero(np.concatenate(
+            ([True], keys[1:] != keys[:-1])))
+        n_chunks = min(n_chunks, len(zmwStarts))
+        lengths = np.concatenate(([0], np.cumsum(
+            index.qEnd[order] - index.qStart[order], dtype=np.int64)))
+
+        # Find the boundaries of each chunk, in ZMWs:
+        if byBases:
+            zmwEnds = np.append(zmwStarts[1:], len(keys))
+            cumBases = lengths[zmwEnds]
+            targets = (cumBases[-1] * np.arange(1, n_chunks, dtype=np.int64)
+                       // n_chunks)
+            bounds = np.searchsorted(cumBases, targets) + 1
+            bounds = np.unique(np.clip(bounds, 1, len(zmwStarts) - 1))
+        else:
+            # the same sizes as splitKeys:
+            chunksizes = np.full(n_chunks, len(zmwStarts)//n_chunks,
+                                 dtype=np.int64)
+            chunksizes[:len(zmwStarts) % n_chunks] += 1
+            bounds = np.cumsum(chunksizes)[:-1]
+        bounds = np.concatenate(([0], zmwStarts[bounds], [len(keys)]))
+
+        # the rows of each movie in the sorted index:
+        movies = np.unique(qIds)
+        movieStarts = np.searchsorted(qIds, movies, side='left')
+        movieEnds = np.searchsorted(qIds, movies, side='right')
 
         results = []
         log.debug("Making copies")
-        tmp_results = [self.copy() for _ in range(n_chunks)]
+        tmp_results = [self.copy() for _ in range(len(bounds) - 1)]
 
         # add filters
-        for chunk, res in zip(hn_chunks, tmp_results):
-            # check if multiple movies:
-            if chunk[0]['qId'] == chunk[-1]['qId']:
-                movieName = rgIdMovieNameMap[chunk[0]['qId']]
-                zmwStart = chunk[0]['holeNumber']
-                zmwEnd = chunk[-1]['holeNumber']
-                res._filters.clearCallbacks()
-                newfilt = [[('movie', '=', movieName),
-                             ('zm', '<', zmwEnd + 1),
-                             ('zm', '>', zmwStart - 1)]]
-                res._filters.broadcastFilters(newfilt)
-            else:
-                movieNames = []
-                zmwStarts = []
-                zmwEnds = []
-                for mov in np.unique(chunk['qId']):
-                    movieNames.append(rgIdMovieNameMap[mov])
-                    inds = np.flatnonzero(chunk['qId'] == mov)
-                    zmwStarts.append(chunk[inds[0]]['holeNumber'])
-                    zmwEnds.append(chunk[inds[-1]]['holeNumber'])
-                res._filters.clearCallbacks()
-                newfilts = []
-                for mn, ze, zs in zip(movieNames, zmwEnds, zmwStarts):
-                    newfilts.append([('movie', '=', mn),
-                                     ('zm', '<', ze + 1),
-                                     ('zm', '>', zs - 1)])
-                res._filters.broadcastFilters(newfilts)
-            res.numRecords = len(chunk)
-            res.totalLength = sum(chunk['qEnd'] - chunk['qStart'])
+        for start, end, res in zip(bounds[:-1], bounds[1:], tmp_results):
+            first = np.searchsorted(movies, qIds[start])
+            last = np.searchsorted(movies, qIds[end - 1])
+            newfilts = []
+            for mov in range(first, last + 1):
+                zmwStart = holeNumbers[max(start, movieStarts[mov])]
+                zmwEnd = holeNumbers[min(end, movieEnds[mov]) - 1]
+                newfilts.append([('movie', '=', rgIdMovieNameMap[movies[mov]]),
+                                 ('zm', '<', zmwEnd + 1),
+                                 ('zm', '>', zmwStart - 1)])
+            res._filters.clearCallbacks()
+            res._filters.broadcastFilters(newfilts)
+            res.numRecords = end - start
+            res.totalLength = lengths[end] - lengths[start]
             res.newUuid()
             results.append(res)
 
-        # we changed the sort order above, so this is dirty:
-        self._index = None
-        self._indexMap = None
-
         # Update the basic metadata for the new DataSets from external
         # resources, or at least mark as dirty
         # TODO
@@ -2431,10 +2824,31 @@ class ReadSet(DataSet):
             qIdMap = dict(zip(rr.readGroupTable.ID,
                               rr.readGroupTable.MovieName))
             nameMap = self.movieIds
-            for qId in qIdMap.keys():
-                qId_acc(indices)[qId_acc(indices) == qId] = nameMap[
-                    qIdMap[qId]]
-
+            _remapIndexIds(rr, 'qId', qId_acc(indices),
+                           {qId: nameMap[name]
+                            for qId, name in qIdMap.items()})
+
+
+    def _indexSegment(self, rrNum, rr):
+        """The index records of one resource reader that conform to the
+        filters, and their row numbers in that reader"""
+        indices = rr.index
+
+        self._fixQIds(indices, rr)
+
+        if not self._filters or self.noFiltering:
+            return indices._tbl, np.arange(len(indices._tbl))
+        # Filtration will be necessary:
+        nameMap = {}
+        if not rr.referenceInfoTable is None:
+            nameMap = {name: n
+                       for n, name in enumerate(
+                           rr.referenceInfoTable['Name'])}
+        passes = self._filterPasses(
+            getattr(rr, 'filename', rrNum), indices._tbl,
+            lambda filters, records: filters.filterIndexRecords(
+                records, nameMap, self.movieIds))
+        return indices._tbl[passes], np.flatnonzero(passes)
 
     def _indexRecords(self):
         """Returns index recarray summarizing all of the records in all of
@@ -2443,36 +2857,85 @@ class ReadSet(DataSet):
 
         """
         recArrays = []
-        _indexMap = []
+        _indexMap = [_indexMapSegment(0, [])]
         for rrNum, rr in enumerate(self.resourceReaders()):
-            indices = rr.index
-
-            self._fixQIds(indices, rr)
-
-            if not self._filters or self.noFiltering:
-                recArrays.append(indices._tbl)
-                _indexMap.extend([(rrNum, i) for i in
-                                       range(len(indices._tbl))])
-            else:
-                # Filtration will be necessary:
-                nameMap = {}
-                if not rr.referenceInfoTable is None:
-                    nameMap = {name: n
-                               for n, name in enumerate(
-                                   rr.referenceInfoTable['Name'])}
-                passes = self._filters.filterIndexRecords(indices._tbl,
-                                                          nameMap,
-                                                          self.movieIds)
-                newInds = indices._tbl[passes]
-                recArrays.append(newInds)
-                _indexMap.extend([(rrNum, i) for i in
-                                       np.flatnonzero(passes)])
-        self._indexMap = np.array(_indexMap, dtype=[('reader', 'uint64'),
-                                                    ('index', 'uint64')])
+            records, rows = self._indexSegment(rrNum, rr)
+            recArrays.append(records)
+            _indexMap.append(_indexMapSegment(rrNum, rows))
+        self._indexMap = np.concatenate(_indexMap)
         if recArrays == []:
             return recArrays
         return _stackRecArrays(recArrays)
 
+    def _indexIdMaps(self):
+        """The name: id maps of the index id columns that are remapped to be
+        unique across resources"""
+        return {'qId': self.movieIds}
+
+    def _fixIndexIds(self, rr):
+        """Remap the ids in the index of a resource reader to those joined
+        across resources"""
+        self._fixQIds(rr.index, rr)
+
+    def _extendResources(self, extResources):
+        """Open newly added ExternalResources, appending them to the open
+        readers and (if it has been built) the index, rather than reopening
+        and reindexing every resource. Ids in the existing index segments are
+        remapped only where the new resources change them (e.g. conflicting
+        qIds).
+
+        Args:
+            :extResources: The ExternalResources added to this DataSet
+
+        Returns:
+            T/F the readers and index were extended. Otherwise (e.g. for
+            cmp.h5 files) they must be reopened and rebuilt
+        """
+        if not all(extRes.resourceId.endswith('bam')
+                   for extRes in extResources):
+            return False
+        if not all(isinstance(reader, IndexedBamReader)
+                   for reader in self._openReaders):
+            return False
+        before = self._indexIdMaps()
+        start = len(self._openReaders)
+        self._openFiles(extResources)
+        # the joined tables have to include the new resources:
+        self._referenceInfoTable = None
+        self._referenceInfoTableIsStacked = None
+        after = self._indexIdMaps()
+        newReaders = self._openReaders[start:]
+        if self._index is None or isinstance(self._index, list):
+            # not built yet, or built without any resources
+            self._index = None
+            self._indexMap = None
+            return True
+        if not all(isinstance(reader, IndexedBamReader)
+                   for reader in newReaders):
+            self._index = None
+            self._indexMap = None
+            return True
+        remapped = False
+        for field, ids in before.items():
+            if _remapIds(getattr(self._index, field), ids, after[field]):
+                log.debug("Remapping {f} of existing index "
+                          "segments".format(f=field))
+                remapped = True
+        if remapped:
+            for reader in self._openReaders[:start]:
+                self._fixIndexIds(reader)
+        recArrays = [self._index]
+        _indexMap = [self._indexMap]
+        for rrNum, rr in enumerate(newReaders, start):
+            records, rows = self._indexSegment(rrNum, rr)
+            recArrays.append(records)
+            _indexMap.append(_indexMapSegment(rrNum, rows))
+        log.debug("Extending index with {n} resources".format(
+            n=len(newReaders)))
+        self._index = _stackRecArrays(recArrays)
+        self._indexMap = np.concatenate(_indexMap)
+        return True
+
     def resourceReaders(self):
         """Open the files in this ReadSet"""
         if not self._openReaders:
@@ -2498,6 +2961,166 @@ class ReadSet(DataSet):
             length = sum(self.index.qEnd - self.index.qStart)
         return count, length
 
+    def _recordLengths(self, indices):
+        """The per-record lengths summed into TotalLength"""
+        return indices.qEnd - indices.qStart
+
+    @property
+    def _canStreamIndex(self):
+        """Counts can be streamed from the pbi files if no readers have been
+        opened or index cached yet, and every resource is an indexed bam"""
+        if self._openReaders or self._index is not None:
+            return False
+        if not len(self._externalResources):
+            return False
+        for extRes in self._externalResources:
+            if not extRes.resourceId.endswith('bam'):
+                return False
+            if not os.path.exists(self._pbiLocation(extRes)):
+                return False
+        return True
+
+    def _pbiLocation(self, extRes):
+        """The pbi listed for this resource, or where IndexedBamReader would
+        look for it"""
+        if extRes.pbi:
+            return urlparse(extRes.pbi).path
+        return urlparse(extRes.resourceId).path + '.pbi'
+
+    def _streamIndex(self, keepRows=False, chunkSize=10000000,
+                     onChunk=None):
+        """Walk the pbi of each resource in ZMW-aligned chunks (see
+        StreamingBamIndex), filtering each chunk as it is read. Neither the
+        full index nor the readers' own copies of the pbi are held in memory,
+        only the bam headers.
+
+        Args:
+            :keepRows: Also return the passing rows of each resource
+            :chunkSize: The approximate number of records per chunk
+            :onChunk: Called with the passing records of each chunk
+
+        Returns:
+            (numRecords, totalLength, rows), where rows is None unless
+            keepRows, in which case it is a list (one per resource) of int64
+            arrays of [start, end) runs of passing row numbers
+        """
+        numRecords = 0
+        totalLength = 0
+        rows = [] if keepRows else None
+        filters = Filters() if self.noFiltering else self._filters
+        for extRes in self._externalResources:
+            location = urlparse(extRes.resourceId).path
+            header = BamReader(location)
+            movieMap = {rg.MovieName: rg.ID for rg in header.readGroupTable}
+            nameMap = {}
+            if header.referenceInfoTable is not None:
+                nameMap = dict(zip(header.referenceInfoTable['Name'],
+                                   header.referenceInfoTable['ID']))
+            header.close()
+            pbi = StreamingBamIndex(self._pbiLocation(extRes), chunkSize)
+            log.debug("Streaming {n} pbi chunks from {f}".format(
+                n=pbi.nchunks, f=location))
+            runs = []
+            offset = 0
+            for chunk, passes in filters.filterIndexChunks(pbi, nameMap,
+                                                           movieMap):
+                numRecords += int(np.count_nonzero(passes))
+                if len(chunk):
+                    totalLength += int(np.sum(
+                        self._recordLengths(chunk[passes]), dtype=np.int64))
+                if onChunk is not None and np.any(passes):
+                    onChunk(chunk[passes])
+                if keepRows:
+                    edges = np.flatnonzero(np.diff(np.concatenate(
+                        ([0], passes.view(np.int8), [0]))))
+                    runs.append(edges.reshape(-1, 2) + offset)
+                offset += len(chunk)
+            if keepRows:
+                runs = (np.concatenate(runs).astype(np.int64) if runs
+                        else np.zeros((0, 2), dtype=np.int64))
+                # join runs that continue across chunk boundaries:
+                if len(runs) > 1:
+                    starts = np.concatenate(
+                        ([True], runs[1:, 0] != runs[:-1, 1]))
+                    ends = np.concatenate((starts[1:], [True]))
+                    runs = np.column_stack((runs[starts, 0], runs[ends, 1]))
+                rows.append(runs)
+        return numRecords, totalLength, rows
+
+    def updateStats(self, readLenBinWidth=100, readQualBinWidth=0.01,
+                    insertLenBinWidth=100):
+        """Compute the ReadLenDist, ReadQualDist and InsertReadLenDist (of the
+        longest subread of each ZMW) of the records that pass the filters,
+        along with NumRecords and TotalLength, from the pbi alone. The pbi is
+        streamed in chunks where possible. The distributions replace any
+        loaded from sts.xml files in metadata.summaryStats, which no longer
+        describe filtered or split datasets.
+
+        Args:
+            :readLenBinWidth: The bin width of ReadLenDist
+            :readQualBinWidth: The bin width of ReadQualDist
+            :insertLenBinWidth: The bin width of InsertReadLenDist
+        Returns:
+            The updated StatsMetadata
+
+        Doctest:
+            >>> import pbcore.data.datasets as data
+            >>> from pbcore.io import SubreadSet
+            >>> ds = SubreadSet(data.getXml(10))
+            >>> stats = ds.updateStats()
+            >>> stats.readLenDist.sampleSize == ds.numRecords
+            True
+            >>> sum(stats.readLenDist.bins) == ds.numRecords
+            True
+        """
+        readLens = HistogramAccumulator(readLenBinWidth)
+        readQuals = HistogramAccumulator(readQualBinWidth)
+        zmwKeys = []
+        zmwLens = []
+        counts = [0, 0]
+
+        def _addChunk(indices):
+            lengths = indices.qEnd - indices.qStart
+            readLens.add(lengths)
+            readQuals.add(indices.readQual)
+            keys, longest = _zmwMaxima(
+                packZmwKeys(indices.qId, indices.holeNumber), lengths)
+            zmwKeys.append(keys)
+            zmwLens.append(longest)
+            counts[0] += len(indices)
+            counts[1] += int(np.sum(self._recordLengths(indices),
+                                    dtype=np.int64))
+
+        log.debug("Computing stats from the index")
+        if self._canStreamIndex:
+            self._streamIndex(onChunk=_addChunk)
+        else:
+            self.assertIndexed()
+            if len(self.index):
+                _addChunk(self.index)
+        # ZMWs could continue across chunks or resources:
+        insertLens = HistogramAccumulator(insertLenBinWidth)
+        if len(zmwKeys) > 1:
+            insertLens.add(_zmwMaxima(np.concatenate(zmwKeys),
+                                      np.concatenate(zmwLens))[1])
+        elif zmwLens:
+            insertLens.add(zmwLens[0])
+
+        metadata = self.metadata
+        metadata.numRecords, metadata.totalLength = counts
+        stats = metadata.summaryStats
+        if not stats:
+            stats = StatsMetadata(_emptyMember(tag='SummaryStats'))
+            metadata.summaryStats = stats
+        for tag, description, acc in [
+                ('ReadLenDist', 'Read Length', readLens),
+                ('ReadQualDist', 'Read Quality', readQuals),
+                ('InsertReadLenDist', 'Read Length of Insert', insertLens)]:
+            stats.removeChildren(tag)
+            stats.append(acc.toDistribution(tag, description))
+        log.debug("Done computing stats")
+        return stats
+
     def _resourceSizes(self):
         sizes = []
         for rr in self.resourceReaders():
@@ -2567,21 +3190,24 @@ class ReadSet(DataSet):
     def updateCounts(self):
         if self._skipCounts:
             log.debug("SkipCounts is true, skipping updateCounts()")
-            self.metadata.totalLength = -1
-            self.metadata.numRecords = -1
+            self._metadata.totalLength = -1
+            self._metadata.numRecords = -1
             return
         try:
-            self.assertIndexed()
             log.debug('Updating counts')
-            numRecords, totalLength = self._length
-            self.metadata.totalLength = totalLength
-            self.metadata.numRecords = numRecords
+            if self._canStreamIndex:
+                numRecords, totalLength, _ = self._streamIndex()
+            else:
+                self.assertIndexed()
+                numRecords, totalLength = self._length
+            self._metadata.totalLength = totalLength
+            self._metadata.numRecords = numRecords
             self._countsUpdated = True
         except (IOError, UnavailableFeature):
             if not self._strict:
                 log.debug("File problem, metadata not populated")
-                self.metadata.totalLength = 0
-                self.metadata.numRecords = 0
+                self._metadata.totalLength = 0
+                self._metadata.numRecords = 0
             else:
                 raise
 
@@ -2610,11 +3236,12 @@ class HdfSubreadSet(ReadSet):
         """Open the files (assert they exist, assert they are of the proper
         type before accessing any file)
         """
+        self._runDeferred()
         if self._openReaders:
             log.debug("Closing old readers...")
             self.close()
         log.debug("Opening resources")
-        for extRes in self.externalResources:
+        for extRes in self._externalResources:
             location = urlparse(extRes.resourceId).path
             resource = BaxH5Reader(location)
             self._openReaders.append(resource)
@@ -2637,20 +3264,20 @@ class HdfSubreadSet(ReadSet):
         """Overriding here so we don't have to assertIndexed"""
         if self._skipCounts:
             log.debug("SkipCounts is true, skipping updateCounts()")
-            self.metadata.totalLength = -1
-            self.metadata.numRecords = -1
+            self._metadata.totalLength = -1
+            self._metadata.numRecords = -1
             return
         try:
             log.debug('Updating counts')
             numRecords, totalLength = self._length
-            self.metadata.totalLength = totalLength
-            self.metadata.numRecords = numRecords
+            self._metadata.totalLength = totalLength
+            self._metadata.numRecords = numRecords
             self._countsUpdated = True
         except (IOError, UnavailableFeature):
             if not self._strict:
                 log.debug("File problem, metadata not populated")
-                self.metadata.totalLength = 0
-                self.metadata.numRecords = 0
+                self._metadata.totalLength = 0
+                self._metadata.numRecords = 0
             else:
                 raise
 
@@ -2827,9 +3454,51 @@ class AlignmentSet(ReadSet):
             rname2tid = dict(zip(unfilteredRefTable['Name'],
                             unfilteredRefTable['ID']))
             #nameMap = self.refIds
-            for tId in tIdMap.keys():
-                tId_acc(indices)[tId_acc(indices) == tId] = rname2tid[
-                    tIdMap[tId]]
+            _remapIndexIds(rr, 'tId', tId_acc(indices),
+                           {tId: rname2tid[name]
+                            for tId, name in tIdMap.items()})
+
+    def _indexSegment(self, rrNum, rr, correctIds=True):
+        """The index records of one resource reader that conform to the
+        filters, and their row numbers in that reader"""
+        indices = rr.index
+        # pbi files lack e.g. mapping cols when bam emtpy, ignore
+        # TODO(mdsmith)(2016-01-19) rename the fields instead of branching:
+        #if self.isCmpH5:
+        #    _renameField(indices, 'MovieID', 'qId')
+        #    _renameField(indices, 'RefGroupID', 'tId')
+        if not self.isCmpH5:
+            indices = indices._tbl
+
+        # Correct tId field
+        self._fixTIds(indices, rr, correctIds)
+
+        # Correct qId field
+        self._fixQIds(indices, rr)
+
+        # filter
+        if not self._filters or self.noFiltering:
+            return indices, np.arange(len(indices))
+        passes = self._filterPasses(
+            getattr(rr, 'filename', rrNum), indices,
+            lambda filters, records: filters.filterIndexRecords(
+                records, self.refIds, self.movieIds))
+        return indices[passes], np.flatnonzero(passes)
+
+    def _indexIdMaps(self):
+        idMaps = super(AlignmentSet, self)._indexIdMaps()
+        unfilteredRefTable = self._buildRefInfoTable(filterMissing=False)
+        idMaps['tId'] = dict(zip(unfilteredRefTable['Name'],
+                                 unfilteredRefTable['ID']))
+        return idMaps
+
+    def _fixIndexIds(self, rr):
+        self._fixTIds(rr.index._tbl, rr)
+        super(AlignmentSet, self)._fixIndexIds(rr)
+
+    def _extendResources(self, extResources):
+        self.__referenceIdMap = None
+        return super(AlignmentSet, self)._extendResources(extResources)
 
     def _indexRecords(self, correctIds=True):
         """Returns index records summarizing all of the records in all of
@@ -2839,37 +3508,12 @@ class AlignmentSet(ReadSet):
         """
         recArrays = []
         log.debug("Processing resource indices")
-        _indexMap = []
+        _indexMap = [_indexMapSegment(0, [])]
         for rrNum, rr in enumerate(self.resourceReaders()):
-            indices = rr.index
-            # pbi files lack e.g. mapping cols when bam emtpy, ignore
-            # TODO(mdsmith)(2016-01-19) rename the fields instead of branching:
-            #if self.isCmpH5:
-            #    _renameField(indices, 'MovieID', 'qId')
-            #    _renameField(indices, 'RefGroupID', 'tId')
-            if not self.isCmpH5:
-                indices = indices._tbl
-
-            # Correct tId field
-            self._fixTIds(indices, rr, correctIds)
-
-            # Correct qId field
-            self._fixQIds(indices, rr)
-
-            # filter
-            if not self._filters or self.noFiltering:
-                recArrays.append(indices)
-                _indexMap.extend([(rrNum, i) for i in
-                                  range(len(indices))])
-            else:
-                passes = self._filters.filterIndexRecords(indices, self.refIds,
-                                                          self.movieIds)
-                newInds = indices[passes]
-                recArrays.append(newInds)
-                _indexMap.extend([(rrNum, i) for i in
-                                  np.flatnonzero(passes)])
-        self._indexMap = np.array(_indexMap, dtype=[('reader', 'uint64'),
-                                                    ('index', 'uint64')])
+            records, rows = self._indexSegment(rrNum, rr, correctIds)
+            recArrays.append(records)
+            _indexMap.append(_indexMapSegment(rrNum, rows))
+        self._indexMap = np.concatenate(_indexMap)
         if recArrays == []:
             return recArrays
         tbr = _stackRecArrays(recArrays)
@@ -3044,6 +3688,59 @@ class AlignmentSet(ReadSet):
         else:
             return len(self.index)
 
+    def _referenceCounts(self):
+        """Count the records and aligned reference bases of every reference
+        in one pass over the index (np.bincount on tId), rather than masking
+        the index once per reference.
+
+        Returns:
+            A dict of refName: (numRecords, alignedBases) for the references
+            with records
+        """
+        if not len(self.index):
+            return {}
+        tIds = self.tId
+        mapped = tIds >= 0
+        tIds = tIds[mapped]
+        spans = (self.index.tEnd[mapped].astype(np.int64) -
+                 self.index.tStart[mapped])
+        counts = np.bincount(tIds)
+        bases = np.bincount(tIds, weights=spans)
+        return {name: (int(counts[tId]), int(bases[tId]))
+                for name, tId in self.refIds.iteritems()
+                if 0 <= tId < len(counts) and counts[tId]}
+
+    def _windowCounts(self, windows):
+        """Count the records overlapping each of many (refName, start, end)
+        windows (as countRecords would). The index is sorted once, by tId and
+        then tStart or tEnd, and each count is the difference of two
+        searchsorted positions: the records that start before the end of the
+        window less those that end before its start.
+
+        Args:
+            :windows: An iterable of (refName, start, end) tuples
+
+        Returns:
+            A list of counts, one per window
+        """
+        windows = list(windows)
+        if not windows or not len(self.index):
+            return [0] * len(windows)
+        refIds = self.refIds
+        tIds = self.tId.astype(np.int64)
+        mapped = tIds >= 0
+        tIds = tIds[mapped] << 32
+        startKeys = np.sort(tIds + self.index.tStart[mapped])
+        endKeys = np.sort(tIds + self.index.tEnd[mapped])
+        winIds = np.array([refIds.get(w[0], -1)
+                           for w in windows], dtype=np.int64) << 32
+        winStarts = np.array([w[1] for w in windows], dtype=np.int64)
+        winEnds = np.array([w[2] for w in windows], dtype=np.int64)
+        counts = (np.searchsorted(startKeys, winIds + winEnds, 'left') -
+                  np.searchsorted(endKeys, winIds + winStarts, 'right'))
+        counts[winIds < 0] = 0
+        return counts.tolist()
+
     def readsInReference(self, refName):
         """A generator of (usually) BamAlignment objects for the
         reads in one or more Bam files pointed to by the ExternalResources in
@@ -3155,8 +3852,74 @@ class AlignmentSet(ReadSet):
                 shiftedAtoms.append(rAtoms[0])
         return shiftedAtoms
 
+    def _coverageWindows(self, chunks):
+        """Cut the references into 'chunks' runs of reference windows with
+        equal numbers of aligned bases, i.e. at the quantiles of the
+        cumulative coverage across the whole reference set.
+
+        The cumulative aligned bases along a reference are piecewise linear,
+        with breakpoints where reads start or end. So the profile comes from
+        the sorted tStart/tEnd of the pbi, tiled into one coordinate
+        (tId << 32 | position), rather than from a per-base coverage array
+        (see intervalContour).
+
+        Returns:
+            A list of chunks, each a list of (rname, start, end) windows.
+            Cuts that coincide (e.g. in a deep pileup) yield fewer chunks
+        """
+        tIds = self.tId.astype(np.int64)
+        mapped = tIds >= 0
+        tIds = tIds[mapped]
+        if not len(tIds):
+            return []
+        starts = (tIds << 32) | self.index.tStart[mapped]
+        ends = (tIds << 32) | self.index.tEnd[mapped]
+        keys = np.concatenate([starts, ends])
+        order = np.argsort(keys, kind='mergesort')
+        keys = keys[order]
+        depth = np.cumsum(np.concatenate([np.ones(len(starts), np.int64),
+                                          -np.ones(len(ends), np.int64)])[
+                                              order])
+        # aligned bases before each breakpoint (depth is 0 between
+        # references):
+        cumBases = np.zeros(len(keys), dtype=np.int64)
+        np.cumsum(depth[:-1] * np.diff(keys), out=cumBases[1:])
+
+        targets = cumBases[-1] * np.arange(1, chunks, dtype=np.float64) / chunks
+        segment = np.searchsorted(cumBases, targets, 'right') - 1
+        segDepth = depth[segment]
+        offsets = (targets - cumBases[segment]) / np.maximum(segDepth, 1)
+        cuts = keys[segment] + np.rint(offsets).astype(np.int64)
+        # cuts between references go to the start of the next one:
+        nextKeys = keys[np.minimum(segment + 1, len(keys) - 1)]
+        between = (segDepth == 0) & ((nextKeys >> 32) != (cuts >> 32))
+        cuts[between] = (nextKeys[between] >> 32) << 32
+        contigs = np.unique(tIds)
+        cuts = np.concatenate([[contigs[0] << 32], cuts,
+                               [(contigs[-1] << 32) | 0xffffffff]])
+
+        refLens = self.refLengths
+        tid2rname = self.tid2rname
+        windows = []
+        for begin, end in zip(cuts[:-1], cuts[1:]):
+            firstTid, firstPos = begin >> 32, begin & 0xffffffff
+            lastTid, lastPos = end >> 32, end & 0xffffffff
+            chunk = []
+            for tId in contigs[(contigs >= firstTid) & (contigs <= lastTid)]:
+                rname = tid2rname[tId]
+                winStart = firstPos if tId == firstTid else 0
+                winEnd = refLens[rname]
+                if tId == lastTid:
+                    winEnd = min(lastPos, winEnd)
+                if winEnd > winStart:
+                    chunk.append((rname, int(winStart), int(winEnd)))
+            if chunk:
+                windows.append(chunk)
+        return windows
+
     def _split_contigs(self, chunks, maxChunks=0, breakContigs=False,
-                       targetSize=5000, byRecords=False, updateCounts=True):
+                       targetSize=5000, byRecords=False, updateCounts=True,
+                       byCoverage=False):
         """Split a dataset into reference windows based on contigs.
 
         Args:
@@ -3165,8 +3928,14 @@ class AlignmentSet(ReadSet):
                      contig is assigned to each dataset regardless of size. If
                      chunks >= contigs, contigs are split into roughly equal
                      chunks (<= 1.0 contig per file).
+            :byCoverage: Cut the reference set into windows of equal aligned
+                         bases (see _coverageWindows), for skewed coverage
 
         """
+        if byCoverage:
+            return self._split_contigs_by_coverage(
+                chunks, maxChunks, breakContigs, targetSize=targetSize,
+                updateCounts=updateCounts)
         # removed the non-trivial case so that it is still filtered to just
         # contigs with associated records
 
@@ -3179,22 +3948,24 @@ class AlignmentSet(ReadSet):
         log.debug("{i} references found".format(i=len(refNames)))
 
         log.debug("Finding contigs")
+        # all references are counted in one pass over the index:
+        refCounts = self._referenceCounts()
         if byRecords:
             log.debug("Counting records...")
-            atoms = [(rn, 0, 0, count)
-                     for rn, count in zip(refNames, map(self.countRecords,
-                                                        refNames))
-                     if count != 0]
-            balanceKey = lambda x: self.countRecords(*x)
+            atoms = [(rn, 0, 0, refCounts[rn][0])
+                     for rn in refNames if rn in refCounts]
+            windowCounts = {}
+            def balanceKey(x):
+                # windows are counted in bulk, when first needed
+                x = tuple(x)
+                if not x in windowCounts:
+                    todo = [tuple(atom) for atom in atoms
+                            if not tuple(atom) in windowCounts]
+                    windowCounts.update(zip(todo, self._windowCounts(todo)))
+                return windowCounts[x]
         else:
-            # if there are that many references, on average they will probably
-            # be distributed pretty evenly. Checking the counts will also be
-            # super expensive
-            if len(refNames) < 100:
-                atoms = [(rn, 0, refLens[rn]) for rn in refNames if
-                         self.countRecords(rn) != 0]
-            else:
-                atoms = [(rn, 0, refLens[rn]) for rn in refNames]
+            atoms = [(rn, 0, refLens[rn]) for rn in refNames
+                     if rn in refCounts]
             balanceKey = lambda x: x[2] - x[1]
         log.debug("{i} contigs found".format(i=len(atoms)))
 
@@ -3294,12 +4065,46 @@ class AlignmentSet(ReadSet):
         chunks = self._chunkList(atoms, chunks, balanceKey)
 
         log.debug("Done chunking")
+        return self._applyContigChunks(results, chunks, bool(atoms[0][2]),
+                                       updateCounts)
+
+    def _split_contigs_by_coverage(self, chunks, maxChunks=0,
+                                   breakContigs=False, targetSize=5000,
+                                   updateCounts=True):
+        """Split a dataset into runs of reference windows with equal numbers
+        of aligned bases. The number of chunks defaults to the number of
+        contigs with records, and is otherwise chosen as in _split_contigs.
+        """
+        if not chunks:
+            chunks = len(self._referenceCounts())
+        if maxChunks and chunks > maxChunks:
+            log.debug("maxChunks trumps chunks")
+            chunks = maxChunks
+        if maxChunks and breakContigs:
+            chunks = int(self.numRecords//targetSize)
+            chunks = min(max(chunks, 2), maxChunks)
+            log.debug("Resulting number of chunks: {i}".format(i=chunks))
+        chunks = max(chunks, 1)
+
+        log.debug("Cutting {n} chunks of equal coverage".format(n=chunks))
+        windows = self._coverageWindows(chunks)
+        if not windows:
+            return [self.copy()]
+        log.debug("Making copies")
+        results = [self.copy() for _ in windows]
+        return self._applyContigChunks(results, windows, True, updateCounts)
+
+    def _applyContigChunks(self, results, chunks, windowed, updateCounts):
+        """Restrict each of the results to the contigs, or (rname, start, end)
+        reference windows if windowed, of its chunk. Then give each a new
+        UniqueId and update its counts.
+        """
         log.debug("Modifying filters or resources")
         for result, chunk in zip(results, chunks):
             # we don't want to updateCounts or anything right now, so we'll
             # block that functionality:
             result._filters.clearCallbacks()
-            if atoms[0][2]:
+            if windowed:
                 result._filters.addRequirement(
                     rname=[('=', c[0]) for c in chunk],
                     tStart=[('<', c[2]) for c in chunk],
@@ -3648,6 +4453,13 @@ class AlignmentSet(ReadSet):
     def tEnd(self):
         return self._checkIdentical('tEnd')
 
+    def _recordLengths(self, indices):
+        """The per-record aligned lengths summed into TotalLength"""
+        if not 'aEnd' in indices.dtype.names:
+            # empty or not actually mapped, see _length
+            return np.zeros(len(indices), dtype=np.int64)
+        return indices.aEnd.astype(np.int64) - indices.aStart
+
     @property
     def _length(self):
         """Used to populate metadata in updateCounts. We're using the pbi here,
@@ -3682,7 +4494,7 @@ class AlignmentSet(ReadSet):
 
     @property
     def _referenceFile(self):
-        responses = [res.reference for res in self.externalResources]
+        responses = [res.reference for res in self._externalResources]
         return self._unifyResponses(responses)
 
     @property
@@ -3947,59 +4759,85 @@ class ContigSet(DataSet):
 
     def __init__(self, *files, **kwargs):
         self._fastq = False
+        self._contigRowCache = None
+        self._headerIndexCache = None
         super(ContigSet, self).__init__(*files, **kwargs)
-        # weaken by permitting failure to allow BarcodeSet to have own
-        # Metadata type
-        try:
-            self._metadata = ContigSetMetadata(self._metadata)
-            self._updateMetadata()
-        except TypeError:
-            pass
+        # the metadata already has the subtype's Metadata type (see
+        # _castMetadata), BarcodeSet included
+        self._updateMetadata()
 
     def split(self, nchunks):
         log.debug("Getting and dividing contig id's")
-        keys = self.index.id
+        keys = self._contigIndex().id
         chunks = divideKeys(keys, nchunks)
         log.debug("Creating copies of the dataset")
         results = [self.copy() for _ in range(nchunks)]
         log.debug("Applying filters and updating counts")
+        # With unique ids each chunk is a contiguous block of rows in the
+        # index, and its counts can be read straight from the index:
+        unique = len(self._contigRows()) == len(keys)
+        lengths = self._contigIndex().length
+        start = 0
         for chunk, res in zip(chunks, results):
             res._filters.addRequirement(id=[('=', n) for n in chunk])
             res.newUuid()
             log.debug("Updating new res counts:")
-            res.updateCounts()
+            if unique:
+                end = start + len(chunk)
+                res.metadata.totalLength = int(lengths[start:end].sum())
+                res.metadata.numRecords = len(chunk)
+                res._countsUpdated = True
+                start = end
+            else:
+                res.updateCounts()
         return results
 
     def consolidate(self, outfn=None, numFiles=1, useTmp=False):
         """Consolidation should be implemented for window text in names and
-        for filters in ContigSets"""
+        for filters in ContigSets
+
+        Window pieces are grouped by contig name using the index (when the
+        resources are indexed), and streamed in window order into the new
+        file(s), which are indexed in the same pass.
 
-        if numFiles != 1:
-            raise NotImplementedError(
-                "Only one output file implemented so far.")
+        Args:
+            :outfn: The name of the output file. If numFiles >1 numbers will
+                    be added.
+            :numFiles: The number of files the contigs are divided among,
+                       written in parallel.
 
+        """
         # In general "name" here refers to the contig.id only, which is why we
         # also have to keep track of comments.
         log.debug("Beginning consolidation")
-        # Get the possible keys
-        names = self.contigNames
-        winless_names = [self._removeWindow(name) for name in names]
+        indexed = self.isIndexed
+        if indexed:
+            # (reader, row) pieces, the sequence data isn't touched yet
+            pieces = itertools.izip(
+                self._contigIndex().id, ((int(rrNum), int(recNum))
+                                for rrNum, recNum in self._indexMap))
+        else:
+            pieces = ((con.id, con) for con in self.contigs)
 
         # Put them into buckets
-        matches = {}
-        for con in self.contigs:
-            conId = con.id
+        matches = OrderedDict()
+        for conId, piece in pieces:
             window = self._parseWindow(conId)
             if not window is None:
                 conId = self._removeWindow(conId)
-            if conId not in matches:
-                matches[conId] = [con]
-            else:
-                matches[conId].append(con)
+            matches.setdefault(conId, []).append((window, piece))
+
         for name, match_list in matches.items():
-            matches[name] = np.array(match_list)
+            if len(match_list) > 1:
+                if any(window is None for window, _ in match_list):
+                    log.error("Windows not found for all items with a "
+                              "matching id, consolidation aborted")
+                    return
+                log.debug("Multiple matches found for {i}".format(i=name))
+                # order windows
+                match_list.sort(key=lambda match: match[0][0])
 
-        writeTemp = False
+        writeTemp = numFiles > 1
         # consolidate multiple files into one
         if len(self.toExternalFiles()) > 1:
             writeTemp = True
@@ -4008,92 +4846,78 @@ class ContigSet(DataSet):
         if not writeTemp:
             writeTemp = any([len(m) > 1 for n, m in matches.items()])
 
-        def _get_windows(match_list):
-            # look for the quiver window indication scheme from quiver:
-            windows = np.array([self._parseWindow(match.id)
-                                for match in match_list])
-            for win in windows:
-                if win is None:
-                    raise ValueError("Windows not found for all items with a "
-                                     "matching id, consolidation aborted")
-            return windows
-
-        for name, match_list in matches.items():
-            if len(match_list) > 1:
-                try:
-                    windows = _get_windows(match_list)
-                except ValueError as e:
-                    log.error(e)
-                    return
+        if not writeTemp:
+            log.warn("No need to write a new resource file, using current "
+                     "resource instead.")
+            self._populateMetaTypes()
+            return
 
-        def _get_merged_sequence(name):
-            match_list = matches.pop(name)
-            if len(match_list) > 1:
-                log.debug("Multiple matches found for {i}".format(i=name))
-                windows = _get_windows(match_list)
-                # order windows
-                order = np.argsort([window[0] for window in windows])
-                match_list = match_list[order]
-                windows = windows[order]
-                # TODO: check to make sure windows/lengths are compatible,
-                # complete
-
-                # collapse matches
-                new_name = self._removeWindow(name)
-                seq = ''.join([match.sequence[:] for match in match_list])
-                quality = None
-                if self._fastq:
-                    quality = ''.join([match.qualityString for match in match_list])
-                return (seq, match_list[0].comment, quality)
+        log.debug("Writing a new file is necessary")
+        if not outfn:
+            log.debug("Writing to a temp directory as no path given")
+            outdir = tempfile.mkdtemp(suffix="consolidated-contigset")
+            if self._fastq:
+                outfn = os.path.join(outdir,
+                                     'consolidated_contigs.fastq')
             else:
-                log.debug("One match found for {i}".format(i=name))
-                seq = match_list[0].sequence[:]
-                quality = None
-                if self._fastq:
-                   quality = match_list[0].qualityString
-                return (seq, match_list[0].comment, quality)
-        if writeTemp:
-            log.debug("Writing a new file is necessary")
-            if not outfn:
-                log.debug("Writing to a temp directory as no path given")
-                outdir = tempfile.mkdtemp(suffix="consolidated-contigset")
-                if self._fastq:
-                    outfn = os.path.join(outdir,
-                                         'consolidated_contigs.fastq')
-                else:
-                    outfn = os.path.join(outdir,
-                                         'consolidated_contigs.fasta')
-            with self._writer(outfn) as outfile:
-                log.debug("Writing new resource {o}".format(o=outfn))
-                for name in list(matches.keys()):
-                    seq, comments, quality = _get_merged_sequence(name)
-                    if comments:
-                        name = ' '.join([name, comments])
-                    if self._fastq:
-                        outfile.writeRecord(name, seq, qvsFromAscii(quality))
+                outfn = os.path.join(outdir,
+                                     'consolidated_contigs.fasta')
+        # empty datasets still get an (empty) file
+        shards = (divideKeys(matches.items(), max(numFiles, 1)) if matches
+                  else [[]])
+        if numFiles > 1:
+            fnames = [_infixFname(outfn, str(i)) for i in range(len(shards))]
+        else:
+            fnames = [outfn]
+        filenames = [rr.filename for rr in self.resourceReaders()]
+        readerType = IndexedFastqReader if self._fastq else IndexedFastaReader
+        fastq = self._fastq
+
+        def _writeShard(args):
+            shard, fname = args
+            log.debug("Writing new resource {o}".format(o=fname))
+            readers = []
+            if indexed:
+                # mmapped views are cheap to open, and not shared between
+                # the writing threads:
+                readers = ([readerType(fn) for fn in filenames]
+                           if len(shards) > 1 else self.resourceReaders())
+            def _contigs():
+                for name, match_list in shard:
+                    if indexed:
+                        records = [readers[rrNum][recNum]
+                                   for _, (rrNum, recNum) in match_list]
                     else:
-                        outfile.writeRecord(name, seq)
-            if not self._fastq:
-                _indexFasta(outfn)
-            # replace resources
-            log.debug("Replacing resources")
-            self.externalResources = ExternalResources()
-            self.addExternalResources([outfn])
-            self._index = None
-            self._indexMap = None
-            self._openReaders = []
-            self._populateMetaTypes()
-            self.updateCounts()
+                        records = [con for _, con in match_list]
+                    comment = records[0].comment
+                    if comment:
+                        name = ' '.join([name, comment])
+                    yield name, records
+            try:
+                _writeContigs(fname, _contigs(), fastq=fastq)
+            finally:
+                if len(shards) > 1:
+                    for reader in readers:
+                        reader.close()
+
+        if len(shards) > 1:
+            pool = ThreadPool(len(shards))
+            try:
+                pool.map(_writeShard, zip(shards, fnames))
+            finally:
+                pool.close()
+                pool.join()
         else:
-            log.warn("No need to write a new resource file, using current "
-                     "resource instead.")
+            _writeShard((shards[0], fnames[0]))
+        # replace resources
+        log.debug("Replacing resources")
+        self.externalResources = ExternalResources()
+        self.addExternalResources(fnames)
+        self._index = None
+        self._indexMap = None
+        self._openReaders = []
         self._populateMetaTypes()
-
-    @property
-    def _writer(self):
-        if self._fastq:
-            return FastqWriter
-        return FastaWriter
+        self.updateCounts()
 
     def _popSuffix(self, name):
         """Chunking and quivering adds suffixes to contig names, after the
@@ -4161,8 +4985,9 @@ class ContigSet(DataSet):
             return
         try:
             log.debug('Updating counts')
-            self.metadata.totalLength = sum(self.index.length)
-            self.metadata.numRecords = len(self.index)
+            index = self._contigIndex()
+            self.metadata.totalLength = sum(index.length)
+            self.metadata.numRecords = len(index)
             self._countsUpdated = True
         except (IOError, UnavailableFeature, TypeError):
             # IOError for missing files
@@ -4192,29 +5017,23 @@ class ContigSet(DataSet):
         # Pull generic values, kwargs, general treatment in super
         super(ContigSet, self).addMetadata(newMetadata, **kwargs)
 
-    @property
-    def metadata(self):
-        if not isinstance(self._metadata, ContigSetMetadata):
-           self._metadata = ContigSetMetadata(self._metadata)
-        return self._metadata
-
-    @metadata.setter
-    def metadata(self, value):
-        if not isinstance(value, ContigSetMetadata):
-            value = ContigSetMetadata(value)
-        self._metadata = value
+    def _castMetadata(self, metadata):
+        if not isinstance(metadata, ContigSetMetadata):
+            metadata = ContigSetMetadata(metadata)
+        return metadata
 
     def _openFiles(self):
         """Open the files (assert they exist, assert they are of the proper
         type before accessing any file)
         """
+        self._runDeferred()
         if self._openReaders:
             log.debug("Closing old {t} readers".format(
                 t=self.__class__.__name__))
             self.close()
         log.debug("Opening {t} resources".format(
             t=self.__class__.__name__))
-        for extRes in self.externalResources:
+        for extRes in self._externalResources:
             resource = self._openFile(urlparse(extRes.resourceId).path)
             if resource is not None:
                 self._openReaders.append(resource)
@@ -4227,7 +5046,10 @@ class ContigSet(DataSet):
         resource = None
         if location.endswith("fastq"):
             self._fastq = True
-            resource = FastqReader(location)
+            try:
+                resource = IndexedFastqReader(location)
+            except IOError:
+                resource = FastqReader(location)
         else:
             try:
                 resource = IndexedFastaReader(location)
@@ -4268,7 +5090,6 @@ class ContigSet(DataSet):
         return self._openReaders
 
     @property
-    @filtered
     def contigs(self):
         """A generator of contigs from the fastaReader objects for the
         ExternalResources in this ReferenceSet.
@@ -4277,20 +5098,97 @@ class ContigSet(DataSet):
             A fasta file entry
 
         """
+        if self.isIndexed:
+            # the (filtered) index already knows which rows pass, and
+            # indexed records only read their sequence on request
+            _ = self._contigIndex()
+            readers = self.resourceReaders()
+            for rrNum, recNum in self._indexMap:
+                yield readers[rrNum][int(recNum)]
+        else:
+            for contig in self._streamContigs():
+                yield contig
+
+    @filtered
+    def _streamContigs(self):
         for resource in self.resourceReaders():
             for contig in resource:
                 yield contig
 
+    @property
+    def index(self):
+        """The index records of the (filtered) contigs: id, comment, header,
+        length, offset, lineWidth and stride. The comment and header columns
+        are read from the FASTA files on first access."""
+        index = self._contigIndex()
+        if (self._headerIndexCache is None or
+                self._headerIndexCache[0] is not index):
+            readers = self.resourceReaders()
+            headers = [readers[rrNum].fai.header(int(recNum))
+                       for rrNum, recNum in self._indexMap]
+            comments = [splitFastaHeader(header)[1] for header in headers]
+            withHeaders = np.rec.fromarrays(
+                [index.id, np.array(comments, dtype='O'),
+                 np.array(headers, dtype='O'), index.length, index.offset,
+                 index.lineWidth, index.stride],
+                dtype=[('id', 'O'), ('comment', 'O'), ('header', 'O'),
+                       ('length', '<i8'), ('offset', '<i8'),
+                       ('lineWidth', '<i8'), ('stride', '<i8')])
+            self._headerIndexCache = (index, withHeaders)
+        return self._headerIndexCache[1]
+
+    def _contigIndex(self):
+        """The index records without the comment and header columns, which
+        only need the .fai files"""
+        return super(ContigSet, self).index
+
+    def _contigRows(self):
+        """A dict from contig id to its (first) row in the index"""
+        index = self._contigIndex()
+        if (self._contigRowCache is None or
+                self._contigRowCache[0] is not index):
+            rows = {}
+            for row, name in enumerate(index.id):
+                rows.setdefault(name, row)
+            self._contigRowCache = (index, rows)
+        return self._contigRowCache[1]
+
+    def __getitem__(self, index):
+        if self.isIndexed:
+            # resolve against the header-less index, so that record access
+            # doesn't read every header
+            if self._indexMap is None:
+                self._contigIndex()
+            if isinstance(index, int) and index < 0:
+                index += len(self._contigIndex())
+        if isinstance(index, basestring) and self.isIndexed:
+            row = self._contigRows().get(index)
+            if row is None:
+                raise IndexError("Contig {i} not found".format(i=index))
+            return self[row]
+        return super(ContigSet, self).__getitem__(index)
+
     def get_contig(self, contig_id):
         """Get a contig by ID"""
-        # TODO: have this use getitem for indexed fasta readers:
+        if self.isIndexed:
+            rows = self._contigRows()
+            row = rows.get(contig_id)
+            if row is not None:
+                return self[row]
+            # a full header (name) was given:
+            row = rows.get(splitFastaHeader(contig_id)[0])
+            if row is not None:
+                contig = self[row]
+                if contig.name == contig_id:
+                    return contig
+            return None
         for contig in self.contigs:
             if contig.id == contig_id or contig.name == contig_id:
                 return contig
 
     def assertIndexed(self):
         try:
-            self._assertIndexed(IndexedFastaReader)
+            self._assertIndexed((IndexedFastaReader, IndexedFastqReader))
         except IOError:
             raise IOError("Companion FASTA index (.fai) file not found or "
                           "malformatted! Use 'samtools faidx' to generate "
@@ -4301,7 +5199,8 @@ class ContigSet(DataSet):
     def isIndexed(self):
         try:
             res = self._pollResources(
-                lambda x: isinstance(x, IndexedFastaReader))
+                lambda x: isinstance(x, (IndexedFastaReader,
+                                         IndexedFastqReader)))
             return self._unifyResponses(res)
         except ResourceMismatchError:
             if not self._strict:
@@ -4320,8 +5219,8 @@ class ContigSet(DataSet):
     def contigNames(self):
         """The names assigned to the External Resources, or contigs if no name
         assigned."""
-        # TODO{mdsmith}{3/10/2016} Make this faster by using (optionally) the
-        # index file
+        if self.isIndexed:
+            return sorted(set(self._contigIndex().id))
         names = []
         for contig in self.contigs:
             if self.noFiltering:
@@ -4336,6 +5235,8 @@ class ContigSet(DataSet):
                 'fastq':'PacBio.ContigFile.ContigFastqFile',
                 'fa':'PacBio.ContigFile.ContigFastaFile',
                 'fas':'PacBio.ContigFile.ContigFastaFile',
+                'fasta.gz':'PacBio.ContigFile.ContigFastaFile',
+                'fa.gz':'PacBio.ContigFile.ContigFastaFile',
                 'fai':'PacBio.Index.SamIndex',
                 'contig.index':'PacBio.Index.FastaContigIndex',
                 'index':'PacBio.Index.Indexer',
@@ -4351,15 +5252,9 @@ class ContigSet(DataSet):
         recArrays = []
         _indexMap = []
         for rrNum, rr in enumerate(self.resourceReaders()):
-            indices = rr.fai
-            if len(indices) == 0:
+            if len(rr.fai) == 0:
                 continue
-            # have to manually specify the dtype to make it work like a pbi
-            indices = np.rec.fromrecords(
-                indices,
-                dtype=[('id', 'O'), ('comment', 'O'), ('header', 'O'),
-                       ('length', '<i8'), ('offset', '<i8'),
-                       ('lineWidth', '<i8'), ('stride', '<i8')])
+            indices = rr.fai.toRecArray(headers=False)
 
             if not self._filters or self.noFiltering:
                 recArrays.append(indices)
@@ -4370,8 +5265,10 @@ class ContigSet(DataSet):
                 # dummy map, the id is the name in fasta space
                 nameMap = {name: name for name in indices.id}
 
-                passes = self._filters.filterIndexRecords(indices, nameMap, {},
-                                                          readType='fasta')
+                passes = self._filterPasses(
+                    getattr(rr, 'filename', rrNum), indices,
+                    lambda filters, records: filters.filterIndexRecords(
+                        records, nameMap, {}, readType='fasta'))
                 newInds = indices[passes]
                 recArrays.append(newInds)
                 _indexMap.extend([(rrNum, i) for i in
@@ -4381,8 +5278,7 @@ class ContigSet(DataSet):
         if len(recArrays) == 0:
             recArrays = [np.array(
                 [],
-                dtype=[('id', 'O'), ('comment', 'O'), ('header', 'O'),
-                       ('length', '<i8'), ('offset', '<i8'),
+                dtype=[('id', 'O'), ('length', '<i8'), ('offset', '<i8'),
                        ('lineWidth', '<i8'), ('stride', '<i8')])]
         return _stackRecArrays(recArrays)
 
@@ -4409,6 +5305,8 @@ class ReferenceSet(ContigSet):
         return {'fasta':'PacBio.ContigFile.ContigFastaFile',
                 'fa':'PacBio.ContigFile.ContigFastaFile',
                 'fas':'PacBio.ContigFile.ContigFastaFile',
+                'fasta.gz':'PacBio.ContigFile.ContigFastaFile',
+                'fa.gz':'PacBio.ContigFile.ContigFastaFile',
                 'fai':'PacBio.Index.SamIndex',
                 'contig.index':'PacBio.Index.FastaContigIndex',
                 'index':'PacBio.Index.Indexer',
@@ -4437,6 +5335,8 @@ class GmapReferenceSet(ReferenceSet):
         return {'fasta':'PacBio.ContigFile.ContigFastaFile',
                 'fa':'PacBio.ContigFile.ContigFastaFile',
                 'fas':'PacBio.ContigFile.ContigFastaFile',
+                'fasta.gz':'PacBio.ContigFile.ContigFastaFile',
+                'fa.gz':'PacBio.ContigFile.ContigFastaFile',
                 'fai':'PacBio.Index.SamIndex',
                 'contig.index':'PacBio.Index.FastaContigIndex',
                 'index':'PacBio.Index.Indexer',
@@ -4452,8 +5352,6 @@ class BarcodeSet(ContigSet):
 
     def __init__(self, *files, **kwargs):
         super(BarcodeSet, self).__init__(*files, **kwargs)
-        self._metadata = BarcodeSetMetadata(self._metadata.record)
-        self._updateMetadata()
 
     def addMetadata(self, newMetadata, **kwargs):
         """Add metadata specific to this subtype, while leaning on the
@@ -4476,17 +5374,10 @@ class BarcodeSet(ContigSet):
         # Pull subtype specific values where important
         # -> No type specific merging necessary, for now
 
-    @property
-    def metadata(self):
-        if not isinstance(self._metadata, BarcodeSetMetadata):
-           self._metadata = BarcodeSetMetadata(self._metadata)
-        return self._metadata
-
-    @metadata.setter
-    def metadata(self, value):
-        if not isinstance(value, BarcodeSetMetadata):
-            value = BarcodeSetMetadata(value)
-        self._metadata = value
+    def _castMetadata(self, metadata):
+        if not isinstance(metadata, BarcodeSetMetadata):
+            metadata = BarcodeSetMetadata(metadata)
+        return metadata
 
     def _updateMetadata(self):
         # update barcode specific metadata:
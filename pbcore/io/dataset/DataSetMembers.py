@@ -71,6 +71,8 @@ import os
 import operator as OP
 import numpy as np
 import re
+import weakref
+from itertools import izip
 from urlparse import urlparse
 from urllib import unquote
 from functools import partial as P
@@ -193,34 +195,153 @@ def isFile(string):
         return True
     return False
 
-def qnamer(qid2mov, qId, hn, qs, qe):
-    movs = np.empty_like(qId, dtype='S{}'.format(
-        max(map(len, qid2mov.values()))))
-    for k, v in qid2mov.items():
-        movs[qId == k] = v
-    return (movs, hn, qs, qe)
-
-def breakqname(qname):
-    tbr = []
-    chunks = qname.split('/')
-    # movie:
-    if len(chunks) > 0:
-        tbr.append(chunks[0])
-    # holenumber:
-    if len(chunks) > 1:
-        tbr.append(int(chunks[1]))
-    # qstart, end
-    if len(chunks) > 2:
-        span = chunks[2].split('_')
-        if len(span) == 2:
-            tbr.append(int(span[0]))
-            tbr.append(int(span[1]))
-    return tbr
-
-def qname2vec(qnames):
-    if isinstance(qnames, str):
-        qnames = [qnames]
-    return zip(*[breakqname(q) for q in qnames])
+def qnamer(qId, hn, qs, qe):
+    return (qId, hn, qs, qe)
+
+# Number of whitelist names parsed into Python lists before they are packed
+# into numpy key blocks. Keeps peak memory flat for very large whitelists:
+QNAME_BLOCK_SIZE = 1000000
+
+def packZmwKeys(qId, holeNumber):
+    """Pack (qId, holeNumber) columns into a single int64 key per row. The
+    keys sort in the same order as the (qId, holeNumber) tuples.
+
+    Doctest:
+        >>> from pbcore.io.dataset.DataSetMembers import packZmwKeys
+        >>> list(packZmwKeys([0, 1], [5, 2]))
+        [5, 4294967298]
+    """
+    qId = np.asarray(qId, dtype=np.int64)
+    holeNumber = np.asarray(holeNumber, dtype=np.int64)
+    return (qId << 32) | (holeNumber & 0xFFFFFFFF)
+
+def packSpanKeys(qStart, qEnd):
+    """Pack (qStart, qEnd) columns into a single int64 key per row"""
+    return packZmwKeys(qStart, qEnd)
+
+def _sortedIn(query, sortedKeys):
+    """Vectorized membership test of query against sorted, unique keys"""
+    if len(sortedKeys) == 0:
+        return np.zeros(len(query), dtype=np.bool_)
+    pos = np.searchsorted(sortedKeys, query)
+    pos[pos == len(sortedKeys)] = 0
+    return sortedKeys[pos] == query
+
+def _rankIn(query, sortedKeys):
+    """Position of each query in sorted, unique keys, and whether it is
+    actually present"""
+    pos = np.searchsorted(sortedKeys, query)
+    pos[pos == len(sortedKeys)] = 0
+    return pos, sortedKeys[pos] == query
+
+def iterQnames(value):
+    """Stream stripped read names from a whitelist file, a single name, or an
+    iterable of names. Blank lines are skipped."""
+    if isinstance(value, basestring):
+        if isFile(value):
+            with open(value, 'rU') as ifh:
+                for line in ifh:
+                    line = line.strip()
+                    if line:
+                        yield line
+            return
+        value = [value]
+    for name in value:
+        name = name.strip()
+        if name:
+            yield name
+
+class QnameKeys(object):
+    """A read name whitelist encoded as sorted int64 keys.
+
+    Names may be complete subread names (movie/holeNumber/qStart_qEnd), which
+    are matched on all four fields, ZMW names (movie/holeNumber, or
+    movie/holeNumber/ccs), which match every read from that ZMW, or bare movie
+    names. Movie names are mapped to qIds with movieMap; names from other
+    movies can never match and are dropped while parsing.
+
+    Complete names are joined on (qId, holeNumber, qStart, qEnd) by rank
+    compressing the zmw and span halves of the key against the whitelist's
+    unique values, so that the pair fits a single int64 that can be
+    searchsorted.
+    """
+
+    def __init__(self, names, movieMap):
+        empty = np.array([], dtype=np.int64)
+        movies = set()
+        zmwBlocks = []
+        fullBlocks = []
+        zq, zh = [], []
+        fq, fh, fs, fe = [], [], [], []
+        nskipped = 0
+
+        def flush():
+            if zq:
+                zmwBlocks.append(np.unique(packZmwKeys(zq, zh)))
+            if fq:
+                fullBlocks.append(np.unique(np.rec.fromarrays(
+                    [packZmwKeys(fq, fh), packSpanKeys(fs, fe)],
+                    names='zmw,span')))
+            for buf in (zq, zh, fq, fh, fs, fe):
+                del buf[:]
+
+        for name in names:
+            chunks = name.split('/')
+            qId = movieMap.get(chunks[0])
+            if qId is None:
+                nskipped += 1
+                continue
+            if len(chunks) == 1:
+                movies.add(qId)
+                continue
+            span = chunks[2].split('_') if len(chunks) > 2 else ()
+            if len(span) == 2:
+                fq.append(qId)
+                fh.append(int(chunks[1]))
+                fs.append(int(span[0]))
+                fe.append(int(span[1]))
+            else:
+                zq.append(qId)
+                zh.append(int(chunks[1]))
+            if len(zq) + len(fq) >= QNAME_BLOCK_SIZE:
+                flush()
+        flush()
+        if nskipped:
+            log.debug("Skipped {n} qnames from movies not in this "
+                      "dataset".format(n=nskipped))
+
+        self.movies = np.array(sorted(movies), dtype=np.int64)
+        self.zmws = (np.unique(np.concatenate(zmwBlocks))
+                     if zmwBlocks else empty)
+        if fullBlocks:
+            full = np.concatenate(fullBlocks)
+            self.fullZmws, zmwRank = np.unique(full['zmw'],
+                                               return_inverse=True)
+            self.fullSpans, spanRank = np.unique(full['span'],
+                                                 return_inverse=True)
+            self.fullPairs = np.unique(
+                zmwRank.astype(np.int64) * len(self.fullSpans) + spanRank)
+        else:
+            self.fullZmws = self.fullSpans = self.fullPairs = empty
+
+    def __len__(self):
+        return len(self.movies) + len(self.zmws) + len(self.fullPairs)
+
+    def contains(self, qId, holeNumber, qStart=None, qEnd=None):
+        """Return a boolean mask of the index rows that match any whitelisted
+        name"""
+        result = np.in1d(qId, self.movies)
+        recZmws = packZmwKeys(qId, holeNumber)
+        result |= _sortedIn(recZmws, self.zmws)
+        if len(self.fullPairs) and qStart is not None:
+            zmwRank, zmwHit = _rankIn(recZmws, self.fullZmws)
+            spanRank, spanHit = _rankIn(packSpanKeys(qStart, qEnd),
+                                        self.fullSpans)
+            cand = np.flatnonzero(zmwHit & spanHit)
+            pairs = (zmwRank[cand].astype(np.int64) * len(self.fullSpans) +
+                     spanRank[cand])
+            result[cand] |= _sortedIn(pairs, self.fullPairs)
+        return result
 
 class PbiFlags(object):
     NO_LOCAL_CONTEXT = 0
@@ -263,7 +384,7 @@ def getter(key, container='attrib', asType=(lambda x: x), parent=False):
         if parent:
             return asType(self.getV(container, key), parent=self)
         else:
-            return asType(self.getV(container, key))
+            return self._adopt(asType(self.getV(container, key)))
     return property(get)
 
 def setter(key, container='attrib'):
@@ -296,6 +417,130 @@ def updateNamespace(ele, ns):
         ele.namespace = ns
 
 
+class _ChildList(list):
+    """The 'children' list of a record, with a lazily built index of the
+    positions of each child tag. append and extend keep the index up to date,
+    popping the last child trims it, and other modifications drop it to be
+    rebuilt on the next lookup. Indices are never copied or pickled."""
+
+    _positions = None
+
+    def _index(self):
+        if self._positions is None:
+            positions = {}
+            for i, child in enumerate(self):
+                positions.setdefault(child['tag'], []).append(i)
+            self._positions = positions
+        return self._positions
+
+    def _invalidate(self):
+        self._positions = None
+
+    def positions(self, tag):
+        """The positions of the children with this tag, in order"""
+        positions = self._index().get(tag, [])
+        # a child record's tag may have been changed in place:
+        if any(self[i]['tag'] != tag for i in positions[:1]):
+            self._invalidate()
+            positions = self._index().get(tag, [])
+        return list(positions)
+
+    def first(self, tag):
+        """The position of the first child with this tag, like list.index"""
+        positions = self.positions(tag)
+        if not positions:
+            raise ValueError("{t} is not in list".format(t=tag))
+        return positions[0]
+
+    def append(self, child):
+        super(_ChildList, self).append(child)
+        if self._positions is not None:
+            self._positions.setdefault(child['tag'], []).append(len(self) - 1)
+
+    def extend(self, children):
+        for child in children:
+            self.append(child)
+
+    def __iadd__(self, children):
+        self.extend(children)
+        return self
+
+    def pop(self, index=-1):
+        last = index in (-1, len(self) - 1)
+        child = super(_ChildList, self).pop(index)
+        if self._positions is not None:
+            positions = self._positions.get(child['tag'])
+            if last and positions and positions[-1] == len(self):
+                # the last child is the only cheap one to remove:
+                positions.pop()
+                if not positions:
+                    del self._positions[child['tag']]
+            else:
+                self._invalidate()
+        return child
+
+    def _invalidating(name):
+        method = getattr(list, name)
+        def _wrapped(self, *args, **kwargs):
+            self._invalidate()
+            return method(self, *args, **kwargs)
+        _wrapped.__name__ = name
+        return _wrapped
+
+    insert = _invalidating('insert')
+    remove = _invalidating('remove')
+    sort = _invalidating('sort')
+    reverse = _invalidating('reverse')
+    __setitem__ = _invalidating('__setitem__')
+    __delitem__ = _invalidating('__delitem__')
+    __setslice__ = _invalidating('__setslice__')
+    __delslice__ = _invalidating('__delslice__')
+    __imul__ = _invalidating('__imul__')
+    del _invalidating
+
+    def __deepcopy__(self, memo):
+        tbr = type(self)()
+        memo[id(self)] = tbr
+        list.extend(tbr, [copy.deepcopy(child, memo) for child in self])
+        return tbr
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+class _MemberOwner(object):
+    """Links the wrappers around the records of a DataSet member (its
+    metadata or ExternalResources) back to the DataSet. The member's records
+    may be shared with copies of the DataSet (see DataSet._cowCopy), so the
+    wrappers report each modification through beforeWrite first, letting the
+    DataSet deep copy a shared member. Wrappers handed out before then follow
+    their records into the copy through current()."""
+
+    def __init__(self, dataset, member):
+        self._dataset = weakref.ref(dataset)
+        self.member = member
+        self.moved = {}
+
+    def beforeWrite(self, record):
+        dataset = self._dataset()
+        if dataset is not None:
+            dataset._beforeWrite(self.member, record)
+
+    def move(self, old, new):
+        """The records under 'old' have been deep copied to 'new'"""
+        self.moved[id(old)] = (old, new)
+        for oldChild, newChild in izip(old['children'], new['children']):
+            self.move(oldChild, newChild)
+
+    def current(self, record):
+        """The record that has taken the place of 'record', if any"""
+        moved = self.moved.get(id(record))
+        while moved is not None and moved[0] is record:
+            record = moved[1]
+            moved = self.moved.get(id(record))
+        return record
+
+
 class RecordWrapper(object):
     """The base functionality of a metadata element.
 
@@ -308,6 +553,9 @@ class RecordWrapper(object):
     KEEP_WITH_PARENT = False
     NS = ''
 
+    # the _MemberOwner of the DataSet member this record belongs to, if any
+    _owner = None
+
     def __init__(self, record=None, parent=None):
         """Here, record is any element in the Metadata Element tree and a
         dictionary with five members: 'tag', 'attrib', 'text', 'children', and
@@ -317,9 +565,12 @@ class RecordWrapper(object):
         modifications.
         """
         self._callbacks = []
+        if not parent is None:
+            self._owner = parent._owner
         if record:
             try:
                 self.record = record.record
+                self._owner = record._owner
             except AttributeError:
                 self.record = record
         else:
@@ -342,6 +593,29 @@ class RecordWrapper(object):
             self.record['namespace'] = NAMESPACES[self.NS]
 
 
+    @property
+    def record(self):
+        if self._owner is not None and self._owner.moved:
+            self._record = self._owner.current(self._record)
+        return self._record
+
+    @record.setter
+    def record(self, value):
+        self._record = value
+
+    def _beforeWrite(self, record=None):
+        """Report an upcoming modification of this element's record (or of
+        the given child record) to the owning DataSet, see _MemberOwner"""
+        if self._owner is not None:
+            self._owner.beforeWrite(self.record if record is None else record)
+
+    def _adopt(self, wrapper):
+        """Have a new wrapper around one of the records under this element
+        belong to the same DataSet member"""
+        if isinstance(wrapper, RecordWrapper):
+            wrapper._owner = self._owner
+        return wrapper
+
     def registerCallback(self, func):
         if func not in self._callbacks:
             self._callbacks.append(func)
@@ -379,20 +653,35 @@ class RecordWrapper(object):
         tbr.record = copy.deepcopy(self.record, memo)
         return tbr
 
+    def cowCopy(self, own=()):
+        """Copy this element, sharing its child records with the original
+        instead of deep copying them. The attributes and list of children of
+        this element belong to the copy alone, and children with tags in 'own'
+        are deep copied, so those can be modified without touching the
+        original."""
+        tbr = type(self)()
+        record = dict(self.record)
+        record['attrib'] = dict(self.record['attrib'])
+        record['children'] = [copy.deepcopy(child) if child['tag'] in own
+                              else child
+                              for child in self.record['children']]
+        tbr.record = record
+        return tbr
+
     def __getitem__(self, tag):
         """Try to get the a specific child (only useful in simple cases where
         children will not be wrapped in a special wrapper object, returns the
         first instance of 'tag')"""
         if isinstance(tag, str):
-            return RecordWrapper(self.getV('children', tag))
+            return self._adopt(RecordWrapper(self.getV('children', tag)))
         elif isinstance(tag, int):
-            return RecordWrapper(self.record['children'][tag])
+            return self._adopt(RecordWrapper(self.record['children'][tag]))
 
     def __iter__(self):
         """Get each child iteratively (only useful in simple cases where
         children will not be wrapped in a special wrapper object)"""
         for child in self.record['children']:
-            yield RecordWrapper(child)
+            yield self._adopt(RecordWrapper(child))
 
     def __repr__(self):
         """Return a pretty string represenation of this object:
@@ -421,7 +710,8 @@ class RecordWrapper(object):
         return True
 
     def pop(self, index):
-        return self.record['children'].pop(index)
+        self._beforeWrite()
+        return self._childList().pop(index)
 
     def merge(self, other):
         pass
@@ -443,18 +733,19 @@ class RecordWrapper(object):
         """Generic accessor for the contents of the children of this element,
         without having to interface with them directly"""
         try:
-            if container == 'attrib':
-                self.record['children'][self.index(str(tag))][str(container)][attrib] = (
-                    str(value))
-            else:
-                self.record['children'][self.index(str(tag))][str(container)] = (
-                    str(value))
+            index = self.index(str(tag))
         except ValueError:
             if container == 'text':
                 newMember = _emptyMember(tag=tag, text=value)
                 self.append(newMember)
-            else:
-                raise
+                return self
+            raise
+        self._beforeWrite(self.record['children'][index])
+        if container == 'attrib':
+            self.record['children'][index][str(container)][attrib] = (
+                str(value))
+        else:
+            self.record['children'][index][str(container)] = str(value)
         return self
 
     def getV(self, container='text', tag=None):
@@ -473,6 +764,7 @@ class RecordWrapper(object):
     def setV(self, value, container='text', tag=None):
         """Generic accessor for the contents of this element's 'attrib' or
         'text' fields"""
+        self._beforeWrite()
         if tag:
             self.record[str(container)][tag] = value
         else:
@@ -483,20 +775,46 @@ class RecordWrapper(object):
         """Extend the actual list of child elements"""
         newMembers = [nM.record if isinstance(nM, RecordWrapper) else nM
                       for nM in newMembers]
-        self.record['children'].extend(newMembers)
+        self._beforeWrite()
+        self._childList().extend(newMembers)
 
     def append(self, newMember):
         """Append to the actual list of child elements"""
+        self._beforeWrite()
         if isinstance(newMember, RecordWrapper):
             newMember._runCallbacks()
-            self.record['children'].append(newMember.record)
+            self._childList().append(newMember.record)
+            if newMember._owner is None:
+                self._adopt(newMember)
         else:
-            self.record['children'].append(newMember)
+            self._childList().append(newMember)
         self._runCallbacks()
 
+    def remove(self, member):
+        """Remove a child element (or record)"""
+        if isinstance(member, RecordWrapper):
+            member = member.record
+        self._beforeWrite()
+        children = self._childList()
+        for i, child in enumerate(children):
+            if child is member:
+                children.pop(i)
+                return
+        children.remove(member)
+
+    def _childList(self):
+        """The 'children' of this record as a _ChildList, which indexes the
+        positions of child tags. Records are parsed (and sometimes pruned)
+        into plain lists, so these are converted on first use"""
+        children = self.record['children']
+        if not isinstance(children, _ChildList):
+            children = _ChildList(children)
+            self.record['children'] = children
+        return children
+
     def index(self, tag):
         """Return the index in 'children' list of item with 'tag' member"""
-        return self.tags.index(tag)
+        return self._childList().first(tag)
 
     @property
     def tags(self):
@@ -509,6 +827,7 @@ class RecordWrapper(object):
 
     @namespace.setter
     def namespace(self, value):
+        self._beforeWrite()
         self.record['namespace'] = value
 
     @property
@@ -523,6 +842,7 @@ class RecordWrapper(object):
     @metaname.setter
     def metaname(self, value):
         """Cleaner accessor for this node's tag"""
+        self._beforeWrite()
         self.record['tag'] = value
 
     @property
@@ -541,6 +861,7 @@ class RecordWrapper(object):
     @metavalue.setter
     def metavalue(self, value):
         """Cleaner accessor for this node's text"""
+        self._beforeWrite()
         self.record['text'] = value
 
     @property
@@ -551,25 +872,29 @@ class RecordWrapper(object):
 
     def addMetadata(self, key, value):
         """Add a key, value pair to this metadata object (attributes)"""
+        self._beforeWrite()
         self.metadata[key] = value
 
     @property
     def submetadata(self):
         """Cleaner accessor for wrapped versions of this node's children."""
-        return [RecordWrapper(child) for child in self.record['children']]
+        return [self._adopt(RecordWrapper(child))
+                for child in self.record['children']]
 
     @property
     def subrecords(self):
         """Cleaner accessor for this node's children. Returns mutable, doesn't
         need setter"""
+        self._beforeWrite()
         return self.record['children']
 
     def findChildren(self, tag):
-        for child in self.submetadata:
-            if child.metaname == tag:
-                yield child
+        children = self._childList()
+        for child in [children[i] for i in children.positions(tag)]:
+            yield self._adopt(RecordWrapper(child))
 
     def removeChildren(self, tag):
+        self._beforeWrite()
         keepers = []
         removed = []
         for child in self.record['children']:
@@ -581,6 +906,7 @@ class RecordWrapper(object):
         return removed
 
     def pruneChildrenTo(self, whitelist):
+        self._beforeWrite()
         newChildren = []
         oldChildren = self.record['children']
         for child in oldChildren:
@@ -665,6 +991,62 @@ class Filters(RecordWrapper):
         else:
             return False
 
+    # Requirements that depend on other records (e.g. the number of subreads
+    # in a ZMW) can't be evaluated on a subset of an index:
+    _CONTEXT_PARAMS = ('n_subreads',)
+
+    def requirementSets(self):
+        """A hashable summary of these filters: a tuple with the frozenset of
+        (name, operator, value, modulo) requirements of each filter. No
+        filters is summarized as one empty filter, which passes everything.
+        """
+        reqSets = tuple(frozenset((req.name, req.operator, req.value,
+                                   req.modulo)
+                                  for req in filt if req.name)
+                        for filt in self)
+        return reqSets or (frozenset(),)
+
+    def refinement(self, previous):
+        """Test whether these filters only narrow those summarized by
+        'previous' (see requirementSets), i.e. they have changed only by AND-ing
+        on new requirements, so that every record that passes them passed the
+        previous filters.
+
+        Args:
+            previous: The requirementSets() of the filters to compare to
+        Returns:
+            The Filters that records passing 'previous' must also pass to pass
+            these filters (only the new requirements, if there was a single
+            previous filter), or None if requirements were OR-ed on or removed
+
+        Doctest:
+            >>> filters = Filters()
+            >>> filters.addRequirement(rq=[('>', '0.85')])
+            >>> previous = filters.requirementSets()
+            >>> filters.addRequirement(length=[('>', '1000')])
+            >>> print(filters.refinement(previous))
+            ( length > 1000 )
+            >>> filters.addFilter(zm=[('<', '1000')])
+            >>> print(filters.refinement(previous))
+            None
+        """
+        current = self.requirementSets()
+        if len(previous) == 1:
+            base = previous[0]
+            if not all(base <= reqs for reqs in current):
+                return None
+            delta = [reqs - base for reqs in current]
+        elif all(any(old <= reqs for old in previous) for reqs in current):
+            delta = current
+        else:
+            return None
+        if any(req[0] in self._CONTEXT_PARAMS
+               for reqs in delta for req in reqs):
+            return None
+        result = Filters()
+        result.addFilterList([sorted(reqs) for reqs in delta])
+        return result
+
     def merge(self, other):
         # Just add it to the or list
         self.extend(Filters(other).submetadata)
@@ -723,8 +1105,8 @@ class Filters(RecordWrapper):
 
     def _pbiAccMap(self):
         return {'length': (lambda x: int(x.aEnd)-int(x.aStart)),
-                'qname': (lambda m, x: qnamer(m, x.qId, x.holeNumber, x.qStart,
-                                              x.qEnd)),
+                'qname': (lambda x: qnamer(x.qId, x.holeNumber, x.qStart,
+                                           x.qEnd)),
                 'qid': (lambda x: x.qId),
                 'zm': (lambda x: int(x.holeNumber)),
                 'pos': (lambda x: int(x.tStart)),
@@ -759,8 +1141,8 @@ class Filters(RecordWrapper):
         return {'length': (lambda x: x.qEnd - x.qStart),
                 'qstart': (lambda x: x.qStart),
                 'qend': (lambda x: x.qEnd),
-                'qname': (lambda m, x: qnamer(m, x.qId, x.holeNumber, x.qStart,
-                                              x.qEnd)),
+                'qname': (lambda x: qnamer(x.qId, x.holeNumber, x.qStart,
+                                           x.qEnd)),
                 'qid': (lambda x: x.qId),
                 'movie': (lambda x: x.qId),
                 'zm': (lambda x: x.holeNumber),
@@ -832,8 +1214,28 @@ class Filters(RecordWrapper):
             tests.append(lambda x, rt=reqTests: all([f(x) for f in rt]))
         return tests
 
+    def filterIndexChunks(self, indexChunks, nameMap, movieMap,
+                          readType='bam'):
+        """Filter an index one chunk at a time (e.g. the chunks of a
+        StreamingBamIndex), so that the full index never has to be held in
+        memory. Parsed qname whitelists are shared between chunks.
+
+        Yields:
+            (chunk, passes) tuples, where chunk is the index recarray of the
+            chunk and passes is the boolean mask of its passing rows
+        """
+        keyCache = {}
+        for chunk in indexChunks:
+            chunk = getattr(chunk, '_tbl', chunk)
+            if not self:
+                yield chunk, np.ones(len(chunk), dtype=np.bool_)
+                continue
+            yield chunk, self.filterIndexRecords(chunk, nameMap, movieMap,
+                                                 readType=readType,
+                                                 keyCache=keyCache)
+
     def filterIndexRecords(self, indexRecords, nameMap, movieMap,
-                           readType='bam'):
+                           readType='bam', keyCache=None):
         if readType == 'bam':
             typeMap = self._bamTypeMap
             accMap = self._pbiVecAccMap()
@@ -842,14 +1244,13 @@ class Filters(RecordWrapper):
                 accMap = self._pbiMappedVecAccMap()
                 if 'RefGroupID' in indexRecords.dtype.names:
                     accMap['rname'] = (lambda x: x.RefGroupID)
-            accMap['qname'] = P(accMap['qname'],
-                                {v:k for k, v in movieMap.items()})
             # check for hdf resources:
             if 'MovieID' in indexRecords.dtype.names:
                 # TODO(mdsmith)(2016-01-29) remove these once the fields are
                 # renamed:
                 accMap['movie'] = (lambda x: x.MovieID)
-                accMap['qname'] = (lambda x: x.MovieID)
+                accMap['qname'] = (lambda x: qnamer(x.MovieID, x.HoleNumber,
+                                                    None, None))
                 accMap['zm'] = (lambda x: x.HoleNumber)
                 accMap['length'] = (lambda x: x.rEnd - x.rStart)
         elif readType == 'fasta':
@@ -861,7 +1262,33 @@ class Filters(RecordWrapper):
                       }
 
         filterLastResult = np.zeros(len(indexRecords), dtype=np.bool_)
+        # Filters that each require a single value of the same plain field
+        # (e.g. the contig ids of a ContigSet chunk) are OR'ed together with
+        # one set lookup, rather than one pass over the records per filter
+        filters = []
+        eqGroups = defaultdict(list)
         for filt in self:
+            reqs = list(filt)
+            if len(reqs) == 1:
+                req = reqs[0]
+                if (req.name in accMap and
+                        req.name not in ('qname', 'bc', 'cx', 'rname',
+                                         'movie') and
+                        req.modulo is None and
+                        mapOp(req.operator) == OP.eq and
+                        not isListString(req.value) and
+                        not isFile(req.value)):
+                    eqGroups[req.name].append(filt)
+                    continue
+            filters.append(filt)
+        for param, group in eqGroups.iteritems():
+            if len(group) == 1:
+                filters.extend(group)
+                continue
+            values = [map_val_or_vec(typeMap[param], list(filt)[0].value)
+                      for filt in group]
+            filterLastResult |= np.in1d(accMap[param](indexRecords), values)
+        for filt in filters:
             lastResult = np.ones(len(indexRecords), dtype=np.bool_)
             for req in filt:
                 param = req.name
@@ -881,19 +1308,30 @@ class Filters(RecordWrapper):
                         elif mapOp(opstr) == OP.ne:
                             opstr = 'not_in'
 
-                    if opstr in ('in', 'not_in'):
+                    if param == 'qname':
+                        # Stream the names straight into sorted int64 keys
+                        # rather than materializing string columns:
+                        if keyCache is not None and value in keyCache:
+                            value = keyCache[value]
+                        else:
+                            rawValue = value
+                            if isListString(value) and not isFile(value):
+                                value = str2list(value)
+                            value = QnameKeys(iterQnames(value), movieMap)
+                            if keyCache is not None:
+                                keyCache[rawValue] = value
+                    elif opstr in ('in', 'not_in'):
                         if isFile(value):
                             value = fromFile(value)
                         elif isListString(value):
                             value = setify(value)
-                    value = map_val_or_vec(typeMap[param], value)
+                    if param != 'qname':
+                        value = map_val_or_vec(typeMap[param], value)
 
                     if param == 'rname':
                         value = map_val_or_vec(nameMap.get, value)
                     elif param == 'movie':
                         value = map_val_or_vec(movieMap.get, value)
-                    elif param == 'qname':
-                        value = qname2vec(value)
 
                     if param == 'bc':
                         # convert string to list:
@@ -912,6 +1350,11 @@ class Filters(RecordWrapper):
                         operator = mapOp(opstr)
                         reqResultsForRecords &= operator(
                             accMap[param](indexRecords), value)
+                    elif param == 'qname':
+                        reqResultsForRecords = value.contains(
+                            *accMap[param](indexRecords))
+                        if opstr == 'not_in':
+                            reqResultsForRecords = ~reqResultsForRecords
                     else:
                         operator = mapOp(opstr)
                         accessor = accMap[param]
@@ -1250,35 +1693,42 @@ class ExternalResources(RecordWrapper):
         would require opening them"""
 
     def __getitem__(self, index):
-        return ExternalResource(self.record['children'][index])
+        return self._adopt(ExternalResource(self.record['children'][index]))
 
     def __iter__(self):
         for child in self.record['children']:
-            yield ExternalResource(child)
+            yield self._adopt(ExternalResource(child))
 
     def merge(self, other):
+        self.mergeMany([other])
+
+    def mergeMany(self, others):
+        """Merge the resources of several ExternalResources into this one,
+        merging (rather than duplicating) those with known ResourceIds, which
+        are looked up in a hash of the current ids"""
         # make sure we don't add dupes
-        curIds = self.resourceIds
-
-        # check to make sure ResourceIds in other are unique
-        otherIds = Counter([res.resourceId for res in other])
-        dupes = [c for c in otherIds if otherIds[c] > 1]
-        if dupes:
-            raise RuntimeError("Duplicate ResourceIds found: "
-                               "{f}".format(f=', '.join(dupes)))
-
-        for newRes in other:
-            # merge instead
-            if newRes.resourceId in curIds:
-                indexof = curIds.index(newRes.resourceId)
-                self[indexof].merge(newRes)
-            else:
-                self.append(newRes)
-                curIds.append(newRes.resourceId)
-        # we may be missing some metadata
-        if not self.namespace:
-            self.namespace = other.namespace
-            self.attrib.update(other.attrib)
+        curIds = dict((resId, i) for i, resId in enumerate(self.resourceIds))
+        for other in others:
+            # check to make sure ResourceIds in other are unique
+            otherIds = Counter([res.resourceId for res in other])
+            dupes = [c for c in otherIds if otherIds[c] > 1]
+            if dupes:
+                raise RuntimeError("Duplicate ResourceIds found: "
+                                   "{f}".format(f=', '.join(dupes)))
+
+            for newRes in other:
+                # merge instead
+                indexof = curIds.get(newRes.resourceId)
+                if indexof is not None:
+                    self[indexof].merge(newRes)
+                else:
+                    self.append(newRes)
+                    curIds[newRes.resourceId] = len(curIds)
+            # we may be missing some metadata
+            if not self.namespace:
+                self.namespace = other.namespace
+                self.attrib.update(other.attrib)
+        self._resourceIds = []
 
 
     def addResources(self, resourceIds):
@@ -1315,6 +1765,7 @@ class ExternalResources(RecordWrapper):
         bit messy, but fairly concise.
         """
         self._resourceIds = []
+        self._beforeWrite()
         self.record['children'] = []
         for res in resources:
             self.append(res)
@@ -1608,11 +2059,11 @@ class FileIndices(RecordWrapper):
         self.record['tag'] = self.__class__.__name__
 
     def __getitem__(self, index):
-        return FileIndex(self.record['children'][index])
+        return self._adopt(FileIndex(self.record['children'][index]))
 
     def __iter__(self):
         for child in self.record['children']:
-            yield FileIndex(child)
+            yield self._adopt(FileIndex(child))
 
 
 class FileIndex(RecordWrapper):
@@ -1643,16 +2094,25 @@ class DataSetMetadata(RecordWrapper):
         self.record['tag'] = self.TAG
 
     def merge(self, other):
-        self.numRecords += other.numRecords
-        self.totalLength += other.totalLength
-        if other.summaryStats:
-            if self.summaryStats:
-                self.summaryStats.merge(other.summaryStats)
-            else:
-                self.append(other.summaryStats)
-        if not self.namespace:
-            self.namespace = other.namespace
-            self.attrib.update(other.attrib)
+        self.mergeMany([other])
+
+    def mergeMany(self, others):
+        """Merge the counts and summary stats of several DataSetMetadata into
+        this one, with a single pass over each distribution"""
+        others = list(others)
+        self.numRecords += sum(other.numRecords for other in others)
+        self.totalLength += sum(other.totalLength for other in others)
+        stats = [other.summaryStats for other in others if other.summaryStats]
+        if stats:
+            if not self.summaryStats:
+                # adopted records are merged into, so don't share them with
+                # the input:
+                self.append(copy.deepcopy(stats.pop(0)))
+            self.summaryStats.mergeMany(stats)
+        for other in others:
+            if not self.namespace:
+                self.namespace = other.namespace
+                self.attrib.update(other.attrib)
 
     @property
     def numRecords(self):
@@ -1681,7 +2141,8 @@ class DataSetMetadata(RecordWrapper):
     @property
     def summaryStats(self):
         try:
-            return StatsMetadata(self.getV('children', 'SummaryStats'))
+            return self._adopt(StatsMetadata(
+                self.getV('children', 'SummaryStats')))
         except ValueError:
             return None
 
@@ -1694,7 +2155,8 @@ class DataSetMetadata(RecordWrapper):
     @property
     def provenance(self):
         try:
-            return Provenance(self.getV('children', 'Provenance'))
+            return self._adopt(Provenance(
+                self.getV('children', 'Provenance')))
         except ValueError:
             return None
 
@@ -1735,12 +2197,14 @@ class SubreadSetMetadata(DataSetMetadata):
                                 "{t}".format(t=type(record).__name__))
         super(SubreadSetMetadata, self).__init__(record)
 
-    def merge(self, other):
-        super(self.__class__, self).merge(other)
-        if other.collections and not self.collections:
-            self.append(other.collections)
-        else:
-            self.collections.merge(other.collections)
+    def mergeMany(self, others):
+        others = list(others)
+        super(SubreadSetMetadata, self).mergeMany(others)
+        for other in others:
+            if other.collections and not self.collections:
+                self.append(copy.deepcopy(other.collections))
+            else:
+                self.collections.merge(copy.deepcopy(other.collections))
 
     @property
     def collections(self):
@@ -1822,11 +2286,11 @@ class CollectionsMetadata(RecordWrapper):
     NS = 'pbmeta'
 
     def __getitem__(self, index):
-        return CollectionMetadata(self.record['children'][index])
+        return self._adopt(CollectionMetadata(self.record['children'][index]))
 
     def __iter__(self):
         for child in self.record['children']:
-            yield CollectionMetadata(child)
+            yield self._adopt(CollectionMetadata(child))
 
     def merge(self, other, forceUnique=False):
         if forceUnique:
@@ -1874,9 +2338,9 @@ class AutomationParameters(RecordWrapper):
                 child = AutomationParameter(child)
                 if child.name == tag:
                     return child
-            return RecordWrapper(self.getV('children', tag))
+            return self._adopt(RecordWrapper(self.getV('children', tag)))
         elif isinstance(tag, int):
-            return RecordWrapper(self.record['children'][tag])
+            return self._adopt(RecordWrapper(self.record['children'][tag]))
 
     @property
     def parameterNames(self):
@@ -1996,62 +2460,103 @@ class StatsMetadata(RecordWrapper):
     def merge(self, other):
         """This can be modified to use the new accessors above instead of the
         brittle list of dists above"""
-        if (other.shortInsertFraction and other.prodDist and
-                self.shortInsertFraction and self.prodDist):
-            self.shortInsertFraction = (self.shortInsertFraction *
-                                        self.prodDist.bins[1] +
-                                        other.shortInsertFraction *
-                                        other.prodDist.bins[1])/(
-                                            self.prodDist.bins[1]
-                                            + other.prodDist.bins[1])
-        if (other.adapterDimerFraction and other.prodDist and
-                self.shortInsertFraction and self.prodDist):
-            self.adapterDimerFraction = (self.adapterDimerFraction *
-                                         self.prodDist.bins[1] +
-                                         other.adapterDimerFraction *
-                                         other.prodDist.bins[1])/(
-                                             self.prodDist.bins[1]
-                                             + other.prodDist.bins[1])
-        if other.shortInsertFraction and not self.shortInsertFraction:
-            self.shortInsertFraction = other.shortInsertFraction
-        if other.adapterDimerFraction and not self.adapterDimerFraction:
-            self.adapterDimerFraction = other.adapterDimerFraction
-        if other.prodDist and not self.prodDist:
-            self.append(other.prodDist)
-        self.numSequencingZmws += other.numSequencingZmws
+        self.mergeMany([other])
+
+    def mergeMany(self, others):
+        """Merge several StatsMetadata objects into this one. The fractions
+        are weighted by the productive ZMW counts accumulated so far, exactly
+        as in a sequence of pairwise merges, but each distribution is merged
+        with all of its counterparts in a single pass.
+
+        Args:
+            others: An iterable of StatsMetadata objects
+        """
+        others = list(others)
+
+        def _prodCount(stats):
+            if stats.prodDist:
+                return stats.prodDist.binArray[1]
+
+        selfCount = _prodCount(self)
+        for other in others:
+            otherCount = _prodCount(other)
+            if (other.shortInsertFraction and otherCount is not None and
+                    self.shortInsertFraction and selfCount is not None):
+                self.shortInsertFraction = (self.shortInsertFraction *
+                                            selfCount +
+                                            other.shortInsertFraction *
+                                            otherCount)/(
+                                                selfCount + otherCount)
+            if (other.adapterDimerFraction and otherCount is not None and
+                    self.shortInsertFraction and selfCount is not None):
+                self.adapterDimerFraction = (self.adapterDimerFraction *
+                                             selfCount +
+                                             other.adapterDimerFraction *
+                                             otherCount)/(
+                                                 selfCount + otherCount)
+            if other.shortInsertFraction and not self.shortInsertFraction:
+                self.shortInsertFraction = other.shortInsertFraction
+            if other.adapterDimerFraction and not self.adapterDimerFraction:
+                self.adapterDimerFraction = other.adapterDimerFraction
+            if otherCount is not None:
+                selfCount = (otherCount if selfCount is None
+                             else selfCount + otherCount)
+            if other.numSequencingZmws is not None:
+                self.numSequencingZmws = ((self.numSequencingZmws or 0) +
+                                          other.numSequencingZmws)
 
         for dist in self.MERGED_DISTS:
-            selfDist = getattr(self, dist[0].lower() + dist[1:])
-            otherDist = getattr(other, dist[0].lower() + dist[1:])
-            if not selfDist:
-                if otherDist:
-                    self.append(otherDist)
-            else:
-                try:
-                    selfDist.merge(otherDist)
-                except ZeroBinWidthError as e:
-                    removed = self.removeChildren(dist)
-                    self.append(otherDist)
-                except BinMismatchError:
-                    self.append(otherDist)
+            accessor = dist[0].lower() + dist[1:]
+            self._mergeDists(dist, accessor,
+                             [getattr(other, accessor) for other in others])
 
         for dist in self.UNMERGED_DISTS:
-            otherDists = other.findChildren(dist)
-            for otherDist in otherDists:
+            for other in others:
+                for otherDist in other.findChildren(dist):
+                    if otherDist:
+                        self.append(copy.deepcopy(otherDist))
+
+    def _mergeDists(self, dist, accessor, otherDists):
+        """Merge all of the compatible otherDists into this distribution at
+        once. Mismatched distributions are kept alongside it, and distributions
+        with a bin width of zero are replaced."""
+        selfDist = getattr(self, accessor)
+        batch = []
+        for otherDist in otherDists:
+            if not selfDist:
                 if otherDist:
-                    self.append(otherDist)
+                    # (copied, as it may be merged into below)
+                    self.append(copy.deepcopy(otherDist))
+                    selfDist = getattr(self, accessor)
+                continue
+            try:
+                selfDist.checkMergeable(otherDist)
+                batch.append(otherDist)
+            except ZeroBinWidthError as e:
+                # nothing (but other zero width dists) was merged into it
+                removed = self.removeChildren(dist)
+                self.append(copy.deepcopy(otherDist))
+                selfDist = getattr(self, accessor)
+                batch = []
+            except BinMismatchError:
+                self.append(copy.deepcopy(otherDist))
+        if batch:
+            selfDist.mergeMany(batch)
 
     @property
     def prodDist(self):
-        return DiscreteDistribution(self.getV('children', 'ProdDist'))
+        return self._adopt(DiscreteDistribution(
+            self.getV('children', 'ProdDist')))
 
     @property
     def readTypeDist(self):
-        return DiscreteDistribution(self.getV('children', 'ReadTypeDist'))
+        return self._adopt(DiscreteDistribution(
+            self.getV('children', 'ReadTypeDist')))
 
     @property
     def readLenDist(self):
-        return ContinuousDistribution(self.getV('children', 'ReadLenDist'))
+        return self._adopt(ContinuousDistribution(
+            self.getV('children', 'ReadLenDist')))
 
     @property
     def readLenDists(self):
@@ -2060,7 +2565,8 @@ class StatsMetadata(RecordWrapper):
 
     @property
     def readQualDist(self):
-        return ContinuousDistribution(self.getV('children', 'ReadQualDist'))
+        return self._adopt(ContinuousDistribution(
+            self.getV('children', 'ReadQualDist')))
 
     @property
     def readQualDists(self):
@@ -2069,8 +2575,8 @@ class StatsMetadata(RecordWrapper):
 
     @property
     def insertReadQualDist(self):
-        return ContinuousDistribution(self.getV('children',
-                                                'InsertReadQualDist'))
+        return self._adopt(ContinuousDistribution(
+            self.getV('children', 'InsertReadQualDist')))
 
     @property
     def insertReadLenDists(self):
@@ -2079,8 +2585,8 @@ class StatsMetadata(RecordWrapper):
 
     @property
     def insertReadLenDist(self):
-        return ContinuousDistribution(self.getV('children',
-                                                'InsertReadLenDist'))
+        return self._adopt(ContinuousDistribution(
+            self.getV('children', 'InsertReadLenDist')))
     @property
     def insertReadQualDists(self):
         return [ContinuousDistribution(child) for child in
@@ -2088,18 +2594,18 @@ class StatsMetadata(RecordWrapper):
 
     @property
     def controlReadQualDist(self):
-        return ContinuousDistribution(self.getV('children',
-                                                'ControlReadQualDist'))
+        return self._adopt(ContinuousDistribution(
+            self.getV('children', 'ControlReadQualDist')))
 
     @property
     def controlReadLenDist(self):
-        return ContinuousDistribution(self.getV('children',
-                                                'ControlReadLenDist'))
+        return self._adopt(ContinuousDistribution(
+            self.getV('children', 'ControlReadLenDist')))
 
     @property
     def medianInsertDist(self):
-        return ContinuousDistribution(self.getV('children',
-                                                'MedianInsertDist'))
+        return self._adopt(ContinuousDistribution(
+            self.getV('children', 'MedianInsertDist')))
     @property
     def medianInsertDists(self):
         return [ContinuousDistribution(child)
@@ -2130,40 +2636,141 @@ class StatsMetadata(RecordWrapper):
         self.setMemberV('ShortInsertFraction', float(value))
 
 
-def _staggeredZip(binWidth, start1, start2, bins1, bins2):
-    tupleList = [(start1, bins1), (start2, bins2)]
-    tupleList.sort(key=lambda x: x[0])
-    tuple1, tuple2 = tupleList
-    start1, bins1 = tuple1
-    start2, bins2 = tuple2
-    index = start1
-    while bins1 and bins2:
-        # pull from the first if it starts first
-        if index != start2:
-            index += binWidth
-            yield bins1.pop(0)
-        else:
-            yield bins1.pop(0) + bins2.pop(0)
-    # fill with zeros if the second hasn't started yet (they don't overlap)
-    while index != start2:
-        index += binWidth
-        yield 0
-    # then run out whichever still has items
-    for scrap in bins1 or bins2:
-        yield scrap
-
 def histogram_percentile(counts, labels, percentile):
-    thresh = np.true_divide(percentile * sum(counts), 100.0)
-    passed = 0
-    for c, l in zip(counts, labels):
-        passed += c
-        if passed >= thresh:
-            return l
+    counts = np.asarray(counts)
+    thresh = np.true_divide(percentile * counts.sum(), 100.0)
+    # the first bin at which the running total passes the threshold:
+    i = np.searchsorted(np.cumsum(counts), thresh, side='left')
+    if i < min(len(counts), len(labels)):
+        return labels[i]
     return labels[-1]
 
+class _BinStore(object):
+    """The bin counts of a distribution record, kept in the record (under
+    '_bins') as an int64 array. The BinCount elements are only rewritten from
+    it when the record is serialized (see DataSetWriter._syncBins), so
+    merging doesn't rebuild child records."""
+
+    def __init__(self, counts, dirty=False):
+        self.counts = counts
+        self.dirty = dirty
+
+    def __eq__(self, other):
+        return (isinstance(other, _BinStore) and
+                np.array_equal(self.counts, other.counts))
+
+    def __ne__(self, other):
+        return not self == other
+
+def _binArray(record):
+    """The (read only) bin counts of a distribution record, parsed from the
+    BinCount elements on first use"""
+    store = record.get('_bins')
+    if store is None:
+        counts = []
+        for child in record['children']:
+            if child['tag'] == 'BinCounts':
+                counts = [int(count['text']) for count in child['children']
+                          if count['tag'] == 'BinCount']
+                break
+        store = _BinStore(np.array(counts, dtype=np.int64))
+        record['_bins'] = store
+    return store.counts
+
+def _setBinArray(record, counts):
+    record['_bins'] = _BinStore(np.array(counts, dtype=np.int64), dirty=True)
+
+class HistogramAccumulator(object):
+    """Accumulate a fixed width histogram and the sample moments of a stream
+    of value arrays (e.g. pbi columns, chunk by chunk), to be written out as a
+    ContinuousDistribution. Bins start at zero rather than at the smallest
+    value, so that distributions accumulated for different chunks of a
+    dataset can be merged.
+
+    Doctest:
+        >>> acc = HistogramAccumulator(10)
+        >>> acc.add([1, 5, 12])
+        >>> acc.add([38])
+        >>> dist = acc.toDistribution('ReadLenDist')
+        >>> dist.bins, dist.sampleSize, dist.sampleMean, dist.maxOutlierValue
+        ([2, 1, 0, 1], 4, 14.0, 38.0)
+    """
+
+    # quotients are rounded to this many decimals before taking the floor, so
+    # that values on a bin edge aren't put in the bin below by float error
+    # (e.g. 0.29 / 0.01 == 28.999999999999996, or a float32 readQual):
+    EDGE_DECIMALS = 4
+
+    def __init__(self, binWidth):
+        self.binWidth = binWidth
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.size = 0
+        self.total = 0.0
+        self.sumSquares = 0.0
+        self.minValue = None
+        self.maxValue = None
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return
+        bins = np.floor(np.round(values / self.binWidth,
+                                 self.EDGE_DECIMALS)).astype(np.int64)
+        counts = np.bincount(np.clip(bins, 0, None)).astype(np.int64)
+        if len(counts) < len(self.counts):
+            counts, self.counts = self.counts, counts
+        counts[:len(self.counts)] += self.counts
+        self.counts = counts
+        self.size += len(values)
+        self.total += values.sum()
+        self.sumSquares += np.dot(values, values)
+        minValue, maxValue = values.min(), values.max()
+        if self.minValue is None or minValue < self.minValue:
+            self.minValue = minValue
+        if self.maxValue is None or maxValue > self.maxValue:
+            self.maxValue = maxValue
+
+    def toDistribution(self, tag, description=''):
+        """A new ContinuousDistribution element with this histogram"""
+        size = self.size
+        mean = std = median = pct95 = 0
+        if size:
+            mean = self.total / size
+        if size > 1:
+            std = np.sqrt(max(self.sumSquares - self.total ** 2 / size, 0) /
+                          (size - 1))
+        if self.counts.sum():
+            centers = (np.arange(len(self.counts)) * self.binWidth +
+                       self.binWidth / 2.0)
+            median = histogram_percentile(self.counts, centers, 50)
+            pct95 = histogram_percentile(self.counts, centers, 95)
+        # in XSD order:
+        members = [('SampleSize', size),
+                   ('SampleMean', mean),
+                   ('SampleMed', median),
+                   ('SampleStd', std),
+                   ('Sample95thPct', pct95),
+                   ('NumBins', len(self.counts)),
+                   ('BinCounts', ''),
+                   ('BinWidth', self.binWidth),
+                   ('MinOutlierValue', self.minValue or 0),
+                   ('MinBinValue', 0),
+                   ('MaxBinValue', max(len(self.counts) - 1, 0) *
+                    self.binWidth),
+                   ('MaxOutlierValue', self.maxValue or 0),
+                   ('MetricDescription', description)]
+        dist = ContinuousDistribution(_emptyMember(tag=tag))
+        dist.extend([_emptyMember(tag=member, text=str(value))
+                     for member, value in members])
+        dist.bins = self.counts
+        return dist
+
+
 class ContinuousDistribution(RecordWrapper):
 
-    def merge(self, other):
+    def checkMergeable(self, other):
+        """Raise the error that merging 'other' into this distribution would,
+        without merging"""
         if other.binWidth == 0:
             return
         if self.binWidth == 0:
@@ -2173,57 +2780,67 @@ class ContinuousDistribution(RecordWrapper):
         if (self.minBinValue % self.binWidth
                 != other.minBinValue % other.binWidth):
             raise BinBoundaryMismatchError(self.minBinValue, other.minBinValue)
-        self.bins = list(_staggeredZip(self.binWidth, self.minBinValue,
-                                       other.minBinValue, self.bins,
-                                       other.bins))
-        self.minBinValue = min(self.minBinValue, other.minBinValue)
-        self.maxBinValue = max(self.maxBinValue, other.maxBinValue)
-        self.minOutlierValue = min(self.minOutlierValue, other.minOutlierValue)
-        self.maxOutlierValue = max(self.maxOutlierValue, other.maxOutlierValue)
-
-        def _true_divide(num, denom):
-            if denom == 0:
-                return 0
-            else:
-                return np.true_divide(num, denom)
-
-        # Std merging is somewhat complicated:
-        selfweight = _true_divide(self.sampleSize,
-                                  (self.sampleSize + other.sampleSize))
-        otherweight = _true_divide(other.sampleSize,
-                                   (self.sampleSize + other.sampleSize))
-        selfsum = self.sampleMean * self.sampleSize
-        othersum = other.sampleMean * other.sampleSize
-        selfval = otherval = 0
-        if self.sampleSize > 0:
-            selfval = ((self.sampleStd ** 2) * (self.sampleSize - 1) +
-                       ((selfsum) ** 2) / self.sampleSize)
-        if other.sampleSize > 0:
-            otherval = ((other.sampleStd ** 2) * (other.sampleSize - 1) +
-                        ((othersum) ** 2) / other.sampleSize)
-        sums = selfsum + othersum
-        vals = selfval + otherval
-        tots = self.sampleSize + other.sampleSize
+
+    def merge(self, other):
+        self.mergeMany([other])
+
+    def mergeMany(self, others):
+        """Merge several distributions into this one in a single pass. Bins
+        are aligned by their offsets from the smallest minBinValue and summed,
+        and the sample statistics are pooled.
+
+        Args:
+            others: An iterable of ContinuousDistributions with the same
+                    binWidth and bin boundaries. Those with a binWidth of
+                    zero are skipped.
+        """
+        others = [other for other in others if other.binWidth != 0]
+        for other in others:
+            self.checkMergeable(other)
+        if not others:
+            return
+        dists = [self] + others
+        binWidth = self.binWidth
+
+        mins = np.array([dist.minBinValue for dist in dists])
+        minBinValue = mins.min()
+        offsets = np.rint((mins - minBinValue) / binWidth).astype(np.int64)
+        counts = [dist.binArray for dist in dists]
+        bins = np.zeros(max(offset + len(count)
+                            for offset, count in zip(offsets, counts)),
+                        dtype=np.int64)
+        for offset, count in zip(offsets, counts):
+            bins[offset:offset + len(count)] += count
+        self.bins = bins
+        # keep full precision, later merges check the bin boundaries:
+        self.minBinValue = repr(float(minBinValue))
+        self.maxBinValue = max(dist.maxBinValue for dist in dists)
+        self.minOutlierValue = min(dist.minOutlierValue for dist in dists)
+        self.maxOutlierValue = max(dist.maxOutlierValue for dist in dists)
+
+        # Pool the std from each sum of squares:
+        sizes = np.array([dist.sampleSize for dist in dists], dtype=np.int64)
+        means = np.array([dist.sampleMean for dist in dists], dtype=float)
+        stds = np.array([dist.sampleStd for dist in dists], dtype=float)
+        sums = means * sizes
+        nonzero = sizes > 0
+        vals = np.sum(stds[nonzero] ** 2 * (sizes[nonzero] - 1) +
+                      sums[nonzero] ** 2 / sizes[nonzero])
+        tots = sizes.sum()
         if tots > 1:
-            self.sampleStd = np.sqrt((vals - (sums ** 2) / tots) / (tots - 1))
+            self.sampleStd = np.sqrt((vals - (sums.sum() ** 2) / tots) /
+                                     (tots - 1))
         else:
             self.sampleStd = 0
-
-        # The others are pretty simple:
-        self.sampleMean = ((self.sampleMean * selfweight) +
-                           (other.sampleMean * otherweight))
-        self.sampleSize = self.sampleSize + other.sampleSize
+        self.sampleMean = sums.sum() / tots if tots else 0
+        self.sampleSize = tots
 
         # These two are approximations:
-        if np.sum(self.bins):
-            self.sampleMed = histogram_percentile(
-                self.bins,
-                (np.array(self.labels) + self.binWidth / 2.0),
-                50)
-            self.sample95thPct = histogram_percentile(
-                self.bins,
-                (np.array(self.labels) + self.binWidth / 2.0),
-                95)
+        if bins.sum():
+            centers = (minBinValue + np.arange(len(bins)) * binWidth +
+                       binWidth / 2.0)
+            self.sampleMed = histogram_percentile(bins, centers, 50)
+            self.sample95thPct = histogram_percentile(bins, centers, 95)
         else:
             self.sampleMed = 0
             self.sample95thPct = 0
@@ -2247,20 +2864,20 @@ class ContinuousDistribution(RecordWrapper):
     def description(self):
         return self.getMemberV('MetricDescription')
 
+    @property
+    def binArray(self):
+        """The bin counts as an int64 array. Assign to bins to change them"""
+        return _binArray(self.record)
+
     @property
     def bins(self):
-        binCounts = RecordWrapper(self.getV('children', 'BinCounts'))
-        counts = binCounts.findChildren('BinCount')
-        counts = [int(count.metavalue) for count in counts]
-        return counts
+        return self.binArray.tolist()
 
     @bins.setter
     def bins(self, newBins):
         """Replace the bins."""
-        binCounts = RecordWrapper(self.getV('children', 'BinCounts'))
-        binCounts.removeChildren('BinCount')
-        binCounts.extend([_emptyMember(tag='BinCount', text=str(mem))
-                          for mem in newBins])
+        self._beforeWrite()
+        _setBinArray(self.record, newBins)
 
     @property
     def labels(self):
@@ -2268,7 +2885,7 @@ class ContinuousDistribution(RecordWrapper):
         # numBins appears to be wrong in the sts.xml files. Otherwise, it would
         # work well here:
         return [self.minBinValue + i * self.binWidth for i in
-                range(len(self.bins))]
+                range(len(self.binArray))]
 
 class ZeroBinWidthError(Exception):
 
@@ -2315,32 +2932,57 @@ class BinBoundaryMismatchError(BinMismatchError):
 
 class DiscreteDistribution(RecordWrapper):
 
-    def merge(self, other):
+    def checkMergeable(self, other):
+        """Raise the error that merging 'other' into this distribution would,
+        without merging"""
         if self.numBins != other.numBins:
             raise BinNumberMismatchError(self.numBins, other.numBins)
         if set(self.labels) != set(other.labels):
             raise BinMismatchError
-        sBins = zip(self.labels, self.bins)
-        oBins = dict(zip(other.labels, other.bins))
-        self.bins = [value + oBins[key] for key, value in sBins]
+
+    def merge(self, other):
+        self.mergeMany([other])
+
+    def mergeMany(self, others):
+        """Merge several distributions with the same labels into this one,
+        summing the bins of each label in a single pass"""
+        others = list(others)
+        for other in others:
+            self.checkMergeable(other)
+        if not others:
+            return
+        labels = self.labels
+        bins = self.binArray[:len(labels)].copy()
+        for other in others:
+            otherLabels = other.labels
+            if otherLabels == labels:
+                bins += other.binArray[:len(labels)]
+            else:
+                position = dict((label, i)
+                                for i, label in enumerate(otherLabels))
+                bins += other.binArray[[position[label]
+                                        for label in labels]]
+        self.bins = bins
 
     @property
     def numBins(self):
         return self.getMemberV('NumBins', asType=int)
 
+    @property
+    def binArray(self):
+        """The bin counts as an int64 array. Assign to bins to change them"""
+        return _binArray(self.record)
+
     @property
     def bins(self):
-        binCounts = RecordWrapper(self.getV('children', 'BinCounts'))
-        return [int(child.metavalue)
-                for child in binCounts.findChildren('BinCount')]
+        return self.binArray.tolist()
 
     @bins.setter
     def bins(self, newBins):
         """Replace the bin values. This assumes the label order is
         maintained"""
-        binCounts = RecordWrapper(self.getV('children', 'BinCounts'))
-        for child, value in zip(binCounts.findChildren('BinCount'), newBins):
-            child.metavalue = str(value)
+        self._beforeWrite()
+        _setBinArray(self.record, newBins)
 
     @property
     def labels(self):
@@ -2387,12 +3029,12 @@ class BioSamplesMetadata(RecordWrapper):
 
     def __getitem__(self, index):
         """Get a biosample"""
-        return BioSampleMetadata(self.record['children'][index])
+        return self._adopt(BioSampleMetadata(self.record['children'][index]))
 
     def __iter__(self):
         """Iterate over biosamples"""
         for child in self.record['children']:
-            yield BioSampleMetadata(child)
+            yield self._adopt(BioSampleMetadata(child))
 
     def addSample(self, name):
         new = BioSampleMetadata()
@@ -2412,12 +3054,12 @@ class DNABarcodes(RecordWrapper):
 
     def __getitem__(self, index):
         """Get a DNABarcode"""
-        return DNABarcode(self.record['children'][index])
+        return self._adopt(DNABarcode(self.record['children'][index]))
 
     def __iter__(self):
         """Iterate over DNABarcode"""
         for child in self.record['children']:
-            yield DNABarcode(child)
+            yield self._adopt(DNABarcode(child))
 
     def addBarcode(self, name):
         new = DNABarcode()
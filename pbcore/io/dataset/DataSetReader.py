@@ -40,10 +40,10 @@ def populateDataSet(dset, filenames):
         dset._populateMetaTypes()
 
 def xmlRootType(fname):
+    # only the root element is needed, so stop parsing there:
     with open(fname, 'rb') as xml_file:
-        tree = ET.parse(xml_file)
-    root = tree.getroot()
-    return _splitTag(root.tag)[-1]
+        for _, root in ET.iterparse(xml_file, events=('start',)):
+            return _splitTag(root.tag)[-1]
 
 def _addFile(dset, filename):
     handledTypes = {'xml': _addXmlFile,
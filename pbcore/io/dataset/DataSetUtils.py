@@ -3,15 +3,23 @@
 from __future__ import absolute_import
 
 import os
+import time
 import logging
+import threading
 
 log = logging.getLogger(__name__)
 
+# Positive os.path.exists results are trusted for this many seconds:
+STAT_CACHE_TTL = 30.0
+# Threads used to stat a batch of files (e.g. on network filesystems):
+STAT_THREADS = 16
+
 
 def fileType(fname):
-    """Get the extension of fname (with h5 type)"""
+    """Get the extension of fname (with h5 type, or the type compressed to
+    .gz)"""
     remainder, ftype = os.path.splitext(fname)
-    if ftype == '.h5':
+    if ftype in ('.h5', '.gz'):
         _, prefix = os.path.splitext(remainder)
         ftype = prefix + ftype
     elif ftype == '.index':
@@ -22,6 +30,72 @@ def fileType(fname):
     return ftype
 
 
+_STAT_CACHE = {}
+_STAT_POOL = {}
+_STAT_LOCK = threading.Lock()
+
+def clearStatCache():
+    """Forget all cached existence checks"""
+    with _STAT_LOCK:
+        _STAT_CACHE.clear()
+
+def _statPool():
+    """A ThreadPool for stat calls, created lazily and once per process (a
+    forked child can't use its parent's pool threads)"""
+    with _STAT_LOCK:
+        pid = os.getpid()
+        if _STAT_POOL.get('pid') != pid:
+            from multiprocessing.pool import ThreadPool
+            _STAT_POOL['pool'] = ThreadPool(STAT_THREADS)
+            _STAT_POOL['pid'] = pid
+        return _STAT_POOL['pool']
+
+def _statExists(fname):
+    exists = os.path.exists(fname)
+    if exists:
+        with _STAT_LOCK:
+            _STAT_CACHE[fname] = time.time()
+    return exists
+
+def filesExist(fnames, ttl=None):
+    """Check whether each of a batch of files exists. Files that were found
+    within the last 'ttl' seconds aren't stat-ed again, and the rest are
+    stat-ed in parallel. Missing files aren't cached, as they are often about
+    to be written.
+
+    Args:
+        fnames: An iterable of paths
+        ttl: (STAT_CACHE_TTL) Trust cached existence checks for this long
+    Returns:
+        A list of T/F, one per path
+
+    Doctest:
+        >>> import pbcore.data.datasets as data
+        >>> filesExist([data.getXml(8), '/not/a/file.xml'])
+        [True, False]
+    """
+    fnames = list(fnames)
+    if ttl is None:
+        ttl = STAT_CACHE_TTL
+    found = {}
+    oldest = time.time() - ttl
+    with _STAT_LOCK:
+        for fname in fnames:
+            if _STAT_CACHE.get(fname, oldest) > oldest:
+                found[fname] = True
+    todo = sorted(set(fnames) - set(found))
+    if len(todo) > 1:
+        found.update(zip(todo, _statPool().map(_statExists, todo)))
+    elif todo:
+        found[todo[0]] = _statExists(todo[0])
+    return [found[fname] for fname in fnames]
+
+def fileExists(fname, ttl=None):
+    """os.path.exists, cached per process for 'ttl' (STAT_CACHE_TTL) seconds
+    if the file is found"""
+    return filesExist([fname], ttl)[0]
+
+
 def getDataSetUuid(xmlfile):
     """
     Quickly retrieve the uuid from the root element of a dataset XML file,
@@ -50,6 +124,51 @@ def getDataSetMetaType(xmlfile):
         return None
 
 
+def getDataSetHeader(xmlfile):
+    """
+    Quickly retrieve the UniqueId, MetaType, NumRecords and TotalLength of a
+    dataset XML file. The streaming parse stops as soon as the top level
+    DataSetMetadata counts have been read, and finished elements are cleared
+    as it goes, so large CollectionMetadata or subdataset elements are never
+    held in memory. Counts that are missing are returned as None. Returns None
+    if the parsing fails.
+    """
+    def _localName(tag):
+        return tag.rsplit('}', 1)[-1]
+
+    try:
+        import xml.etree.cElementTree as ET
+        header = {}
+        depth = 0
+        inMetadata = False
+        for event, element in ET.iterparse(xmlfile, events=("start", "end")):
+            tag = _localName(element.tag)
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    header["UniqueId"] = element.get("UniqueId")
+                    header["MetaType"] = element.get("MetaType")
+                elif depth == 2 and tag == "DataSetMetadata":
+                    inMetadata = True
+                continue
+            depth -= 1
+            if inMetadata and depth == 2 and tag in ("NumRecords",
+                                                     "TotalLength"):
+                header[tag] = int(element.text)
+                if "NumRecords" in header and "TotalLength" in header:
+                    break
+            elif inMetadata and depth == 1:
+                break
+            if depth > 1:
+                # drop finished subtrees as we go:
+                element.clear()
+        header.setdefault("NumRecords", None)
+        header.setdefault("TotalLength", None)
+        return header
+    except Exception:
+        return None
+
+
 def loadMockCollectionMetadata():
     """
     Load CollectionMetadata template from pbcore.data.datasets
@@ -7,10 +7,13 @@ from __future__ import print_function
 
 import os
 import re
+import itertools
+import threading
 from urlparse import urlparse
 from urllib import unquote
 import xml.etree.ElementTree as ET
 import logging
+from pbcore.io.dataset.DataSetUtils import filesExist
 
 XMLNS = "http://pacificbiosciences.com/PacBioDataModel.xsd"
 
@@ -25,20 +28,25 @@ def validateResources(xmlroot, relTo='.'):
                work poorly if relTo is not set to the dirname of the incoming
                XML file.
     """
+    resIds = []
     stack = [xmlroot]
     while stack:
         element = stack.pop()
         stack.extend(element)
         resId = element.get('ResourceId')
         if resId:
-            parsedId = urlparse(resId)
-            rfn = unquote(urlparse(resId).path.strip())
-            if not os.path.exists(rfn):
-                if (not os.path.exists(os.path.join(relTo,
-                                                    rfn)) and
-                        not os.path.exists(os.path.join('.',
-                                                        rfn))):
-                    raise IOError("{f} not found".format(f=rfn))
+            resIds.append(unquote(urlparse(resId).path.strip()))
+    # Stat every ResourceId as given, in one parallel batch, then any
+    # misses relative to relTo and the cwd:
+    found = filesExist(resIds)
+    missing = [rfn for rfn, exists in zip(resIds, found) if not exists]
+    if missing:
+        found = filesExist(itertools.chain.from_iterable(
+            (os.path.join(relTo, rfn), os.path.join('.', rfn))
+            for rfn in missing))
+        for i, rfn in enumerate(missing):
+            if not (found[2 * i] or found[2 * i + 1]):
+                raise IOError("{f} not found".format(f=rfn))
 
 def validateLxml(xml_fn, xsd_fn):
     try:
@@ -57,26 +65,42 @@ def validateMiniXsv(xml_fn, xsd_fn):
     except ImportError:
         log.debug('minixsv not found, validation disabled')
 
-def validateXml(xmlroot, skipResources=False, relTo='.'):
+_SCHEMA = {}
+_SCHEMA_LOCK = threading.Lock()
 
-    if not skipResources:
-        validateResources(xmlroot, relTo)
+def _getSchema():
+    """The compiled DataSet XSD bindings (or None if PyXb is unavailable),
+    imported once per process and shared between threads"""
+    with _SCHEMA_LOCK:
+        if not 'pyxb' in _SCHEMA:
+            try:
+                from pbcore.io.dataset.pyxb import DataSetXsd
+                _SCHEMA['pyxb'] = DataSetXsd
+            except ImportError:
+                log.info('PyXb not found, validation disabled')
+                _SCHEMA['pyxb'] = None
+        return _SCHEMA['pyxb']
 
+def _validateSchema(xmlString):
+    schema = _getSchema()
+    if schema is None:
+        return
     # Conceal the first characters of UniqueIds if they are legal numbers that
     # would for some odd reason be considered invalid. Let all illegal
     # characters fall through to the validator.
-    try:
-        from pbcore.io.dataset.pyxb import DataSetXsd
-        log.debug('Validating with PyXb')
-        fixedString = re.sub('UniqueId="[0-9]', 'UniqueId="f',
-                             ET.tostring(xmlroot))
-        fixedString = re.sub('Barcode="[0-9]', 'Barcode="f',
-                             fixedString)
-        fixedString = re.sub('Pointer>[0-9]', 'Pointer>f',
-                             fixedString)
-        DataSetXsd.CreateFromDocument(fixedString)
-    except ImportError:
-        log.info('PyXb not found, validation disabled')
+    log.debug('Validating with PyXb')
+    fixedString = re.sub('UniqueId="[0-9]', 'UniqueId="f', xmlString)
+    fixedString = re.sub('Barcode="[0-9]', 'Barcode="f',
+                         fixedString)
+    fixedString = re.sub('Pointer>[0-9]', 'Pointer>f',
+                         fixedString)
+    schema.CreateFromDocument(fixedString)
+
+def validateXml(xmlroot, skipResources=False, relTo='.'):
+
+    if not skipResources:
+        validateResources(xmlroot, relTo)
+    _validateSchema(ET.tostring(xmlroot))
 
 def validateFile(xmlfn, skipResources=False):
     if ':' in xmlfn:
@@ -87,4 +111,43 @@ def validateFile(xmlfn, skipResources=False):
                            relTo=os.path.dirname(xmlfn))
 
 def validateString(xmlString, skipResources=False, relTo='.'):
-    validateXml(ET.fromstring(xmlString), skipResources, relTo)
+    """Validate an XML string. The string itself is handed to the schema
+    validator, it is only parsed here if the resources need checking"""
+    if not skipResources:
+        validateResources(ET.fromstring(xmlString), relTo)
+    _validateSchema(xmlString)
+
+
+class BackgroundValidation(threading.Thread):
+    """Run validateString in a daemon thread. Call result() to wait for it,
+    which re-raises any validation error.
+
+    Args:
+        xmlString: The XML to validate
+        skipResources: T/F (False) skip the ResourceId existence checks
+        relTo: ('.') The path relative to which resources may reside
+        fileName: (None) The file the XML was written to, for logging
+    """
+
+    def __init__(self, xmlString, skipResources=False, relTo='.',
+                 fileName=None):
+        super(BackgroundValidation, self).__init__(
+            name="BackgroundValidation")
+        self.daemon = True
+        self._args = (xmlString, skipResources, relTo)
+        self._fileName = fileName
+        self._error = None
+
+    def run(self):
+        try:
+            validateString(*self._args)
+        except Exception as e:
+            log.error("Invalid file produced: {f}".format(f=self._fileName))
+            self._error = e
+        finally:
+            self._args = None
+
+    def result(self, timeout=None):
+        self.join(timeout)
+        if self._error is not None:
+            raise self._error
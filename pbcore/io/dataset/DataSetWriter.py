@@ -12,7 +12,7 @@ log = logging.getLogger(__name__)
 
 XML_VERSION = "3.0.1"
 
-__all__ = ['toXml']
+__all__ = ['toXml', 'serializeXml']
 
 # XML Writer:
 
@@ -28,6 +28,7 @@ def toXml(dataset, core=False):
         The XML representation as a string.
     """
     log.debug('Making elementtree...')
+    dataset._runDeferred()
     root = _toElementTree(dataset, root=None, core=core)
     log.debug('Done making ElementTree...')
     log.debug('Converting ElementTree to string...')
@@ -35,6 +36,36 @@ def toXml(dataset, core=False):
     log.debug('Done converting ElementTree to string')
     return xmlstring
 
+def serializeXml(dataset, pretty=True):
+    """Generate the (optionally indented) XML document for this object in a
+    single pass over its RecordWrapper trees, without building an
+    intermediate ElementTree or re-parsing the result to pretty print it.
+    This is what DataSet.write uses; toXml remains the canonical (unindented)
+    form used for hashing core UniqueIds.
+
+    Args:
+        pretty: T/F (True) put each element on its own tab-indented line
+    Returns:
+        The UTF-8 encoded XML document as a string.
+
+    Doctest:
+        >>> import pbcore.data.datasets as data
+        >>> import xml.etree.ElementTree as ET
+        >>> from pbcore.io import AlignmentSet
+        >>> ds = AlignmentSet(data.getXml(8))
+        >>> xml = serializeXml(ds)
+        >>> xml.splitlines()[1].startswith('<pbds:AlignmentSet ')
+        True
+        >>> root = ET.fromstring(xml)
+        >>> root.get('UniqueId') == ds.uuid
+        True
+    """
+    dataset._runDeferred()
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>']
+    _streamDataSet(dataset, lines.append, 0, pretty, root=True)
+    sep = '\n' if pretty else ''
+    return sep.join(lines) + sep
+
 NAMESPACES = {
     'pbbase': 'http://pacificbiosciences.com/PacBioBaseDataModel.xsd',
     'pbsample': 'http://pacificbiosciences.com/PacBioSampleInfo.xsd',
@@ -197,8 +228,10 @@ def _addExternalResourcesElement(dataSet, root, core=False):
         root: The root ElementTree object. Extended here using SubElement
         core=False: T/F strip out user editable attributes
     """
-    if dataSet.externalResources:
-        root.append(_eleFromDictList(dataSet.externalResources.record, core))
+    # read-only, so don't unshare (see DataSet.copy) the resources:
+    externalResources = dataSet._externalResources
+    if externalResources:
+        root.append(_eleFromDictList(externalResources.record, core))
 
 def _addDataSetMetadataElement(dataSet, root, core=False):
     """Add DataSetMetadata Elements to the root ElementTree object. Full
@@ -207,30 +240,40 @@ def _addDataSetMetadataElement(dataSet, root, core=False):
     Args:
         root: The root ElementTree object. Extended here using SubElement
     """
-    if dataSet.metadata:
-        provenance = dataSet.metadata.removeChildren("Provenance")
-        for i, record in enumerate(dataSet.metadata.record['children']):
-            if record['tag'] == "NumRecords":
-                for k, value in enumerate(provenance):
-                    dataSet.metadata.record['children'].insert(i + k + 1, value)
-                break
-        else:
-            dataSet.metadata.extend([p.record for p in provenance])
+    # Only the top level of the metadata is rearranged here, so read the
+    # (possibly shared, see DataSet.copy) metadata without unsharing it:
+    metadata = dataSet._metadata
+    if metadata:
+        _placeProvenance(metadata)
         # hide the stats:
         stats = None
-        if dataSet.metadata.summaryStats:
-            stats = dataSet.metadata.summaryStats
-            dataSet.metadata.summaryStats = None
-        root.append(_eleFromDictList(dataSet.metadata.record,
+        if metadata.summaryStats:
+            stats = metadata.summaryStats
+            metadata.summaryStats = None
+        root.append(_eleFromDictList(metadata.record,
                                      core=core))
         if stats:
-            dataSet.metadata.summaryStats = stats
+            metadata.summaryStats = stats
         # Metadata order matters....
         #tl = dsmd.find('TotalLength')
         #tl = dsmd.remove(tl)
         #dsmd.insert(0, tl)
 
 
+def _placeProvenance(metadata):
+    """Move any Provenance elements in the DataSetMetadata to just after
+    NumRecords (or to the end, if there is no NumRecords element), where the
+    XSD expects them."""
+    provenance = metadata.removeChildren("Provenance")
+    for i, record in enumerate(metadata.record['children']):
+        if record['tag'] == "NumRecords":
+            for k, value in enumerate(provenance):
+                metadata.record['children'].insert(i + k + 1, value)
+            break
+    else:
+        metadata.extend([p.record for p in provenance])
+
+
 def _guessNs(tag):
     for option in TAGS:
         nsprefix, nstag = option.split(':')
@@ -238,8 +281,29 @@ def _guessNs(tag):
             return NAMESPACES[nsprefix]
     return ''
 
+def _syncBins(record):
+    """Distributions keep their bin counts in an array (see
+    DataSetMembers._BinStore), rewrite the BinCount elements from it if it
+    has changed"""
+    store = record.get('_bins')
+    if store is None or not store.dirty:
+        return
+    counts = [{'tag': 'BinCount', 'text': str(count), 'attrib': {},
+               'children': [], 'namespace': ''}
+              for count in store.counts]
+    for child in record['children']:
+        if child['tag'] == 'BinCounts':
+            child['children'] = counts
+            break
+    else:
+        record['children'].append({'tag': 'BinCounts', 'text': '',
+                                   'attrib': {}, 'children': counts,
+                                   'namespace': ''})
+    store.dirty = False
+
 def _eleFromDictList(eleAsDict, core=False):
     """Create an ElementTree Element from a DictList"""
+    _syncBins(eleAsDict)
     # Elements should have namespaces from the XML file. If you add new
     # elements that have classes in DataSetMembers, associated namespaces
     # should be handled there. Some elements don't get a class and are covered
@@ -299,3 +363,135 @@ def _extResToXMLAttribs(extRes):
         if value and not (key == 'PacBioIndex' or key == 'PacBioMetadata'):
             attr[key] = value
     return attr
+
+
+# Streaming XML Writer:
+
+XSI = "http://www.w3.org/2001/XMLSchema-instance"
+
+# uri -> prefix, as registered with ElementTree above (plus xsi):
+_PREFIXES = dict((uri, prefix) for prefix, uri in NAMESPACES.items()
+                 if prefix)
+_PREFIXES[XSI] = 'xsi'
+
+def _encode(value):
+    if not isinstance(value, basestring):
+        value = str(value)
+    if isinstance(value, unicode):
+        value = value.encode('UTF-8')
+    return value
+
+def _escapeText(text):
+    return (_encode(text).replace('&', '&amp;').replace('<', '&lt;')
+            .replace('>', '&gt;'))
+
+def _escapeAttrib(value):
+    return (_escapeText(value).replace('"', '&quot;')
+            .replace('\n', '&#10;'))
+
+def _qualify(name, decls, namespace=None, scope=None):
+    """Convert a '{uri}name' (or a name in namespace) to 'prefix:name'.
+    Namespaces without a registered prefix or a declaration in an enclosing
+    element (scope) are declared on this element, in decls"""
+    if name[:1] == '{':
+        namespace, name = name[1:].split('}', 1)
+    if not namespace:
+        return name
+    prefix = _PREFIXES.get(namespace)
+    if prefix is None and scope:
+        prefix = scope.get(namespace)
+    if prefix is None:
+        prefix = decls.get(namespace)
+        if prefix is None:
+            prefix = 'ns{i}'.format(i=len(decls) + len(scope or ()))
+            decls[namespace] = prefix
+    return '{p}:{n}'.format(p=prefix, n=name)
+
+def _startTag(tag, attribs, decls, close=False, scope=None):
+    """Both attributes and namespace declarations are sorted, as in
+    minidom's pretty printed output"""
+    attribs = [(_qualify(key, decls, scope=scope), value)
+               for key, value in attribs.items()]
+    attribs.extend(('xmlns:' + prefix, uri)
+                   for uri, prefix in decls.items())
+    attribs.sort()
+    parts = ['<', tag]
+    for key, value in attribs:
+        parts.extend((' ', key, '="', _escapeAttrib(value), '"'))
+    parts.append('/>' if close else '>')
+    return ''.join(parts)
+
+def _streamRecord(record, emit, depth, pretty, skip=(), scope=None):
+    """Emit a RecordWrapper dict tree, one line per element if pretty"""
+    _syncBins(record)
+    decls = {}
+    namespace = record['namespace']
+    if namespace == '':
+        namespace = _guessNs(record['tag'])
+    tag = _qualify(record['tag'], decls, namespace, scope)
+    indent = '\t' * depth if pretty else ''
+    start = _startTag(tag, record['attrib'], decls, scope=scope)
+    text = record['text']
+    children = [child for child in record['children']
+                if not child['tag'] in skip]
+    if not children:
+        if text:
+            emit(''.join((indent, start, _escapeText(text),
+                          '</', tag, '>')))
+        else:
+            emit(indent + start[:-1] + '/>')
+        return
+    emit(indent + start)
+    if text and (not pretty or text.strip()):
+        emit(indent + ('\t' if pretty else '') + _escapeText(text))
+    if decls:
+        scope = dict(scope or {})
+        scope.update(decls)
+    for child in children:
+        _streamRecord(child, emit, depth + 1, pretty, scope=scope)
+    emit('{i}</{t}>'.format(i=indent, t=tag))
+
+def _streamDataSet(dataSet, emit, depth, pretty, root=False):
+    """Emit a DataSet (or subdataset) element, in the same order and with the
+    same defaulted attributes as _toElementTree"""
+    attribs = dict(dataSet.objMetadata)
+    if not attribs.get('CreatedAt'):
+        attribs['CreatedAt'] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    if not attribs.get('Version'):
+        attribs['Version'] = XML_VERSION
+    if not attribs.get('{' + XSI + '}schemaLocation'):
+        attribs['{' + XSI + '}schemaLocation'] = (
+            "http://pacificbiosciences.com/PacBioDataModel.xsd")
+    decls = {}
+    tag = _qualify(type(dataSet).__name__, decls, NAMESPACES[''])
+    if root:
+        decls.update(_PREFIXES)
+    # Only the top level of the metadata is rearranged here, so read the
+    # (possibly shared, see DataSet.copy) metadata without unsharing it:
+    metadata = dataSet._metadata
+    sections = [dataSet._externalResources, dataSet.filters,
+                dataSet.subdatasets, metadata]
+    indent = '\t' * depth if pretty else ''
+    if not any(sections):
+        emit(indent + _startTag(tag, attribs, decls, close=True))
+        return
+    emit(indent + _startTag(tag, attribs, decls))
+    extRes, filters, subdatasets, metadata = sections
+    if extRes:
+        _streamRecord(extRes.record, emit, depth + 1, pretty)
+    if filters:
+        _streamRecord(filters.record, emit, depth + 1, pretty)
+    if subdatasets:
+        dsTag = _qualify('DataSets', {}, NAMESPACES[''])
+        emit('{i}<{t}>'.format(i=indent + ('\t' if pretty else ''),
+                               t=dsTag))
+        for subSet in subdatasets:
+            _streamDataSet(subSet, emit, depth + 2, pretty)
+        emit('{i}</{t}>'.format(i=indent + ('\t' if pretty else ''),
+                                t=dsTag))
+    if metadata:
+        _placeProvenance(metadata)
+        # hide the stats:
+        _streamRecord(metadata.record, emit, depth + 1, pretty,
+                      skip=('SummaryStats',))
+    emit('{i}</{t}>'.format(i=indent, t=tag))
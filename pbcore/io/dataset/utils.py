@@ -14,6 +14,8 @@ import shutil
 import datetime
 import pysam
 from pbcore.util.Process import backticks
+from pbcore.io.FastaIO import writeFastaIndex, splitFastaHeader
+from pbcore.io.FastqIO import writeFastqIndex
 
 log = logging.getLogger(__name__)
 
@@ -116,8 +118,73 @@ def _indexBam(fname):
     return fname + ".bai"
 
 def _indexFasta(fname):
-    pysam.samtools.faidx(fname, catch_stdout=False)
-    return fname + ".fai"
+    if fname.endswith(".fastq"):
+        return writeFastqIndex(fname)
+    if fname.endswith(".gz"):
+        pysam.samtools.faidx(fname, catch_stdout=False)
+        return fname + ".fai"
+    return writeFastaIndex(fname)
+
+# bases copied from the sources at a time when writing contigs
+STITCH_BLOCKSIZE = 60 * 16384
+
+def _writeContigs(outfn, contigs, fastq=False, columns=60):
+    """Stream contigs into a new FASTA (or four-line FASTQ) file, writing its
+    .fai in the same pass. Each contig is the concatenation of the sequences
+    (and qualities) of its pieces, copied in blocks straight from the source
+    records. The output matches that of FastaWriter/FastqWriter, and the
+    index that of _indexFasta.
+
+    Args:
+        :outfn: The output filename
+        :contigs: An iterable of (header, pieces) tuples, pieces being the
+                  ordered list of records making up the contig
+        :fastq: Write FASTQ rather than FASTA
+        :columns: The FASTA line width
+
+    Returns:
+        The index filename
+    """
+    faiFn = outfn + ".fai"
+    with open(outfn, "w") as out, open(faiFn, "w") as fai:
+        for header, pieces in contigs:
+            name = splitFastaHeader(header)[0]
+            out.write(("@" if fastq else ">") + header + "\n")
+            offset = out.tell()
+            length = 0
+            carry = ""
+            for piece in pieces:
+                sequence = piece.sequence
+                for start in xrange(0, len(sequence), STITCH_BLOCKSIZE):
+                    block = sequence[start:start + STITCH_BLOCKSIZE]
+                    length += len(block)
+                    if fastq:
+                        out.write(block)
+                        continue
+                    block = carry + block
+                    full = len(block) - len(block) % columns
+                    if full:
+                        out.write("\n".join(block[i:i + columns]
+                                            for i in xrange(0, full, columns)))
+                        out.write("\n")
+                    carry = block[full:]
+            if fastq:
+                out.write("\n+\n")
+                qualOffset = out.tell()
+                for piece in pieces:
+                    out.write(piece.qualityString)
+                out.write("\n")
+                fai.write("%s\t%d\t%d\t%d\t%d\t%d\n" % (
+                    name, length, offset, length, length + 1, qualOffset))
+                continue
+            if carry or not length:
+                out.write(carry + "\n")
+            # like samtools, empty FASTA records are left out of the index
+            if length:
+                lineWidth = min(length, columns)
+                fai.write("%s\t%d\t%d\t%d\t%d\n" % (
+                    name, length, offset, lineWidth, lineWidth + 1))
+    return faiFn
 
 def _pbmergeXML(indset, outbam):
     cmd = "pbmerge -o {o} {i} ".format(i=indset,
@@ -1,7 +1,10 @@
-from nose.tools import assert_equal, assert_true, assert_false
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
 from pbcore import data
 from pbcore.io import FastaReader, FastaWriter, FastaRecord
+from pbcore.io._utils import splitFastaRecords
 from StringIO import StringIO
+import os
+import tempfile
 
 class TestFastaRecord(object):
 
@@ -96,6 +99,29 @@ class TestFastaReader(object):
             assert_true("\r" not in e.header)
             assert_equal(16, len(e.sequence))
 
+    def test_blockParser(self):
+        contents = (">r1 first\nACGT\nAC\r\n>r2\n>r3>x\nGG\nTT\n>r4\r\nA")
+        expected = [("r1 first", "ACGTAC"), ("r2", ""), ("r3>x", "GGTT"),
+                    ("r4", "A")]
+        for blockSize in (1, 2, 3, 5, 8, 4194304):
+            records = [rec for window in
+                       splitFastaRecords(StringIO(contents), blockSize)
+                       for rec in window]
+            assert_equal(expected, records)
+        assert_equal([], list(splitFastaRecords(StringIO(""))))
+
+    def test_batches(self):
+        expected = [(e.header, e.sequence)
+                    for e in FastaReader(data.getFasta())]
+        batches = list(FastaReader(data.getFasta()).batches(10))
+        assert_equal([10, 10, 10, 10, 8], [len(b) for b in batches])
+        assert_equal(expected, [rec for b in batches for rec in b])
+
+    def test_invalidFasta(self):
+        f = FastaReader(StringIO("ACGT\n>r1\nACGT\n"))
+        with assert_raises(ValueError):
+            list(f)
+
 
 
 class TestFastaWriter(object):
@@ -125,3 +151,40 @@ class TestFastaWriter(object):
         for record in FastaReader(self.fasta1):
             w.writeRecord(record.header, record.sequence)
         assert_equal(self.fasta1.getvalue(), f.getvalue())
+
+    def test_writeRecords(self):
+        records = [FastaRecord("r%d comment" % i, "GATTACA" * i)
+                   for i in xrange(30)]
+        expected = StringIO()
+        w = FastaWriter(expected)
+        for record in records:
+            w.writeRecord(record)
+        for size in (1, 7, 4096):
+            f = StringIO()
+            w = FastaWriter(f)
+            # records and (header, sequence) tuples may be mixed:
+            w.writeRecords([r if i % 2 else (r.header, r.sequence)
+                            for i, r in enumerate(records)], size=size)
+            assert_equal(expected.getvalue(), f.getvalue())
+        assert_raises(ValueError, FastaWriter(StringIO()).writeRecords,
+                      [("r1", "GATT>ACA")])
+        assert_raises(ValueError, FastaWriter(StringIO()).writeBatch,
+                      [("r1\nr2", "GATTACA")])
+
+    def test_writeBatch(self):
+        f = StringIO()
+        w = FastaWriter(f)
+        for batch in FastaReader(self.fasta1).batches():
+            w.writeBatch(batch)
+        assert_equal(self.fasta1.getvalue(), f.getvalue())
+
+    def test_backgroundCompression(self):
+        fn = tempfile.NamedTemporaryFile(suffix=".fasta.gz").name
+        records = [FastaRecord("r%d" % i, "GATTACA" * i) for i in xrange(100)]
+        with FastaWriter(fn, backgroundCompression=True) as w:
+            w.BUFFERSIZE = 100
+            w.writeRecords(records[:50])
+            w.writeRecord(records[50])
+            w.writeRecords(records[51:])
+        assert_equal(records, list(FastaReader(fn)))
+        os.remove(fn)
@@ -1,6 +1,15 @@
-from nose.tools import assert_equal, assert_true, assert_false
+import os
+import shutil
+import tempfile
+import numpy as np
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
 from pbcore import data
-from pbcore.io import FastaReader, FastaWriter, IndexedFastaReader
+from pbcore.io import (FastaReader, FastaWriter, IndexedFastaReader,
+                       IndexedBamReader, ReferenceSet)
+from pbcore.io.FastaIO import writeFastaIndex, PackedFastaStore, FaiRecord
+from pbcore.sequence import reverseComplement
+from pbcore.io.align._bgzf import BgzfWriter
+from pbcore.io.dataset.utils import _indexFasta
 
 
 class TestIndexedFastaReader(object):
@@ -86,3 +95,165 @@ class TestIndexedFastaReader(object):
         assert_equal(1, len(entries))
         assert_equal("chr1", entries[0].header)
         assert_equal("acgtacgtacgtact", entries[0].sequence[:])
+
+    def test_lazyHeaders(self):
+        ft = IndexedFastaReader(self.fastaPath)
+        assert_equal({}, ft.fai._headers)
+        assert_equal(48, len(ft.fai))
+        # only the headers of the records looked at are read:
+        assert_equal(203, len(ft["ref000002|EGFR_Exon_3"]))
+        assert_equal([1], ft.fai._headers.keys())
+        assert_equal("ref000004|EGFR_Exon_5", ft.fai[3].header)
+        assert_equal([1, 3], sorted(ft.fai._headers.keys()))
+
+    def test_faiRecordTuple(self):
+        ft = IndexedFastaReader(self.fastaPath)
+        record = ft.fai[2]
+        assert_true(isinstance(record, FaiRecord))
+        assert_equal(("ref000003|EGFR_Exon_4", 215), (record.id, record.length))
+        id_, comment, header, length, offset, lineWidth, stride = record
+        assert_equal("ref000003|EGFR_Exon_4", header)
+        assert_equal(None, comment)
+        expected = FaiRecord(id_, comment, header, length, offset,
+                             lineWidth, stride)
+        assert_equal(expected, record)
+        assert_equal(tuple(expected), tuple(record))
+        assert_equal(header, record[2])
+        assert_equal(expected._asdict(), record._asdict())
+        assert_equal(expected._replace(length=10), record._replace(length=10))
+        assert_equal(repr(expected), repr(record))
+        # (CPython reads the tuple directly in these)
+        assert_equal("{0} {1}".format(header, length),
+                     "{2} {3}".format(*record))
+        assert_equal(header, ("%s %s %s %s %s %s %s" % record).split()[2])
+        records = np.rec.fromrecords(list(ft.fai), names=FaiRecord._fields)
+        assert_equal([r.header for r in FastaReader(self.fastaPath)],
+                     list(records.header))
+
+
+class TestWriteFastaIndex(object):
+
+    def _index(self, contents):
+        fn = tempfile.NamedTemporaryFile(suffix=".fasta", delete=False).name
+        with open(fn, "w") as f:
+            f.write(contents)
+        try:
+            return open(writeFastaIndex(fn)).read()
+        finally:
+            os.remove(fn)
+            if os.path.exists(fn + ".fai"):
+                os.remove(fn + ".fai")
+
+    def test_writeFastaIndex(self):
+        assert_equal("a\t6\t5\t4\t5\nb\t4\t20\t3\t5\nc\t2\t31\t2\t3\n",
+                     self._index(">a x\nACGT\nAC\n>e\n>b\r\nAAA\r\nA\r\n"
+                                 ">c\nAC"))
+        assert_raises(ValueError, self._index, ">a\nAC\nACGT\n")
+        assert_raises(ValueError, self._index, ">a\nACGT\n\nAC\n")
+
+    def test_roundTrip(self):
+        fn = tempfile.NamedTemporaryFile(suffix=".fasta", delete=False).name
+        with FastaWriter(fn) as w:
+            for r in FastaReader(self.fastaPath):
+                w.writeRecord(r)
+        writeFastaIndex(fn)
+        ft = IndexedFastaReader(fn)
+        for fr, ftr in zip(FastaReader(self.fastaPath), ft):
+            assert_equal(fr.header, ftr.header)
+            assert_equal(fr.sequence, ftr.sequence[:])
+        ft.close()
+        os.remove(fn)
+        os.remove(fn + ".fai")
+
+    def setup(self):
+        self.fastaPath = data.getFasta()
+
+
+class TestBgzfIndexedFastaReader(object):
+
+    def setup(self):
+        self.tempDir = tempfile.mkdtemp(suffix="bgzf")
+        self.plainPath = data.getLambdaFasta()
+        self.gzPath = os.path.join(self.tempDir, "lambda.fasta.gz")
+        contents = open(self.plainPath).read()
+        writer = BgzfWriter(self.gzPath)
+        # small blocks, so that slices span several of them
+        for start in xrange(0, len(contents), 10000):
+            writer.write(contents[start:start + 10000])
+            writer.flush()
+        writer.close()
+        _indexFasta(self.gzPath)
+
+    def teardown(self):
+        shutil.rmtree(self.tempDir)
+
+    def _checkAgainstPlain(self):
+        plain = IndexedFastaReader(self.plainPath)
+        gz = IndexedFastaReader(self.gzPath)
+        assert_true(len(gz.view.uOffsets) > 1)
+        for p, g in zip(plain, gz):
+            assert_equal(p.header, g.header)
+            assert_equal(len(p), len(g))
+            for start, end in [(0, 10), (9990, 30100), (len(p) - 5, len(p)),
+                               (0, len(p))]:
+                assert_equal(p.sequence[start:end], g.sequence[start:end])
+
+    def test_withGzi(self):
+        assert_true(os.path.exists(self.gzPath + ".gzi"))
+        self._checkAgainstPlain()
+
+    def test_withoutGzi(self):
+        os.remove(self.gzPath + ".gzi")
+        self._checkAgainstPlain()
+
+    def test_compressedReference(self):
+        bamFname = data.getBamAndCmpH5()[0]
+        plain = IndexedBamReader(bamFname, self.plainPath)
+        gz = IndexedBamReader(bamFname, self.gzPath)
+        for p, g in zip(plain[:20], gz[:20]):
+            assert_equal(p.reference(), g.reference())
+        rs = ReferenceSet(self.gzPath)
+        assert_equal(["lambda_NEB3011"], rs.contigNames)
+
+
+class TestPackedIndexedFastaReader(object):
+
+    def setup(self):
+        self.tempDir = tempfile.mkdtemp(suffix="packed")
+        self.fastaPath = os.path.join(self.tempDir, "masked.fasta")
+        with FastaWriter(self.fastaPath) as w:
+            w.writeRecord("c1", "ACGTNNNNNacgtnnRYKacGTA" * 7)
+            w.writeRecord("c2 has comment", "GATTACA")
+            w.writeRecord("c3", "NNNNNNNNNN")
+        writeFastaIndex(self.fastaPath)
+
+    def teardown(self):
+        shutil.rmtree(self.tempDir)
+
+    def test_packedSlices(self):
+        plain = IndexedFastaReader(self.fastaPath)
+        packed = IndexedFastaReader(self.fastaPath, packed=True)
+        assert_equal(3, len(packed.packedStore))
+        for p, q in zip(plain, packed):
+            assert_equal(p.header, q.header)
+            L = len(p)
+            for start in range(L + 1):
+                for end in (start, start + 1, start + 5, start + 30, L):
+                    end = min(end, L)
+                    expected = p.sequence[start:end]
+                    assert_equal(expected, q.sequence[start:end])
+                    assert_equal(reverseComplement(expected),
+                                 q.sequence.reverseComplement(start, end))
+            assert_equal(p.sequence[-1], q.sequence[-1])
+
+    def test_saveAndLoad(self):
+        packed = IndexedFastaReader(self.fastaPath, packed=True)
+        prefix = os.path.join(self.tempDir, "masked")
+        packed.packedStore.save(prefix)
+        store = PackedFastaStore.load(prefix)
+        assert_false(store.bases.flags.writeable)
+        shared = IndexedFastaReader(self.fastaPath, packed=store)
+        assert_equal([str(r.sequence) for r in packed],
+                     [str(r.sequence) for r in shared])
+        assert_raises(ValueError, IndexedFastaReader, data.getFasta(),
+                      packed=store)
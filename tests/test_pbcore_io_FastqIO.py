@@ -1,9 +1,12 @@
-from nose.tools import assert_equal, assert_true, assert_false
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
 from numpy.testing import assert_array_equal
 from pbcore import data
 from StringIO import StringIO
+import os
+import tempfile
 
 from pbcore.io.FastqIO import *
+from pbcore.io.FastqIO import writeFastqIndex
 
 
 # Test QV <-> string conversion routines
@@ -147,6 +150,30 @@ class TestFastqReader(object):
                       FastqRecord("seq2", "CATTAGA", [31]*7) ],
                      l)
 
+    def test_batches(self):
+        fastq = StringIO(self.fastq2.getvalue() + "@seq3 empty\n\n+\n\n")
+        batches = list(FastqReader(fastq).batches(2))
+        assert_equal([2, 1], [len(b) for b in batches])
+        assert_equal(["seq1", "seq2"], batches[0].headers)
+        assert_equal("GATTACACATTAGA", batches[0].sequences)
+        assert_array_equal([0, 7, 14], batches[0].offsets)
+        assert_array_equal(range(22, 29) + [31]*7, batches[0].qualities)
+        assert_array_equal([25, 31], batches[0].meanQvs())
+        assert_array_equal([0], batches[1].lengths)
+        assert_equal(list(FastqReader(StringIO(fastq.getvalue()))),
+                     [r for b in batches for r in b])
+
+    def test_lazyQuality(self):
+        record = next(iter(FastqReader(self.fastq1)))
+        assert_true(record._quality is None)
+        assert_equal("789:;<=", record.qualityString)
+        assert_array_equal(range(22, 29), record.quality)
+        record.quality[0] = 0
+        assert_equal("!89:;<=", record.qualityString)
+        record = FastqRecord("seq1", "GATT", qualityString="IIII")
+        record.quality[0] = 0
+        assert_equal("!III", record.qualityString)
+
 
 class TestFastqWriter(object):
 
@@ -181,3 +208,71 @@ class TestFastqWriter(object):
         for record in FastqReader(self.fastq2):
             w.writeRecord(record.header, record.sequence, record.quality)
         assert_equal(self.fastq2.getvalue(), f.getvalue())
+
+
+    def test_writeRecords(self):
+        records = list(FastqReader(self.fastq2))
+        for size in (1, 4096):
+            f = StringIO()
+            w = FastqWriter(f)
+            w.writeRecords([records[0],
+                            (records[1].header, records[1].sequence,
+                             records[1].quality)], size=size)
+            assert_equal(self.fastq2.getvalue(), f.getvalue())
+        f = StringIO()
+        FastqWriter(f).writeRecords([("r1", "ACGT", [10, 20, 30, 99]),
+                                     ("r2", "", []),
+                                     ("r3", "GG", "!!")])
+        assert_equal("@r1\nACGT\n+\n+5?~\n@r2\n\n+\n\n@r3\nGG\n+\n!!\n",
+                     f.getvalue())
+        assert_raises(ValueError, FastqWriter(StringIO()).writeRecords,
+                      [("r1", "ACGT", [10, 20, 30])])
+
+    def test_writeBatch(self):
+        f = StringIO()
+        w = FastqWriter(f)
+        for batch in FastqReader(self.fastq2).batches(1):
+            w.writeBatch(batch)
+        assert_equal(self.fastq2.getvalue(), f.getvalue())
+
+    def test_backgroundCompression(self):
+        fn = tempfile.NamedTemporaryFile(suffix=".fastq.gz").name
+        records = [FastqRecord("r%d" % i, "GATTACA" * i, [i % 94] * 7 * i)
+                   for i in xrange(100)]
+        with FastqWriter(fn, backgroundCompression=True) as w:
+            w.BUFFERSIZE = 100
+            w.writeRecords(records)
+        assert_equal(records, list(FastqReader(fn)))
+        os.remove(fn)
+
+
+class TestIndexedFastqReader(object):
+
+    def setup(self):
+        self.fastq = tempfile.NamedTemporaryFile(suffix=".fastq",
+                                                 delete=False).name
+        with open(self.fastq, "w") as f:
+            f.write("@seq1 first\nGATTACA\n+\n789:;<=\n"
+                    "@seq2\r\nCATTAGA\r\n+\r\n@@@@@@@\r\n"
+                    "@seq3\n\n+\n\n")
+        writeFastqIndex(self.fastq)
+
+    def teardown(self):
+        os.remove(self.fastq)
+        os.remove(self.fastq + ".fai")
+
+    def test_index(self):
+        assert_equal("seq1\t7\t12\t7\t8\t22\n"
+                     "seq2\t7\t37\t7\t9\t49\n"
+                     "seq3\t0\t64\t0\t1\t67\n",
+                     open(self.fastq + ".fai").read())
+
+    def test_randomAccess(self):
+        r = IndexedFastqReader(self.fastq)
+        assert_equal(3, len(r))
+        assert_equal(r[0], next(iter(FastqReader(self.fastq))))
+        assert_equal("first", r["seq1"].comment)
+        assert_equal("TTA", r["seq1 first"].sequence[2:5])
+        assert_array_equal([31] * 7, r[1].quality)
+        assert_equal("", r[-1].sequence[:])
+        assert_equal("@seq2\nCATTAGA\n+\n@@@@@@@", str(r["seq2"]))
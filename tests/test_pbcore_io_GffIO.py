@@ -4,7 +4,8 @@ import tempfile
 import unittest
 import os.path
 
-from nose.tools import assert_equal, assert_raises
+from nose.tools import assert_equal, assert_raises, assert_true
+import numpy as np
 
 from pbcore.io import GffWriter, Gff3Record, GffReader
 from pbcore.io.GffIO import merge_gffs, merge_gffs_sorted, sort_gff
@@ -87,6 +88,53 @@ class TestGffReader(object):
             # Make sure record matches line
             assert_equal(rawLine.strip(), str(record))
 
+    def test_lazyAttributes(self):
+        reader = GffReader(data.getGff3(), lazyAttributes=True)
+        records = list(reader)
+        record = records[0]
+        assert_equal("reference=G;variantSeq=.;frequency=2;coverage=5;"
+                     "confidence=25", record._rawAttributes)
+        assert_equal(30890, record.start)
+        assert_equal(2, record.frequency)
+        assert_equal(None, record._rawAttributes)
+        assert_equal([str(r) for r in GffReader(data.getGff3())],
+                     [str(r) for r in records])
+        copied = records[1].copy()
+        copied.coverage = 6
+        assert_equal(6, copied.get("coverage"))
+        assert_equal(None, copied.get("missing"))
+        bad = Gff3Record.fromString("chr1\t.\tinsertion\t10\t11\t.\t.\t."
+                                    "\tcat", lazyAttributes=True)
+        assert_equal(10, bad.start)
+        with assert_raises(ValueError):
+            bad.attributes
+
+    def test_toArrays(self):
+        records = list(GffReader(data.getGff3()))
+        for chunkSize in (1, 1000):
+            arrays = GffReader(data.getGff3()).toArrays(chunkSize=chunkSize)
+            assert_equal(len(records), len(arrays))
+            assert_equal([r.type for r in records], arrays.type.tolist())
+            assert_equal([r.start for r in records], arrays.start.tolist())
+            assert_equal([r.seqid for r in records], arrays.seqid.tolist())
+            assert_equal(arrays.start.dtype, np.int64)
+            assert_true(np.isnan(arrays.score).all())
+        f = StringIO("##gff-version 3\n"
+                     "chr10\tsrc\tdeletion\t5\t6\t0.5\t+\t.\tcat=1;\n"
+                     "chr2\t.\tinsertion\t10\t11\t.\t-\t0\tdog=2\n")
+        arrays = GffReader(f).toArrays(chunkSize=1)
+        assert_equal(["chr10", "chr2"], arrays.seqid.tolist())
+        assert_equal(["cat=1", "dog=2"], arrays.attributes.tolist())
+        assert_equal(0.5, arrays.score[0])
+        assert_equal(["+", "-"], arrays.strand.tolist())
+        order = np.lexsort((arrays.start, arrays.seqid))
+        assert_equal([0, 1], order.tolist())
+        empty = GffReader(StringIO("##gff-version 3\n")).toArrays()
+        assert_equal(0, len(empty))
+        assert_equal(tuple(Gff3Record._GFF_COLUMNS), empty.dtype.names)
+        with assert_raises(ValueError):
+            GffReader(StringIO("chr1\t.\t5\n")).toArrays()
+
 
 class TestGffWriter(object):
     def setup(self):
@@ -431,6 +431,63 @@ class TestDataSet(unittest.TestCase):
             ds3.filters.addRequirement(rq=[('>', 0.8)])
             ds4 = ds1 + ds2 + ds3
 
+    def test_merge_many(self):
+        def inputs():
+            dsets = []
+            for fname in [data.getXml(8), data.getXml(11), data.getXml(8),
+                          data.getXml(11)]:
+                ds = AlignmentSet(fname)
+                ds.loadStats(data.getStats())
+                dsets.append(ds)
+            return dsets
+        pairwise = reduce(lambda x, y: x + y, inputs())
+        dsets = inputs()
+        # the counts come from the merged resources, not the inputs' metadata:
+        dsets[1].metadata.numRecords = -1
+        merged = dsets[0].mergeMany(dsets[1:])
+        unique = AlignmentSet(data.getXml(8), data.getXml(11))
+        self.assertEqual(merged.numRecords, unique.numRecords)
+        self.assertEqual(merged.totalLength, unique.totalLength)
+        self.assertEqual(merged.toExternalFiles(), pairwise.toExternalFiles())
+        self.assertEqual(len(merged.externalResources), 2)
+        self.assertEqual(len(merged.subdatasets), 4)
+        self.assertEqual(merged.name, pairwise.name)
+        self.assertEqual(merged.metadata.summaryStats.prodDist.bins,
+                         pairwise.metadata.summaryStats.prodDist.bins)
+        self.assertEqual(merged.metadata.summaryStats.readLenDist.bins,
+                         pairwise.metadata.summaryStats.readLenDist.bins)
+        self.assertNotEqual(merged.uuid, dsets[0].uuid)
+        # the inputs are untouched:
+        self.assertEqual(len(dsets[0].externalResources), 1)
+        self.assertEqual(len(dsets[0].subdatasets), 0)
+        original = inputs()[0]
+        for ds in dsets:
+            self.assertEqual(ds.metadata.summaryStats.prodDist.bins,
+                             original.metadata.summaryStats.prodDist.bins)
+            self.assertEqual(ds.metadata.summaryStats.readLenDist.bins,
+                             original.metadata.summaryStats.readLenDist.bins)
+        # as are collections and stats adopted from the inputs:
+        sset1 = SubreadSet(data.getSubreadSet(), skipMissing=True)
+        sset2 = SubreadSet(data.getSubreadSet(), skipMissing=True)
+        sset1.metadata.removeChildren('SummaryStats')
+        sset2.loadStats(data.getStats())
+        prodBins = list(sset2.metadata.summaryStats.prodDist.bins)
+        nCollections = len(sset2.metadata.collections)
+        sset3 = SubreadSet(data.getSubreadSet(), skipMissing=True)
+        sset3.loadStats(data.getStats())
+        merged = sset1.mergeMany([sset2, sset3])
+        self.assertEqual(merged.metadata.summaryStats.prodDist.bins,
+                         [2 * b for b in prodBins])
+        self.assertEqual(sset2.metadata.summaryStats.prodDist.bins, prodBins)
+        self.assertEqual(sset3.metadata.summaryStats.prodDist.bins, prodBins)
+        self.assertEqual(len(sset2.metadata.collections), nCollections)
+        merged.metadata.collections[0].wellSample.name = 'merged'
+        self.assertNotEqual(sset2.metadata.collections[0].wellSample.name,
+                            'merged')
+        # incompatible filters block the merge:
+        dsets[1].filters.addRequirement(rname=[('=', 'E.faecalis.1')])
+        self.assertIsNone(dsets[0].mergeMany(dsets[1:]))
+
     def test_empty_metatype(self):
         inBam = data.getBam()
         d = DataSet(inBam)
@@ -783,6 +840,42 @@ class TestDataSet(unittest.TestCase):
         self.assertEqual(aln.totalLength, 0)
         self.assertEqual(aln.numRecords, 0)
 
+    def test_lazy_open(self):
+        outdir = tempfile.mkdtemp(suffix="dataset-unittest")
+        outXml = os.path.join(outdir, 'tempfile.subreadset.xml')
+        sset = SubreadSet(data.getXml(10))
+        nrecords = len(sset)
+        sset.numRecords = -1
+        sset.write(outXml)
+
+        lazy = SubreadSet(outXml, lazy=True)
+        self.assertFalse(lazy._openReaders)
+        self.assertEqual(lazy.uuid, sset.uuid)
+        self.assertEqual(lazy._metadata.numRecords, -1)
+        # counts are updated on first use:
+        self.assertEqual(lazy.numRecords, nrecords)
+        self.assertEqual(len(lazy), nrecords)
+        self.assertEqual(len(list(lazy)), nrecords)
+        # as is the metadata, and what is written:
+        lazy = SubreadSet(outXml, lazy=True)
+        self.assertEqual(lazy.metadata.numRecords, nrecords)
+        lazy = SubreadSet(outXml, lazy=True)
+        lazyXml = os.path.join(outdir, 'lazy.subreadset.xml')
+        lazy.write(lazyXml)
+        self.assertEqual(SubreadSet(lazyXml, lazy=True)._metadata.numRecords,
+                         nrecords)
+        self.assertIn('<pbds:NumRecords>{n}</pbds:NumRecords>'.format(
+            n=nrecords), open(lazyXml).read())
+
+        # missing resources are only reported on first use:
+        sset.externalResources[0].resourceId = os.path.join(
+            outdir, 'missing.subreads.bam')
+        sset.write(outXml, validate=False)
+        lazy = SubreadSet(outXml, lazy=True)
+        self.assertEqual(lazy.uuid, sset.uuid)
+        with self.assertRaises(InvalidDataSetIOError):
+            lazy.resourceReaders()
+
     @unittest.skipUnless(os.path.isdir("/pbi/dept/secondary/siv/testdata"),
                          "Missing testadata directory")
     def test_barcode_accession(self):
@@ -1151,6 +1244,28 @@ class TestDataSet(unittest.TestCase):
         ds3 = AlignmentSet(data.getBam())
         ds3.write(outfile)
 
+    def test_write_background_validation(self):
+        outdir = tempfile.mkdtemp(suffix="dataset-unittest")
+        outfile = os.path.join(outdir, 'tempfile.alignmentset.xml')
+        ds1 = AlignmentSet(data.getXml(8))
+        validation = ds1.write(outfile, background=True)
+        validation.result()
+        validateFile(outfile)
+        self.assertEqual(AlignmentSet(outfile), ds1)
+
+        # unindented output reads back the same:
+        ds1.write(outfile, pretty=False)
+        with open(outfile) as xmlfile:
+            self.assertEqual(len(xmlfile.read().splitlines()), 1)
+        self.assertEqual(AlignmentSet(outfile), ds1)
+
+        # errors surface when the result is requested:
+        ds1.externalResources[0].resourceId = os.path.join(outdir,
+                                                           'missing.bam')
+        validation = ds1.write(outfile, background=True)
+        with self.assertRaises(IOError):
+            validation.result()
+
     def test_addMetadata(self):
         ds = DataSet()
         ds.addMetadata(None, Name='LongReadsRock')
@@ -1256,6 +1371,28 @@ class TestDataSet(unittest.TestCase):
         self.assertEqual(type(extRef).__name__, "ExternalResource")
         self.assertEqual(extRef.resourceId, 'test2.bam')
 
+    def test_addExternalResources_extends_index(self):
+        for first, second in [(data.getBam(0), data.getBam(1)),
+                              (data.getBam(0),
+                               upstreamdata.getBamAndCmpH5()[0])]:
+            ds = AlignmentSet(first)
+            ds.filters.addRequirement(length=[('>', '500')])
+            self.assertTrue(len(ds.index) > 0)
+            readers = list(ds.resourceReaders())
+            ds.addExternalResources([second])
+            # the open readers are kept:
+            self.assertEqual(len(ds.resourceReaders()), 2)
+            self.assertTrue(ds.resourceReaders()[0] is readers[0])
+            fresh = AlignmentSet(first, second)
+            fresh.filters.addRequirement(length=[('>', '500')])
+            self.assertEqual(ds.numRecords, fresh.numRecords)
+            self.assertEqual(ds.totalLength, fresh.totalLength)
+            self.assertEqual(ds.index.tId.tolist(), fresh.index.tId.tolist())
+            self.assertEqual(ds.index.qId.tolist(), fresh.index.qId.tolist())
+            self.assertEqual(ds._indexMap.tolist(), fresh._indexMap.tolist())
+            self.assertEqual([rec.referenceName for rec in ds],
+                             [rec.referenceName for rec in fresh])
+
     def test_resourceReaders(self):
         ds = AlignmentSet(data.getBam())
         for seqFile in ds.resourceReaders():
@@ -2072,6 +2209,40 @@ class TestDataSet(unittest.TestCase):
         self.assertTrue(isinstance(dist[0], ContinuousDistribution))
         self.assertAlmostEqual(dist[0].sampleMean, 0.8369355201721191, places=3)
 
+    def test_stats_metadata_merge_many(self):
+        stats = []
+        for start, bins in [(10, [1, 2, 3]), (30, [4, 5]), (0, [6]),
+                            (70, [7])]:
+            ds = DataSet(data.getXml(8))
+            ds.loadStats(data.getStats())
+            dist = ds.metadata.summaryStats.readLenDist
+            dist.bins = bins
+            dist.minBinValue = start
+            dist.binWidth = 10
+            stats.append(ds.metadata.summaryStats)
+        merged, others = stats[0], stats[1:]
+        merged.mergeMany(others)
+        dist = merged.readLenDist
+        self.assertEqual(dist.bins, [6, 1, 2, 7, 5, 0, 0, 7])
+        self.assertEqual(dist.minBinValue, 0)
+        self.assertEqual(dist.sampleSize, 4 * 901)
+        self.assertEqual(len(merged.readLenDists), 1)
+        self.assertEqual(merged.prodDist.bins, [4 * 1576, 4 * 901, 4 * 399, 0])
+        # identical distributions pool to the same mean and std:
+        readQual = stats[1].readQualDist
+        self.assertAlmostEqual(merged.readQualDist.sampleMean,
+                               readQual.sampleMean)
+        self.assertAlmostEqual(merged.readQualDist.sampleStd,
+                               readQual.sampleStd, places=4)
+        self.assertEqual(merged.readQualDist.bins,
+                         [4 * count for count in readQual.bins])
+        # bins are rewritten on serialization:
+        from pbcore.io.dataset.DataSetWriter import _eleFromDictList
+        ele = _eleFromDictList(dist.record)
+        self.assertEqual([int(count.text) for count in ele.iter()
+                          if count.tag.endswith('}BinCount')],
+                         [6, 1, 2, 7, 5, 0, 0, 7])
+
     def test_stats_metadata(self):
         ds = DataSet(data.getBam())
         ds.loadStats(data.getStats())
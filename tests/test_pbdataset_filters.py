@@ -9,7 +9,7 @@ import numpy as np
 
 from pbcore.io import (DataSet, SubreadSet, ReferenceSet, AlignmentSet,
                        ConsensusReadSet)
-from pbcore.io.dataset.DataSetMembers import Filters
+from pbcore.io.dataset.DataSetMembers import Filters, HistogramAccumulator
 import pbcore.data.datasets as data
 import pbcore.data as upstreamdata
 
@@ -435,6 +435,132 @@ class TestDataSetFilters(unittest.TestCase):
         self.assertEqual(len(og), size)
 
 
+    def test_qname_file_mixed_names(self):
+        fn = tempfile.NamedTemporaryFile(suffix="filterVals.txt").name
+        sset = SubreadSet(data.getXml(10))
+        self.assertEqual(len(sset), 92)
+        reads = list(sset[:10])
+        full = [r.qName for r in reads[:3]]
+        zmw = '/'.join(reads[5].qName.split('/')[:2])
+        nzmw = sum(1 for hn in sset.index.holeNumber
+                   if hn == reads[5].holeNumber)
+        # the holeNumber of one read and the span of another shouldn't match:
+        movie, hn, _ = reads[0].qName.split('/')
+        other = [r for r in reads if r.holeNumber != int(hn)][0]
+        crossed = '/'.join([movie, hn, other.qName.split('/')[2]])
+        with open(fn, 'w') as ofh:
+            for q in full + ['', zmw, crossed, 'notamovie/1/0_10']:
+                ofh.write(q)
+                ofh.write('\n')
+        sset.filters.addRequirement(qname_file=[('=', fn)])
+        self.assertEqual(len(sset), 3 + nzmw)
+        self.assertEqual(len(sset), sum(1 for _ in sset))
+        names = set(r.qName for r in sset)
+        self.assertTrue(set(full) <= names)
+        self.assertFalse(crossed in names)
+
+        sset = SubreadSet(data.getXml(10))
+        sset.filters.addRequirement(qname_file=[('!=', fn)])
+        self.assertEqual(len(sset), 92 - 3 - nzmw)
+
+    def test_incremental_refilter(self):
+        ds = AlignmentSet(data.getXml(8))
+        ds.filters.addRequirement(rname=[('=', 'E.faecalis.1')])
+        self.assertEqual(len(ds.index), 20)
+        evaluated = []
+        original = Filters.filterIndexRecords
+        def counting(filters, indexRecords, *args, **kwargs):
+            evaluated.append((str(filters), len(indexRecords)))
+            return original(filters, indexRecords, *args, **kwargs)
+        Filters.filterIndexRecords = counting
+        try:
+            # AND-ing a requirement only evaluates it on the passing rows:
+            ds.filters.addRequirement(mapqv=[('>', '128')])
+            refined = ds.index
+            self.assertEqual(evaluated, [('( mapqv > 128 )', 20)])
+            # OR-ing a filter re-evaluates everything:
+            del evaluated[:]
+            ds.filters.addFilter(rname=[('=', 'E.faecalis.2')])
+            widened = ds.index
+            self.assertEqual([n for _, n in evaluated], [92])
+        finally:
+            Filters.filterIndexRecords = original
+        fresh = AlignmentSet(data.getXml(8))
+        fresh.filters.addRequirement(rname=[('=', 'E.faecalis.1')])
+        fresh.filters.addRequirement(mapqv=[('>', '128')])
+        self.assertEqual(refined.tolist(), fresh.index.tolist())
+        fresh.filters.addFilter(rname=[('=', 'E.faecalis.2')])
+        self.assertEqual(widened.tolist(), fresh.index.tolist())
+        self.assertEqual(ds._indexMap.tolist(), fresh._indexMap.tolist())
+
+    def test_streamed_filtered_counts(self):
+        for dset in (SubreadSet(data.getXml(10)),
+                     AlignmentSet(data.getXml(8))):
+            qn = [r.qName for r in dset[:10]]
+            dset.filters.addRequirement(qname=[('=', qn)])
+            dset.filters.addRequirement(length=[('>', '1000')])
+            dset.close()
+            dset._index = None
+            self.assertTrue(dset._canStreamIndex)
+            numRecords, totalLength, rows = dset._streamIndex(
+                keepRows=True, chunkSize=20)
+            self.assertFalse(dset._openReaders)
+
+            dset.updateCounts()
+            self.assertTrue(0 < numRecords < 10)
+            self.assertEqual(numRecords, len(dset.index))
+            self.assertEqual(numRecords, dset.numRecords)
+            self.assertEqual(totalLength, dset.totalLength)
+            self.assertEqual(len(rows), len(dset.externalResources))
+            streamed = [(rrNum, row) for rrNum, runs in enumerate(rows)
+                        for start, end in runs for row in xrange(start, end)]
+            self.assertEqual(streamed, dset._indexMap.tolist())
+
+    def test_filtered_stats_from_index(self):
+        dset = SubreadSet(data.getXml(10))
+        dset.filters.addRequirement(length=[('>', '1000')])
+        stats = dset.updateStats()
+        self.assertFalse(dset._openReaders)
+        lengths = dset.index.qEnd - dset.index.qStart
+        self.assertEqual(dset.numRecords, len(dset.index))
+        self.assertEqual(dset.totalLength, lengths.sum())
+        self.assertEqual(stats.readLenDist.bins,
+                         np.bincount(lengths // 100).tolist())
+        self.assertAlmostEqual(stats.readLenDist.sampleMean, lengths.mean())
+        self.assertEqual(stats.readQualDist.sampleSize, len(dset.index))
+        readQuals = np.rint(dset.index.readQual * 1e4).astype(int)
+        self.assertEqual(stats.readQualDist.bins,
+                         np.bincount(readQuals // 100).tolist())
+        longest = {}
+        for hn, length in zip(dset.index.holeNumber, lengths):
+            longest[hn] = max(longest.get(hn, 0), length)
+        self.assertEqual(stats.insertReadLenDist.sampleSize, len(longest))
+        self.assertEqual(stats.insertReadLenDist.bins,
+                         np.bincount(np.array(longest.values()) //
+                                     100).tolist())
+
+        # chunk stats merge back into the stats of the whole:
+        chunks = dset.split(zmws=True, chunks=2)
+        chunkStats = [chunk.updateStats() for chunk in chunks]
+        chunkStats[0].mergeMany(chunkStats[1:])
+        for dist in ('readLenDist', 'readQualDist', 'insertReadLenDist'):
+            merged = getattr(chunkStats[0], dist)
+            whole = getattr(stats, dist)
+            self.assertEqual(merged.bins, whole.bins)
+            self.assertEqual(merged.sampleSize, whole.sampleSize)
+            self.assertAlmostEqual(merged.sampleStd, whole.sampleStd,
+                                   places=4)
+
+    def test_stats_bin_edges(self):
+        # values on a bin edge go in the bin starting there, despite float
+        # error in the division (0.29 / 0.01 < 29):
+        acc = HistogramAccumulator(0.01)
+        acc.add([0.29, 0.57])
+        acc.add(np.array([0.29, 1.0], dtype=np.float32))
+        counts = np.zeros(101, dtype=np.int64)
+        counts[[29, 57, 100]] = [2, 1, 1]
+        self.assertEqual(acc.counts.tolist(), counts.tolist())
+
     @unittest.skipIf(not _internal_data(),
                      "Internal data not available")
     def test_qname_filter_scaling(self):
@@ -8,7 +8,8 @@ from collections import Counter
 
 from pbcore.io import SubreadSet, AlignmentSet
 from pbcore.io.dataset.DataSetErrors import InvalidDataSetIOError
-from pbcore.io.dataset.DataSetMembers import CollectionMetadata
+from pbcore.io.dataset.DataSetMembers import (CollectionMetadata,
+                                              RecordWrapper, _emptyMember)
 import pbcore.data.datasets as data
 from pbcore.io.dataset.DataSetValidator import validateFile
 
@@ -151,6 +152,45 @@ class TestDataSet(unittest.TestCase):
                               'm54013_151205_032353.sts.xml')
 
 
+    def test_child_tag_index(self):
+        parent = RecordWrapper(_emptyMember(tag='Parent'))
+        parent.extend([_emptyMember(tag='Child{i}'.format(i=i % 3),
+                                    text=str(i))
+                       for i in range(6)])
+        self.assertEqual(parent.getMemberV('Child1'), '1')
+        self.assertEqual([c.metavalue for c in parent.findChildren('Child2')],
+                         ['2', '5'])
+        parent.append(_emptyMember(tag='Child3', text='6'))
+        self.assertEqual(parent.index('Child3'), 6)
+        parent.pop(0)
+        self.assertEqual(parent.getMemberV('Child0'), '3')
+        parent.remove(parent.getV('children', 'Child1'))
+        self.assertEqual(parent.getMemberV('Child1'), '4')
+        parent.setMemberV('Child4', 7)
+        self.assertEqual(parent.index('Child4'), 5)
+        # direct modifications of the list are seen too:
+        parent.record['children'].insert(0, _emptyMember(tag='Child2',
+                                                         text='new'))
+        self.assertEqual(parent.getMemberV('Child2'), 'new')
+        # and copies don't share the index:
+        other = RecordWrapper(copy.deepcopy(parent.record))
+        other.pop(0)
+        self.assertEqual(other.getMemberV('Child2'), '2')
+        self.assertEqual(parent.getMemberV('Child2'), 'new')
+        # popping from the middle, with the same tag at the end:
+        parent = RecordWrapper(_emptyMember(tag='Parent'))
+        parent.extend([_emptyMember(tag=tag, text=str(i))
+                       for i, tag in enumerate('AABA')])
+        self.assertEqual(parent.index('A'), 0)
+        parent.pop(1)
+        self.assertEqual([c.metavalue for c in parent.findChildren('A')],
+                         ['0', '3'])
+        self.assertEqual([c.metavalue for c in parent.findChildren('B')],
+                         ['2'])
+        parent.pop(-1)
+        self.assertEqual([c.metavalue for c in parent.findChildren('A')],
+                         ['0'])
+
     def test_uuid(self):
         ds = AlignmentSet()
         old = ds.uuid
@@ -9,7 +9,7 @@ import numpy as np
 
 from pbcore.io import openIndexedAlignmentFile
 from pbcore.io import (DataSet, SubreadSet, ReferenceSet, AlignmentSet,
-                       openDataSet, HdfSubreadSet,
+                       openDataSet, HdfSubreadSet, GmapReferenceSet,
                        openDataFile)
 import pbcore.data.datasets as data
 import pbcore.data as upstreamdata
@@ -155,6 +155,27 @@ class TestDataSetSplit(unittest.TestCase):
         obs = sorted([len(set(ds.index.holeNumber)) for ds in dss])
         self.assertListEqual(exp, obs)
 
+    def test_split_zmws_by_bases(self):
+        N_RECORDS = 177
+        ds1 = SubreadSet(data.getXml(10), data.getXml(13))
+        self.assertEqual(len(ds1), N_RECORDS)
+        zmwBases = {}
+        for rec in ds1.index:
+            key = (rec.qId, rec.holeNumber)
+            zmwBases[key] = zmwBases.get(key, 0) + rec.qEnd - rec.qStart
+        dss = ds1.split(chunks=4, targetSize=1, zmws=True, byBases=True)
+        self.assertEqual(len(dss), 4)
+        self.assertEqual(sum(len(list(ds_)) for ds_ in dss), N_RECORDS)
+        self.assertEqual(sum(len(ds_) for ds_ in dss), N_RECORDS)
+        self.assertEqual(sum(ds_.totalLength for ds_ in dss),
+                         ds1.totalLength)
+        for ds_ in dss:
+            self.assertEqual(ds_.totalLength,
+                             sum(ds_.index.qEnd - ds_.index.qStart))
+            # each chunk is within a ZMW of the target:
+            self.assertTrue(abs(ds_.totalLength - ds1.totalLength / 4.) <=
+                            max(zmwBases.values()))
+
     #@unittest.skipUnless(os.path.isdir("/pbi/dept/secondary/siv/testdata"),
     #                     "Missing testadata directory")
     @unittest.skip("Too expensive")
@@ -691,6 +712,54 @@ class TestDataSetSplit(unittest.TestCase):
                                          ('E.faecalis.2', 100, 299)])
 
 
+    def test_vectorized_record_counts(self):
+        ds = AlignmentSet(data.getXml(8))
+        refCounts = ds._referenceCounts()
+        self.assertEqual(sorted(refCounts),
+                         sorted(set(ds.tid2rname[tId] for tId in ds.tId)))
+        for name, (count, bases) in refCounts.items():
+            self.assertEqual(count, ds.countRecords(name))
+            reads = ds._indexReadsInReference(name)
+            self.assertEqual(bases, sum(reads.tEnd - reads.tStart))
+        windows = [(name, start, start + 300)
+                   for name in sorted(refCounts)[:5]
+                   for start in (0, 50, 500, 1000, 1500)]
+        windows.append(('not_a_reference', 0, 1000))
+        self.assertEqual(ds._windowCounts(windows),
+                         [ds.countRecords(*window) for window in windows[:-1]]
+                         + [0])
+
+    def test_split_contigs_by_coverage(self):
+        ds = AlignmentSet(data.getXml(8))
+        index = ds.index
+        tStart = index.tStart.astype(np.int64)
+        tEnd = index.tEnd.astype(np.int64)
+        total = np.sum(tEnd - tStart)
+        def alignedBases(chunk):
+            bases = 0
+            for rname, start, end in chunk:
+                sel = ds.tId == ds.refIds[rname]
+                bases += np.clip(np.minimum(tEnd[sel], end) -
+                                 np.maximum(tStart[sel], start), 0,
+                                 None).sum()
+            return bases
+        for chunks in (1, 4, 30):
+            windows = ds._coverageWindows(chunks)
+            self.assertEqual(len(windows), chunks)
+            bases = [alignedBases(chunk) for chunk in windows]
+            self.assertEqual(sum(bases), total)
+            for size in bases:
+                self.assertTrue(abs(size - total / chunks) < 50)
+        dss = ds.split(contigs=True, chunks=4, byCoverage=True)
+        self.assertEqual(len(dss), 4)
+        rname, start, end = ds._coverageWindows(4)[1][0]
+        self.assertEqual(
+            str(dss[1].filters).split(' OR ')[0],
+            '( rname = {r} AND tstart < {e} AND tend > {s} )'.format(
+                r=rname, s=start, e=end))
+        # reads spanning a cut are in both chunks:
+        self.assertTrue(sum(d.numRecords for d in dss) >= ds.numRecords)
+
     @unittest.skip("Too expensive")
     def test_huge_zmw_split(self):
         human = ('/pbi/dept/secondary/siv/testdata/SA3-DS/'
@@ -707,6 +776,84 @@ class TestDataSetSplit(unittest.TestCase):
         self.assertEqual(len(chunks), 2)
         chunks[0].write(fn)
 
+    def test_split_copy_on_write(self):
+        sset = SubreadSet(data.getXml(10))
+        sset.loadMetadata(SubreadSet(data.getSubreadSet(),
+                                     skipMissing=True).metadata)
+        self.assertTrue(sset.metadata.collections)
+        collections = sset._metadata.getV('children', 'Collections')
+        chunks = sset.split(chunks=2, zmws=True)
+        self.assertEqual(len(chunks), 2)
+        # unmodified metadata and resources are shared, not copied:
+        for chunk in chunks:
+            self.assertTrue(
+                chunk._metadata.getV('children', 'Collections') is
+                collections)
+            self.assertTrue(chunk._externalResources.record['children'][0] is
+                            sset._externalResources.record['children'][0])
+        # counts are not:
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(sset))
+        self.assertEqual(sset.numRecords, 92)
+        # reading (and updating the counts) doesn't unshare:
+        for chunk in chunks:
+            chunk.updateCounts()
+            self.assertTrue(chunk.metadata.numRecords > 0)
+            self.assertTrue(chunk.metadata.collections[0].wellSample.name)
+            self.assertTrue(chunk.externalResources[0].resourceId)
+            self.assertTrue(chunk.metadata.getV('children', 'Collections') is
+                            collections)
+            self.assertTrue(chunk.externalResources.record['children'][0] is
+                            sset.externalResources.record['children'][0])
+        # writing doesn't unshare:
+        fn = tempfile.NamedTemporaryFile(suffix=".subreadset.xml").name
+        chunks[0].write(fn, validate=False)
+        self.assertTrue(chunks[0]._metadata.getV('children', 'Collections')
+                        is collections)
+        self.assertEqual(len(SubreadSet(fn)), len(chunks[0]))
+
+        # modifications are private to the copy:
+        wellSample = chunks[0].metadata.collections[0].wellSample
+        chunks[0].metadata.collections[0].wellSample.name = 'chunk0'
+        # (wrappers handed out earlier follow the unshared records)
+        self.assertEqual(wellSample.name, 'chunk0')
+        self.assertTrue(chunks[1].metadata.getV('children', 'Collections') is
+                        collections)
+        self.assertNotEqual(sset.metadata.collections[0].wellSample.name,
+                            'chunk0')
+        self.assertNotEqual(chunks[1].metadata.collections[0].wellSample.name,
+                            'chunk0')
+        resId = sset.externalResources[0].resourceId
+        chunks[1].makePathsRelative(os.path.dirname(fn))
+        self.assertNotEqual(chunks[1].externalResources[0].resourceId, resId)
+        self.assertEqual(sset.externalResources[0].resourceId, resId)
+        self.assertEqual(chunks[0].externalResources[0].resourceId, resId)
+
+    def test_copy_resources_independent(self):
+        sset = SubreadSet(data.getXml(10))
+        resId = sset.externalResources[0].resourceId
+        nIndices = len(sset.externalResources[0].indices)
+        copied = sset.copy()
+        copied.externalResources[0].resourceId = 'changed.bam'
+        copied.externalResources[0].addIndices(['changed.bam.pbi'])
+        self.assertEqual(copied.externalResources[0].resourceId,
+                         'changed.bam')
+        self.assertEqual(sset.externalResources[0].resourceId, resId)
+        self.assertEqual(len(sset.externalResources[0].indices), nIndices)
+        # and the other way around:
+        copied = sset.copy()
+        sset.externalResources[0].addIndices(['other.bam.pbi'])
+        self.assertEqual(len(copied.externalResources[0].indices), nIndices)
+
+        gmap = GmapReferenceSet(
+            ReferenceSet(data.getXml(9)).toExternalFiles()[0])
+        gmap.gmap = '/path/to/gmap_db'
+        copied = gmap.copy()
+        copied.gmap = '/path/to/other_gmap_db'
+        copied.gmap.name = 'other'
+        self.assertEqual(copied.gmap.resourceId, '/path/to/other_gmap_db')
+        self.assertEqual(gmap.gmap.resourceId, '/path/to/gmap_db')
+        self.assertNotEqual(gmap.gmap.name, 'other')
+
     def test_contigset_split(self):
         ref = ReferenceSet(data.getXml(9))
         exp_n_contigs = len(ref)
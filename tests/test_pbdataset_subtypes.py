@@ -11,12 +11,16 @@ import uuid
 
 from pbcore.util.Process import backticks
 from pbcore.io.dataset.utils import _infixFname, consolidateXml
+from pbcore.io.FastaIO import writeFastaIndex
+from pbcore.io.FastqIO import writeFastqIndex
 from pbcore.io import (SubreadSet, ConsensusReadSet,
                        ReferenceSet, ContigSet, AlignmentSet, BarcodeSet,
                        FastaReader, FastaWriter, IndexedFastaReader,
                        HdfSubreadSet, ConsensusAlignmentSet,
-                       openDataFile, FastqReader,
-                       GmapReferenceSet, TranscriptSet)
+                       openDataFile, FastqReader, FastqWriter,
+                       IndexedFastqReader, GmapReferenceSet, TranscriptSet,
+                       openDataSet)
+from pbcore.io.dataset.DataSetMembers import BarcodeSetMetadata
 import pbcore.data as upstreamData
 import pbcore.data.datasets as data
 from pbcore.io.dataset.DataSetValidator import validateXml
@@ -660,6 +664,147 @@ class TestDataSet(unittest.TestCase):
         # XXX not possible, fastq files can't be indexed:
         #self.assertEqual(len(cset), sum(1 for _ in cset))
 
+    def test_indexed_fastq(self):
+        fq_out = tempfile.NamedTemporaryFile(suffix=".fastq").name
+        with FastqWriter(fq_out) as w:
+            for i in range(10):
+                w.writeRecord("read{i} comment".format(i=i),
+                              "ACGT" * (i + 1), [i] * 4 * (i + 1))
+        cset = ContigSet(fq_out)
+        self.assertFalse(cset.isIndexed)
+        cset.induceIndices()
+        self.assertTrue(os.path.exists(fq_out + ".fai"))
+        cset = ContigSet(fq_out)
+        self.assertTrue(cset.isIndexed)
+        self.assertTrue(isinstance(cset.resourceReaders()[0],
+                                   IndexedFastqReader))
+        self.assertEqual(len(cset), 10)
+        contig = cset.get_contig("read3")
+        self.assertEqual(contig.comment, "comment")
+        self.assertEqual(contig.sequence[:], "ACGT" * 4)
+        self.assertEqual(contig.quality.tolist(), [3] * 16)
+        cfq_out = tempfile.NamedTemporaryFile(suffix=".fastq").name
+        cset.filters.addRequirement(length=[('>', 20)])
+        cset.consolidate(cfq_out)
+        self.assertTrue(os.path.exists(cfq_out + ".fai"))
+        self.assertEqual(len(cset), 5)
+        self.assertEqual(sorted(c.id for c in FastqReader(cfq_out)),
+                         sorted(c.id for c in cset))
+
+    def test_contigset_consolidate_sharded(self):
+        outdir = tempfile.mkdtemp(suffix="dataset-unittest")
+        inFas = os.path.join(outdir, 'windows.fasta')
+        seqs = {}
+        with FastaWriter(inFas) as writer:
+            for i in range(6):
+                seq = "ACGTTGCA" * (20 + 7 * i)
+                seqs["contig{i}".format(i=i)] = seq
+                # out of order windows, split over short and long lines:
+                mid = len(seq) // 3
+                writer.writeRecord("contig{i}_{s}_{e} c{i}".format(
+                    i=i, s=mid, e=len(seq)), seq[mid:])
+                writer.writeRecord("contig{i}_0_{e} c{i}".format(
+                    i=i, e=mid), seq[:mid])
+            writer.writeRecord("single", "ACGT" * 3)
+        seqs["single"] = "ACGT" * 3
+        cset = ContigSet(inFas)
+        cset.induceIndices()
+        outFas = os.path.join(outdir, 'consolidated.fasta')
+        cset.consolidate(outFas, numFiles=3)
+        fnames = [_infixFname(outFas, str(i)) for i in range(3)]
+        self.assertEqual(cset.toExternalFiles(), fnames)
+        self.assertTrue(cset.isIndexed)
+        self.assertEqual(len(cset), 7)
+        self.assertEqual(cset.totalLength, sum(map(len, seqs.values())))
+        for fname in fnames:
+            # the same file and index FastaWriter and writeFastaIndex make:
+            with open(fname + ".fai") as f:
+                fai = f.read()
+            expFas = os.path.join(outdir, 'expected.fasta')
+            with FastaWriter(expFas) as writer:
+                for contig in FastaReader(fname):
+                    self.assertEqual(contig.sequence, seqs[contig.id])
+                    if contig.id != "single":
+                        self.assertEqual(contig.comment,
+                                         contig.id.replace("contig", "c"))
+                    writer.writeRecord(contig)
+            with open(fname) as f, open(expFas) as g:
+                self.assertEqual(f.read(), g.read())
+            writeFastaIndex(expFas)
+            with open(expFas + ".fai") as f:
+                self.assertEqual(fai, f.read())
+
+        fq_out = os.path.join(outdir, 'windows.fastq')
+        with FastqWriter(fq_out) as w:
+            w.writeRecord("read_5_9", "ACGT", [5, 6, 7, 8])
+            w.writeRecord("read_0_5 c", "TTTTT", [0, 1, 2, 3, 4])
+            w.writeRecord("empty", "", [])
+        cset = ContigSet(fq_out)
+        cset.induceIndices()
+        cfq_out = os.path.join(outdir, 'consolidated.fastq')
+        cset.consolidate(cfq_out)
+        with open(cfq_out + ".fai") as f:
+            fai = f.read()
+        self.assertEqual(fai, open(writeFastqIndex(cfq_out)).read())
+        contigs = {c.id: c for c in FastqReader(cfq_out)}
+        self.assertEqual(contigs["read"].sequence, "TTTTTACGT")
+        self.assertEqual(contigs["read"].quality.tolist(), range(9))
+        self.assertEqual(contigs["read"].comment, "c")
+        self.assertEqual(contigs["empty"].sequence, "")
+
+    def test_contigset_index_lookups(self):
+        fa_out = tempfile.NamedTemporaryFile(suffix=".fasta").name
+        with FastaWriter(fa_out) as w:
+            for i in range(12):
+                w.writeRecord("contig{i} comment{i}".format(i=i),
+                              "ACGT" * (i + 1))
+        cset = ContigSet(fa_out)
+        cset.induceIndices()
+        cset = ContigSet(fa_out)
+        self.assertTrue(cset.isIndexed)
+        self.assertEqual(cset.contigNames,
+                         sorted("contig{i}".format(i=i) for i in range(12)))
+        # names, lengths and lookups don't read the other FASTA headers:
+        self.assertEqual(cset.totalLength, 4 * sum(range(1, 13)))
+        self.assertEqual(cset.resourceReaders()[0].fai._headers, {})
+        contig = cset.get_contig("contig3")
+        self.assertEqual(cset.resourceReaders()[0].fai._headers.keys(), [3])
+        self.assertEqual(contig.sequence[:], "ACGT" * 4)
+        self.assertEqual(contig.comment, "comment3")
+        self.assertEqual(cset.get_contig("contig3 comment3").id, "contig3")
+        self.assertEqual(cset["contig5"].id, "contig5")
+        self.assertIsNone(cset.get_contig("contig3 comment4"))
+        self.assertIsNone(cset.get_contig("contig99"))
+        chunks = cset.split(5)
+        self.assertEqual(len(chunks), 5)
+        self.assertEqual(sum(c.numRecords for c in chunks), 12)
+        self.assertEqual(sum(c.totalLength for c in chunks), cset.totalLength)
+        for chunk in chunks:
+            names = chunk.contigNames
+            self.assertEqual(chunk.numRecords, len(names))
+            self.assertEqual(chunk.totalLength,
+                             sum(len(c) for c in chunk.contigs))
+            chunk.updateCounts()
+            self.assertEqual(chunk.numRecords, len(names))
+            self.assertEqual(sorted(c.id for c in chunk.contigs), names)
+            self.assertIsNone(chunk.get_contig(
+                [n for n in cset.contigNames if n not in names][0]))
+        cset.filters.addRequirement(length=[('>', 24)])
+        cset.updateCounts()
+        self.assertEqual(cset.contigNames,
+                         sorted("contig{i}".format(i=i) for i in range(6, 12)))
+        self.assertIsNone(cset.get_contig("contig3"))
+        # the index still carries the header and comment columns:
+        self.assertEqual(list(cset.index.dtype.names),
+                         ['id', 'comment', 'header', 'length', 'offset',
+                          'lineWidth', 'stride'])
+        self.assertEqual(list(cset.index.header),
+                         ["contig{i} comment{i}".format(i=i)
+                          for i in range(6, 12)])
+        self.assertEqual(list(cset.index.comment),
+                         ["comment{i}".format(i=i) for i in range(6, 12)])
+        self.assertEqual(cset[-1].id, "contig11")
+
     @skip_if_no_internal_data
     def test_fastq_consolidate(self):
         fn = ('/pbi/dept/secondary/siv/testdata/SA3-RS/'
@@ -1039,6 +1184,19 @@ class TestDataSet(unittest.TestCase):
         ds_out = tempfile.NamedTemporaryFile(suffix=".barcodeset.xml").name
         ds.write(ds_out)
 
+    def test_barcodeset_metadata(self):
+        ds = BarcodeSet()
+        self.assertTrue(isinstance(ds.metadata, BarcodeSetMetadata))
+        self.assertEqual(ds.metadata.barcodeConstruction, '')
+        ds = openDataSet(data.getXml(1), skipMissing=True)
+        self.assertTrue(isinstance(ds, BarcodeSet))
+        self.assertTrue(isinstance(ds.metadata, BarcodeSetMetadata))
+        self.assertEqual(ds.metadata.barcodeConstruction, 'paired')
+        self.assertEqual(ds.numRecords, 30)
+        chunk = ds.copy()
+        self.assertTrue(isinstance(chunk.metadata, BarcodeSetMetadata))
+        self.assertEqual(chunk.metadata.barcodeConstruction, 'paired')
+
     def test_merged_contigset(self):
         fn = tempfile.NamedTemporaryFile(suffix=".contigset.xml").name
         with ContigSet(upstreamData.getLambdaFasta(),
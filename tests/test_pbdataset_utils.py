@@ -1,13 +1,18 @@
 
 import logging
+import os
 import tempfile
 import unittest
 
 from pbcore.io.dataset.DataSetMetaTypes import dsIdToSuffix
+from pbcore.io.dataset.DataSetUtils import (filesExist, fileExists,
+                                            clearStatCache)
 from pbcore.io import (DataSetMetaTypes, divideKeys,
-                       SubreadSet, getDataSetUuid, getDataSetMetaType)
+                       SubreadSet, AlignmentSet, getDataSetUuid,
+                       getDataSetMetaType, getDataSetHeader)
 
 import pbcore.data as upstreamdata
+import pbcore.data.datasets as data
 
 from utils import _pbtestdata, _check_constools, _internal_data
 
@@ -39,6 +44,45 @@ class TestDataSetUtils(unittest.TestCase):
         meta_type = getDataSetMetaType(ds_file)
         self.assertEqual(meta_type, "PacBio.DataSet.SubreadSet")
 
+    def test_get_dataset_header(self):
+        ds = SubreadSet(upstreamdata.getUnalignedBam(), strict=True)
+        ds_file = tempfile.NamedTemporaryFile(suffix=".subreadset.xml").name
+        ds.write(ds_file)
+        header = getDataSetHeader(ds_file)
+        self.assertEqual(header, {"UniqueId": ds.uuid,
+                                  "MetaType": "PacBio.DataSet.SubreadSet",
+                                  "NumRecords": 117,
+                                  "TotalLength": ds.totalLength})
+        # subdataset counts are ignored:
+        aln = AlignmentSet(data.getXml(8), data.getXml(11))
+        ds_file = tempfile.NamedTemporaryFile(suffix=".alignmentset.xml").name
+        aln.write(ds_file)
+        header = getDataSetHeader(ds_file)
+        self.assertEqual(header["NumRecords"], aln.numRecords)
+        self.assertEqual(header["TotalLength"], aln.totalLength)
+        with open(ds_file, "w") as out:
+            out.write("hello world!")
+        self.assertEqual(getDataSetHeader(ds_file), None)
+
+    def test_stat_cache(self):
+        fnames = [tempfile.NamedTemporaryFile(suffix=".bam",
+                                              delete=False).name
+                  for _ in range(4)]
+        missing = fnames[0] + '.missing'
+        self.assertEqual(filesExist(fnames + [missing, fnames[0]]),
+                         [True] * 4 + [False, True])
+        # found files are trusted until the ttl expires:
+        os.remove(fnames[0])
+        self.assertTrue(fileExists(fnames[0]))
+        self.assertFalse(fileExists(fnames[0], ttl=0))
+        # missing files are never cached:
+        with open(missing, 'w'):
+            pass
+        self.assertTrue(fileExists(missing))
+        clearStatCache()
+        os.remove(missing)
+        self.assertFalse(fileExists(missing))
+
     def test_dsIdToSuffix(self):
         suffixes = ['subreadset.xml', 'hdfsubreadset.xml', 'alignmentset.xml',
                     'barcodeset.xml', 'consensusreadset.xml',
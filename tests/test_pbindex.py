@@ -64,3 +64,18 @@ class TestPbIndex(unittest.TestCase):
                 unique_zmws.add(zmws[0])
                 n_indexed_zmws += 1
         self.assertEqual(len(unique_zmws), n_indexed_zmws)
+
+    def test_pbindex_streaming_mapped(self):
+        """
+        Coordinate sorted mapped indices have a per-reference section that
+        chunks have to step over.
+        """
+        fname = pbcore.data.getBamAndCmpH5()[0] + ".pbi"
+        full = PacBioBamIndex(fname)
+        self.assertTrue(full.hasCoordinateSortedInfo)
+        streamed = StreamingBamIndex(fname, 20)
+        self.assertTrue(streamed.nchunks > 1)
+        chunks = [chunk for chunk in streamed]
+        for attr in ["qId", "holeNumber", "tId", "tStart", "aEnd"]:
+            combined = np.concatenate([getattr(c, attr) for c in chunks])
+            self.assertTrue(all(combined == getattr(full, attr)))